@@ -0,0 +1,35 @@
+import streamlit as st
+import Instrumentation
+
+
+def show_instrumentation_panel(recent_runs=50):
+    # Sidebar with the stage timings of the recent runs, for the admins only
+    with st.sidebar:
+        st.header('Instrumentation', divider='gray')
+        recording = st.toggle('Record stage timings', value=Instrumentation.enabled,
+                              help='Applies to every session of this server')
+        if recording != Instrumentation.enabled:
+            Instrumentation.enable(recording)
+
+        stage_records = Instrumentation.records()
+        if not stage_records:
+            st.caption('Nothing recorded yet')
+            return
+        runs = set(sorted({record['run'] for record in stage_records})[-recent_runs:])
+        stage_records = [record for record in stage_records if record['run'] in runs]
+
+        summary = Instrumentation.summary(stage_records)
+        st.dataframe(summary.style.format('{:.3f}', subset=['Total (s)', 'Mean (s)', 'p95 (s)', 'Memory (MB)']))
+
+        import plotly.graph_objects as go
+
+        selected_stage = st.selectbox('Stage', summary.index)
+        seconds = [record['seconds'] for record in stage_records if record['stage'] == selected_stage]
+        fig = go.Figure(data=[go.Histogram(x=seconds)])
+        fig.update_layout(xaxis_title='Seconds', yaxis_title='Calls', height=250, margin=dict(l=0, r=0, t=10, b=0))
+        st.plotly_chart(fig)
+
+        st.download_button('Export as JSON lines', Instrumentation.to_jsonl(), file_name='stages.jsonl',
+                           mime='application/jsonl')
+        if st.button('Clear'):
+            Instrumentation.clear()
@@ -0,0 +1,30 @@
+import os
+import pickle
+
+# Everything the dashboard draws before it touches the journal, the bucket or the price store. Each ingestion publishes
+# a new file in one atomic replace and never modifies it, so a reader always gets one consistent version
+APP_STATE_FILE = 'app_state.pkl'
+
+
+def app_state_path(data_dir):
+    return os.path.join(data_dir, APP_STATE_FILE)
+
+
+def read_app_state(data_dir):
+    # {'version', 'last_date', 'portfolio', 'tracking', 'exposure', 'source'} as last written, or None before the
+    # first write. source is the PortfolioJournal.source the state was built from
+    path = app_state_path(data_dir)
+    if not os.path.exists(path):
+        return None
+    with open(path, 'rb') as file:
+        return pickle.load(file)
+
+
+def write_app_state(data_dir, last_date, portfolio, tracking, version=0, exposure=None, source=None):
+    app_state = {'version': version, 'last_date': last_date, 'portfolio': portfolio, 'tracking': tracking,
+                 'exposure': exposure, 'source': source}
+    temporary_path = f'{app_state_path(data_dir)}.{os.getpid()}.tmp'
+    with open(temporary_path, 'wb') as file:
+        pickle.dump(app_state, file, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(temporary_path, app_state_path(data_dir))
+    return app_state
@@ -0,0 +1,42 @@
+import numpy as np
+import pandas as pd
+
+
+def downsample(dataframe, max_points=500, series_name='Series', value_name='Value'):
+    # Min/max bucketing of every column of a dates x series dataframe to about max_points points per series.
+    # Each bucket keeps the lowest and highest value of every series, plus its first and last valid day, so peaks and
+    # drops survive. Returns a long dataframe (Date, series_name, value_name) for st.line_chart and the number of
+    # points left out
+    values = dataframe.to_numpy()
+    if values.dtype != np.float32:
+        values = values.astype(np.float64, copy=False)
+    n_rows, n_columns = values.shape
+    valid = ~np.isnan(values)
+    keep = valid.copy()
+    if n_rows > max_points:
+        keep[:] = False
+        n_buckets = max(1, max_points // 2)
+        bucket_size = -(-n_rows // n_buckets)
+        padded = np.full((n_buckets * bucket_size, n_columns), np.nan, dtype=values.dtype)
+        padded[:n_rows] = values
+        buckets = padded.reshape(n_buckets, bucket_size, n_columns)
+        starts = (np.arange(n_buckets) * bucket_size)[:, None]
+        columns = np.broadcast_to(np.arange(n_columns), (n_buckets, n_columns))
+        for extreme in (np.where(np.isnan(buckets), np.inf, buckets).argmin(axis=1),
+                        np.where(np.isnan(buckets), -np.inf, buckets).argmax(axis=1)):
+            rows = np.minimum(starts + extreme, n_rows - 1)
+            keep[rows, columns] = True
+        # First and last valid value of every series
+        all_columns = np.arange(n_columns)
+        keep[valid.argmax(axis=0), all_columns] = True
+        keep[n_rows - 1 - valid[::-1].argmax(axis=0), all_columns] = True
+        keep &= valid
+
+    # Long format, one series after the other in date order
+    columns, rows = np.nonzero(keep.T)
+    long_dataframe = pd.DataFrame({
+        'Date': dataframe.index[rows],
+        series_name: np.asarray(dataframe.columns)[columns],
+        value_name: values[rows, columns],
+    })
+    return long_dataframe, int(valid.sum() - keep.sum())
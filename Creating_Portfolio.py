@@ -1,8 +1,10 @@
 import pandas as pd
 from Telegram_Bot import sold_stocks, bought_stocks
-
+from Portfolio_State import PortfolioState
+from Instrumentation import timed
 
 # Function to transform csv files in desired dataframes
+@timed('excel_to_dataframe', rows=len)
 def excel_to_dataframe(file_name):
     # Transform csv in dataframe
     dataframe = pd.read_excel(file_name, engine='openpyxl')
@@ -21,6 +23,7 @@ def excel_to_dataframe(file_name):
 
 
 # Function to create the portfolio dataframe
+@timed('create_portfolio', rows=len)
 def create_portfolio(initial_dataframe, allocation, date):
     portfolio = pd.DataFrame(index=initial_dataframe.index)
     portfolio['Sector'] = initial_dataframe['Sector']
@@ -53,79 +56,9 @@ def create_portfolio(initial_dataframe, allocation, date):
     return portfolio
 
 
+@timed('update_portfolio', rows=len)
 def update_portfolio(portfolio_dataframe, final_dataframe, date):
-    # Align final dataframe
-    final_dataframe.reindex(portfolio_dataframe.index)
-    sold = ~portfolio_dataframe.index.isin(final_dataframe.index)
-    portfolio_dataframe.loc[sold & portfolio_dataframe['Sell Date'].isnull(), 'Sell Date'] = date
-    sold_today = portfolio_dataframe['Sell Date'] == date
-    # Send Telegram message if there are sold stocks
-    if not portfolio_dataframe.loc[sold_today].empty:
-        sold_stocks(portfolio_dataframe.loc[sold_today])
-    for stock_name in portfolio_dataframe.loc[sold_today].index:
-        base_name = stock_name.split('.')[0]
-        count = 1
-        new_name = f"{base_name}.{count}"
-        while new_name in portfolio_dataframe.index:
-            count += 1
-            new_name = f"{base_name}.{count}"
-        portfolio_dataframe.rename(index={stock_name: new_name}, inplace=True)
-    sold = pd.Series(sold, index=portfolio_dataframe.index)
-    sold_dataframe = portfolio_dataframe[sold]
-
-    portfolio_dataframe = portfolio_dataframe[~sold]
-    # Update Pricing
-    portfolio_dataframe['Yesterday Price'] = portfolio_dataframe['Today Price']
-    portfolio_dataframe['Today Price'] = final_dataframe['Price']
-    # Check if any stocks were sold
-    portfolio_dataframe['Days Holding'] += 1
-    # Update Daily Count
-    portfolio_dataframe.loc[~portfolio_dataframe['Second Entry'], 'Days Since First Entry'] += 1
-    portfolio_dataframe.loc[
-        (portfolio_dataframe['Second Entry']) & (~portfolio_dataframe['Third Entry']), 'Days Since Second Entry'] += 1
-
-    # Second Entry Action
-    second_entry = (~portfolio_dataframe['Second Entry']) & ((portfolio_dataframe['Days Since First Entry'] == 90) | (
-            portfolio_dataframe['Today Price'] > portfolio_dataframe['First Entry Price'] * 1.2))
-    portfolio_dataframe.loc[second_entry, 'Second Entry'] = True
-    portfolio_dataframe.loc[second_entry, 'Second Entry Price'] = portfolio_dataframe['Today Price']
-    portfolio_dataframe.loc[second_entry, 'Investment'] += 1500
-    portfolio_dataframe.loc[second_entry, 'Quantity'] += 1500 / portfolio_dataframe['Second Entry Price']
-
-    # Third Entry Action
-    third_entry = (portfolio_dataframe['Second Entry']) & (~portfolio_dataframe['Third Entry']) & (
-            (portfolio_dataframe['Days Since Second Entry'] == 90) | (
-            portfolio_dataframe['Today Price'] > portfolio_dataframe['Second Entry Price'] * 1.2))
-    portfolio_dataframe.loc[third_entry, 'Third Entry'] = True
-    portfolio_dataframe.loc[third_entry, 'Third Entry Price'] = portfolio_dataframe['Today Price']
-    portfolio_dataframe.loc[third_entry, 'Investment'] += 1500
-    portfolio_dataframe.loc[third_entry, 'Quantity'] += 1500 / portfolio_dataframe['Third Entry Price']
-
-    # Update Allocation and Value
-    portfolio_dataframe['Total Amount'] = portfolio_dataframe['Quantity'] * portfolio_dataframe['Today Price']
-    portfolio_dataframe['Allocation'] = portfolio_dataframe['Total Amount'] / portfolio_dataframe['Total Amount'].sum()
-
-    portfolio_dataframe['ROI'] = (portfolio_dataframe['Total Amount'] / portfolio_dataframe[
-        'Investment'] - 1) * 100
-    # Add new stocks that were not in the portfolio before
-    new_stocks = final_dataframe.index.difference(portfolio_dataframe.index)
-    if not new_stocks.empty:
-        # Create portfolio dataframe based on the new stocks
-        new_rows = create_portfolio(final_dataframe.loc[new_stocks], 0.02, date)
-        # Send Telegram message with the new stocks
-        bought_stocks(new_rows)
-        # Add new rows to the portfolio dataframe
-        portfolio_dataframe = pd.concat([portfolio_dataframe, new_rows])
-
-    # Calculating the Overdraft
-    if portfolio_dataframe['Total Amount'].sum() > 100000:
-        scaling_factor = 100000 / portfolio_dataframe['Total Amount'].sum()
-        portfolio_dataframe['Value'] = portfolio_dataframe['Total Amount'] * scaling_factor
-        portfolio_dataframe['Overdraft'] = portfolio_dataframe['Total Amount'] - portfolio_dataframe['Value']
-    else:
-        portfolio_dataframe['Value'] = portfolio_dataframe['Total Amount']
-        portfolio_dataframe['Overdraft'] = 0
-
-    portfolio_dataframe = pd.concat([portfolio_dataframe, sold_dataframe])
-
-    return portfolio_dataframe
+    # Load the positions in the array-backed state, apply the day and turn it back into the dataframe layout
+    portfolio_state = PortfolioState.from_dataframe(portfolio_dataframe)
+    portfolio_state.update(final_dataframe, date, on_sold=sold_stocks, on_bought=bought_stocks)
+    return portfolio_state.to_dataframe()
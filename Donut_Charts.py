@@ -1,29 +1,54 @@
+import numpy as np
+import pandas as pd
 import streamlit as st
-import plotly.graph_objects as go
 
+# Chart title of each categorical column
+TITLES = {'Sector': 'Market Sector', 'Market Cap': 'Market Capitalization'}
 
-def plot_charts(portfolio_dataframe):
-    # Create two columns
-    col1, col2 = st.columns(2)
 
-    # Prepare data for the donut chart
-    with col1:
-        grouped_by_sector = portfolio_dataframe.groupby('Sector')['Allocation'].sum()
-        labels_cap = grouped_by_sector.index
-        values_cap = grouped_by_sector.values
+def portfolio_exposure(portfolio_dataframe, date):
+    # Exposure of the open positions on one day, grouped from the portfolio dataframe, for app states published
+    # before the daily exposure was kept
+    open_positions = portfolio_dataframe[portfolio_dataframe['Sell Date'].isna()]
+    return {name: open_positions.groupby(name, observed=True)['Total Amount'].sum().to_frame(pd.Timestamp(date)).T
+            for name in TITLES}
 
-        fig_sector = go.Figure(data=[go.Pie(labels=labels_cap, values=values_cap, hole=.3)])
 
-        st.header('Market Sector Distribution', divider='gray')
-        st.plotly_chart(fig_sector)
+def plot_charts(exposure):
+    import plotly.graph_objects as go
 
-    # Prepare data for the donut chart
-    with col2:
-        grouped_by_cap = portfolio_dataframe.groupby('Market Cap')['Allocation'].sum()
-        labels_cap = grouped_by_cap.index
-        values_cap = grouped_by_cap.values
+    # Create two columns, one donut of the latest day per column
+    for column, (name, title) in zip(st.columns(2), TITLES.items()):
+        with column:
+            latest = exposure[name].iloc[-1] if len(exposure[name]) else pd.Series(dtype=np.float64)
+            latest = latest[latest > 0]
 
-        fig_cap = go.Figure(data=[go.Pie(labels=labels_cap, values=values_cap, hole=.3)])
+            fig = go.Figure(data=[go.Pie(labels=latest.index, values=latest.values, hole=.3)])
 
-        st.header('Market Capitalization Distribution', divider='gray')
-        st.plotly_chart(fig_cap)
+            st.header(f'{title} Distribution', divider='gray')
+            st.plotly_chart(fig)
+
+
+def plot_exposure_drift(exposure, from_date, to_date):
+    # Share of each sector or market cap in the open positions over a period, as a stacked area chart
+    import plotly.graph_objects as go
+
+    st.header('Exposure over Time', divider='gray')
+    name = st.radio('Exposure by', list(TITLES), horizontal=True)
+    frame = exposure[name]
+    dates = frame.index
+    first, last = dates.searchsorted(pd.Timestamp(from_date)), dates.searchsorted(pd.Timestamp(to_date), 'right')
+    values = frame.to_numpy()[first:last]
+    if not len(values):
+        st.caption('No exposure recorded in this period')
+        return
+    with np.errstate(divide='ignore', invalid='ignore'):
+        shares = values / values.sum(axis=1, keepdims=True) * 100
+
+    fig = go.Figure()
+    for position, category in enumerate(frame.columns):
+        if values[:, position].any():
+            fig.add_trace(go.Scatter(x=dates[first:last], y=shares[:, position], name=str(category), mode='lines',
+                                     stackgroup='exposure'))
+    fig.update_layout(yaxis_title='Share of the open positions (%)', yaxis_range=[0, 100])
+    st.plotly_chart(fig)
@@ -1,62 +1,114 @@
-import yfinance as yf
+import numpy as np
 import pandas as pd
-
-
-def get_ipo_date(ticker_symbol):
-    stock_data = yf.Ticker(ticker_symbol)
-    history = stock_data.history(period="max").tz_localize(None)
-    first_trading_date = history.index[0].date()
-
-    return first_trading_date
-
-
-def create_mean_cumulative_returns(portfolio_dataframe):
-    # Getting the tickers
-    tickers = portfolio_dataframe.index.tolist()
-    unique_tickers = list(set([ticker.split('.')[0] for ticker in tickers]))
+from Price_Store import PriceStore, shared_fetcher
+from Price_Panel import PricePanel
+from Instrumentation import stage
+
+# Indexes the portfolio is compared against
+INDEXES = ['^GSPC', '^IXIC', '^DJI']
+
+
+class ReturnIndex:
+    """Prefix sums of the daily log returns of every stock and index, from the first day all of them traded.
+
+    The growth between two days is exp(S[to] - S[from]), so any window is rebased to 0 at its first day from two
+    lookups instead of compounding its daily returns again. The sums are summed in float64 and kept as a float32
+    PricePanel, stocks first and indexes last, which can be saved and memory-mapped.
+    """
+
+    INDEX_NAMES = {"^DJI": "Dow Jones", "^IXIC": "NASDAQ", "^GSPC": "S&P 500"}
+
+    def __init__(self, close_prices=None, close_prices_indexes=None, sums=None, n_tickers=None):
+        if sums is None:
+            # Only the days with a price for every stock and index
+            close_prices = pd.concat([close_prices, close_prices_indexes], axis=1, join='inner').dropna()
+            n_tickers = len(close_prices.columns) - len(close_prices_indexes.columns)
+            log_returns = np.diff(np.log(close_prices.to_numpy(dtype=np.float64)), axis=0, prepend=np.nan)
+            log_returns[0] = 0
+            names = list(close_prices.columns[:n_tickers]) + [self.INDEX_NAMES.get(index, index)
+                                                               for index in close_prices_indexes.columns]
+            sums = PricePanel.from_frame(pd.DataFrame(np.cumsum(log_returns, axis=0), index=close_prices.index,
+                                                      columns=names))
+        self.sums = sums
+        self.tickers = sums.columns[:n_tickers]
+        self.indexes = sums.columns[n_tickers:]
+
+    @property
+    def dates(self):
+        return self.sums.dates
+
+    @property
+    def stock_sums(self):
+        return self.sums.values[:, :len(self.tickers)]
+
+    @property
+    def index_sums(self):
+        return self.sums.values[:, len(self.tickers):]
+
+    def save(self, directory):
+        # Saves the sums and maps them back from the file
+        self.sums = self.sums.save(directory, {'tickers': len(self.tickers)})
+        return self
+
+    @classmethod
+    def open(cls, directory):
+        sums, meta = PricePanel.open(directory)
+        return cls(sums=sums, n_tickers=meta['tickers']) if sums is not None else None
+
+    def window(self, from_date, to_date):
+        # Cumulative returns of the portfolio and the indexes between two dates, 0 on the first day of the window.
+        # The portfolio is an equal amount bought of every stock on that day, so it is the mean of their growths
+        first, last = self.sums.bounds(from_date, to_date)
+        dates = self.dates[first:last]
+        if first == last:
+            return pd.DataFrame(columns=['Portfolio'] + self.indexes, index=dates, dtype=np.float64)
+        index_sums = self.index_sums
+        index_returns = np.exp(index_sums[first:last] - index_sums[first], dtype=np.float64) - 1
+        if self.tickers:
+            # mean(exp(S[t] - S[from])) as one matrix-vector product over the window
+            stock_sums = self.stock_sums
+            weights = np.exp(-stock_sums[first], dtype=np.float64) / len(self.tickers)
+            portfolio_returns = np.exp(stock_sums[first:last], dtype=np.float64) @ weights - 1
+        else:
+            portfolio_returns = np.full(last - first, np.nan)
+        return pd.DataFrame(np.column_stack([portfolio_returns, index_returns]), index=dates,
+                            columns=['Portfolio'] + self.indexes)
+
+
+def create_return_index(portfolio_dataframe, price_store=None):
+    # Prices come from the local store, which only fetches what it does not have yet
+    if price_store is None:
+        price_store = PriceStore('data/prices', fetcher=shared_fetcher())
+
+    # Getting the tickers, all stocks and indexes are fetched together and failed tickers are left out
+    unique_tickers = portfolio_dataframe.index.unique().tolist()
+    with stage('price update', rows=len(unique_tickers) + len(INDEXES)):
+        price_store.update(unique_tickers + INDEXES)
+    unique_tickers = [ticker for ticker in unique_tickers if price_store.first_trade_date(ticker) is not None]
 
     # To get the largest time period possible in which all stocks were traded, get the latest IPO
-    latest_ipo = max([get_ipo_date(ticker) for ticker in unique_tickers])
+    latest_ipo = max([price_store.first_trade_date(ticker) for ticker in unique_tickers])
 
-    # Download stock data starting from the latest IPO date
-    data = yf.download(unique_tickers, start=latest_ipo)
-
-    # Extract the 'Close' prices
-    close_prices = data['Close']
+    # Stock data starting from the latest IPO date, the 'Close' prices
+    close_prices = price_store.closes(sorted(unique_tickers), start=latest_ipo)
 
     # Transpose the DataFrame so that tickers are the index and dates are columns
     returns = close_prices.T
 
-    # Calculate daily returns (percentage change in closing prices)
-    daily_returns = close_prices.pct_change().dropna()
-
-    # Calculate cumulative returns of the portfolio
-    cumulative_returns = (1 + daily_returns).cumprod() - 1
-
-    # Calculate the mean cumulative returns for all stocks in the portfolio
-    mean_cumulative_returns = cumulative_returns.mean(axis=1)
-
-    # Download index data
-    indexes = ['^GSPC', '^IXIC', '^DJI']
-    data_indexes = yf.download(indexes, start=latest_ipo)
+    # 'Close' prices for indexes
+    close_prices_indexes = price_store.closes(sorted(INDEXES), start=latest_ipo)
 
-    # Extract 'Close' prices for indexes
-    close_prices_indexes = data_indexes['Close']
+    with stage('return index', rows=len(unique_tickers)):
+        return_index = ReturnIndex(close_prices, close_prices_indexes)
 
-    # Calculate daily returns for indexes
-    daily_returns_indexes = close_prices_indexes.pct_change().dropna()
+    return returns, return_index
 
-    # Calculate cumulative returns for indexes
-    cumulative_returns_indexes = (1 + daily_returns_indexes).cumprod() - 1
 
-    # Combine cumulative returns of portfolio and indexes
-    mean_cumulative_returns.name = "Portfolio"
-    total_cumulative_returns = pd.concat([mean_cumulative_returns, cumulative_returns_indexes], axis=1)
+def create_mean_cumulative_returns(portfolio_dataframe, price_store=None):
+    returns, return_index = create_return_index(portfolio_dataframe, price_store)
 
-    # Rename index columns
-    total_cumulative_returns = total_cumulative_returns.rename(
-        columns={"^DJI": "Dow Jones", "^IXIC": "NASDAQ", "^GSPC": "S&P 500"}
-    )
+    # Cumulative returns of the portfolio and indexes over the whole period
+    total_cumulative_returns = return_index.window(return_index.dates[0], return_index.dates[-1])
 
     # Ensure 'Date' is the index name for Streamlit plotting
     total_cumulative_returns.index = total_cumulative_returns.index.date
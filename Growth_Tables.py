@@ -1,39 +1,81 @@
 import streamlit as st
+import numpy as np
 import pandas as pd
 
 
-def generate_tables(stock_dataframe):
-    # Criação de um DataFrame vazio
-    growth_data = []
+def window_growth(prices):
+    # Growth (%) of every column of a dates x tickers array, from its first to its last valid price in the window.
+    # Columns without two valid prices, or starting at 0, get NaN
+    valid = ~np.isnan(prices)
+    n_rows = prices.shape[0]
+    if n_rows == 0:
+        return np.full(prices.shape[1], np.nan)
+    first = valid.argmax(axis=0)
+    last = n_rows - 1 - valid[::-1].argmax(axis=0)
+    columns = np.arange(prices.shape[1])
+    first_price = prices[first, columns].astype(np.float64)
+    last_price = prices[last, columns].astype(np.float64)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        growth = (last_price - first_price) / first_price * 100
+    growth[~valid.any(axis=0) | (first == last) | (first_price == 0)] = np.nan
+    return growth
 
-    for ticker in stock_dataframe.columns[1:]:
-        first_price = stock_dataframe[ticker].iloc[0]
-        last_price = stock_dataframe[ticker].iloc[-1]
 
-        if not pd.isna(first_price) and not pd.isna(last_price) and first_price != 0:
-            growth = (last_price - first_price) / first_price * 100
-            # Em vez de append, armazenamos os dados em uma lista
-            growth_data.append({'Stock': ticker, 'Growth (%)': growth})
+def rank_growth(tickers, growth, k=10):
+    # Top and bottom k tickers by growth, picked with a partial selection instead of sorting every ticker
+    tickers = np.asarray(tickers)
+    growth = np.asarray(growth, dtype=np.float64)
+    ranked = np.flatnonzero(~np.isnan(growth))
+    k = min(k, len(ranked))
 
-    # Agora criamos o DataFrame a partir da lista
-    growth_df = pd.DataFrame(growth_data)
+    def table(order):
+        growth_df = pd.DataFrame({'Stock': tickers[order], 'Growth (%)': growth[order]})
+        growth_df.index = growth_df.index + 1
+        return growth_df
 
-    # Classificar as 10 ações com maior crescimento
-    top_10_growth = growth_df.sort_values(by='Growth (%)', ascending=False).head(10).reset_index(drop=True)
-    top_10_growth.index = top_10_growth.index + 1
+    if k == 0:
+        return table(ranked), table(ranked)
+    values = growth[ranked]
+    top = ranked[np.argpartition(-values, k - 1)[:k]]
+    top = top[np.argsort(-growth[top], kind='stable')]
+    worst = ranked[np.argpartition(values, k - 1)[:k]]
+    worst = worst[np.argsort(growth[worst], kind='stable')]
+    return table(top), table(worst)
 
-    # Classificar as 10 ações com pior desempenho
-    worst_10_growth = growth_df.sort_values(by='Growth (%)', ascending=True).head(10).reset_index(drop=True)
-    worst_10_growth.index = worst_10_growth.index + 1
+
+def generate_tables(stock_dataframe, portfolio_dataframe=None):
+    # stock_dataframe has the prices of the period, dates x tickers
+    tickers = np.asarray(stock_dataframe.columns)
+    growth = window_growth(stock_dataframe.to_numpy())
+
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        k = st.number_input('Number of stocks', min_value=1, max_value=max(1, len(tickers)),
+                            value=min(10, max(1, len(tickers))), step=1)
+
+    # Sector and market cap of each ticker, from its first lot in the portfolio
+    if portfolio_dataframe is not None and len(portfolio_dataframe):
+        categories = portfolio_dataframe[['Sector', 'Market Cap']]
+        categories = categories[~categories.index.duplicated()].reindex(tickers)
+        with col2:
+            sectors = st.multiselect('Sector', sorted(categories['Sector'].dropna().unique()), [])
+        with col3:
+            market_caps = st.multiselect('Market Cap', sorted(categories['Market Cap'].dropna().unique()), [])
+        if sectors:
+            growth = np.where(categories['Sector'].isin(sectors).to_numpy(), growth, np.nan)
+        if market_caps:
+            growth = np.where(categories['Market Cap'].isin(market_caps).to_numpy(), growth, np.nan)
+
+    top_growth, worst_growth = rank_growth(tickers, growth, int(k))
 
     col1, col2 = st.columns(2)
 
     with col1:
-        # Exibir a tabela das 10 ações com maior crescimento
-        st.header('Top 10 Stocks by Growth', divider='gray')
-        st.table(top_10_growth)
+        # Exibir a tabela das ações com maior crescimento
+        st.header(f'Top {int(k)} Stocks by Growth', divider='gray')
+        st.table(top_growth)
 
     with col2:
-        # Exibir a tabela das 10 ações com pior desempenho
-        st.header('Worst 10 Stocks by Growth', divider='gray')
-        st.table(worst_10_growth)
+        # Exibir a tabela das ações com pior desempenho
+        st.header(f'Worst {int(k)} Stocks by Growth', divider='gray')
+        st.table(worst_growth)
@@ -0,0 +1,315 @@
+import logging
+import os
+import threading
+import time
+from datetime import date, timedelta
+from App_State import read_app_state, write_app_state
+from Instrumentation import stage
+from Portfolio_Diff import diff_positions, diff_tracking
+from Portfolio_Journal import PortfolioJournal
+from Snapshot_Cache import read_snapshot
+from Snapshot_Downloader import (changed_snapshots, download_snapshots, manifest_entry, missing_blobs, read_manifest,
+                                 replace_snapshots, write_manifest)
+
+logger = logging.getLogger('ingestion')
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+
+class FileLock:
+    """Exclusive lock on a file, held across processes until released."""
+
+    def __init__(self, path):
+        self.path = path
+        self.file = None
+
+    def acquire(self, blocking=True):
+        file = open(self.path, 'a+')
+        try:
+            if fcntl is not None:
+                fcntl.flock(file.fileno(), fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+            else:
+                file.seek(0)
+                msvcrt.locking(file.fileno(), msvcrt.LK_LOCK if blocking else msvcrt.LK_NBLCK, 1)
+        except OSError:
+            file.close()
+            if blocking:
+                raise
+            return False
+        self.file = file
+        return True
+
+    def release(self):
+        if fcntl is not None:
+            fcntl.flock(self.file.fileno(), fcntl.LOCK_UN)
+        else:
+            self.file.seek(0)
+            msvcrt.locking(self.file.fileno(), msvcrt.LK_UNLCK, 1)
+        self.file.close()
+        self.file = None
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+
+class PortfolioSnapshot:
+    """The portfolio as of one version, shared by every session: read it, do not modify it."""
+
+    def __init__(self, version, last_date, portfolio, tracking, exposure=None):
+        self.version = version
+        self.last_date = last_date
+        self.portfolio = portfolio
+        self.tracking = tracking
+        # Daily exposure of the open positions, see PortfolioJournal.exposure
+        self.exposure = exposure
+
+
+def publish(data_dir, journal, changed=True, version=0):
+    # Snapshot of the journal, written as the app state unless the published one was built from the same journal
+    # (log generation and length) and changed is False. Versions carry on from the published one, whichever process
+    # published it, and version is the least one to carry on from. Call it holding the data directory's lock
+    published = read_app_state(data_dir)
+    if not changed and published is not None and published.get('source') == journal.source:
+        version = max(version, published.get('version', 0))
+        return PortfolioSnapshot(version, published['last_date'], published['portfolio'], published['tracking'],
+                                 published.get('exposure'))
+    version = max(version, published.get('version', 0) if published is not None else 0) + 1
+    portfolio = journal.state.to_dataframe() if journal.state is not None else None
+    snapshot = PortfolioSnapshot(version, journal.last_date, portfolio, journal.tracking(), journal.exposure())
+    if journal.state is not None:
+        write_app_state(data_dir, journal.last_date, portfolio, snapshot.tracking, version, snapshot.exposure,
+                        journal.source)
+        logger.info('published', extra={'fields': {'version': version, 'last_date': journal.last_date}})
+    return snapshot
+
+
+class SharedIngestion:
+    """One journal per process, brought up to date by a single ingestion at a time.
+
+    Threads of the process share the latest PortfolioSnapshot and wait for the one ingesting instead of starting their
+    own. Across processes a lock file in the data directory keeps the downloads and journal appends to one writer, and
+    a journal another process moved forward is reloaded from disk before anything is appended to it. Each new
+    snapshot is also published as the app state, which is all a read-only dashboard needs.
+
+    A snapshot uploaded again with other contents, found through the manifest of the blobs downloaded, rewinds the
+    journal to its checkpoint before that day and applies the days from there again. What that changed in the
+    positions and the tracking is written to data/corrections.
+    """
+
+    def __init__(self, data_dir, csv_file_path=None, tracking_file_path=None, min_interval=300,
+                 notification_window=timedelta(days=3), on_sold=None, on_bought=None, suppressed=None):
+        self.data_dir = data_dir
+        self.csv_file_path = csv_file_path
+        self.tracking_file_path = tracking_file_path
+        # The bucket is listed at most once every min_interval seconds, reruns in between get the cached snapshot
+        self.min_interval = min_interval
+        # Days older than this are caught up without notifications
+        self.notification_window = notification_window
+        self.on_sold = on_sold
+        self.on_bought = on_bought
+        self.suppressed = suppressed
+        self.lock = threading.Lock()
+        self.file_lock = FileLock(os.path.join(data_dir, '.ingest.lock'))
+        self.journal = None
+        self.snapshot = None
+        self.version = 0
+        self.checked = 0.0
+        # Checkpoint and log files as this process last left them
+        self.stamp = None
+
+    def _disk_stamp(self):
+        stamp = []
+        for path in (self.journal.checkpoint_path, self.journal.events_path) if self.journal is not None else ():
+            stamp.append(os.stat(path).st_mtime_ns if os.path.exists(path) else None)
+            stamp.append(os.path.getsize(path) if os.path.exists(path) else None)
+        return tuple(stamp)
+
+    def _load(self):
+        with stage('journal load'):
+            self.journal = PortfolioJournal(self.data_dir).load(self.csv_file_path, self.tracking_file_path)
+        logger.info('journal loaded', extra={'fields': {'last_date': self.journal.last_date}})
+
+    def _publish(self, changed):
+        # Called under the file lock
+        self.snapshot = publish(self.data_dir, self.journal, changed, self.version)
+        self.version = self.snapshot.version
+
+    def current(self):
+        return self.snapshot
+
+    def is_fresh(self):
+        return self.snapshot is not None and time.time() - self.checked < self.min_interval
+
+    def refresh(self, bucket, prefix, progress=None, force=False):
+        # Latest snapshot, ingesting the bucket's new files first unless that was done less than min_interval ago
+        if not force and self.is_fresh():
+            return self.snapshot
+        with self.lock:
+            if not force and self.is_fresh():
+                return self.snapshot
+            with self.file_lock:
+                loaded = self.journal is None or self._disk_stamp() != self.stamp
+                if loaded:
+                    self._load()
+                added = 0
+                try:
+                    added = self._ingest(bucket, prefix, progress)
+                finally:
+                    self._persist(loaded, added)
+            self.checked = time.time()
+        return self.snapshot
+
+    def backfill(self, bucket, prefix, first_date, last_date, progress=None):
+        # Ingests the bucket's snapshots dated first_date to last_date (YYYY-MM-DD, both included) without
+        # notifications. Days before the end of the journal can't be appended to it, so if there are any the
+        # journal is rebuilt from every snapshot in the data directory instead
+        with self.lock, self.file_lock:
+            if self.journal is None or self._disk_stamp() != self.stamp:
+                self._load()
+            added = 0
+            earlier = []
+            try:
+                added = self._ingest(bucket, prefix, progress, (first_date, last_date), historical=True,
+                                     earlier=earlier)
+                if earlier:
+                    self._rebuild()
+            finally:
+                self._persist(True, added + len(earlier))
+            self.checked = time.time()
+        return self.snapshot
+
+    def _persist(self, loaded, added):
+        if self.journal.days_since_checkpoint:
+            with stage('checkpoint'):
+                self.journal.checkpoint()
+        if loaded or added or self.snapshot is None:
+            self._publish(added > 0)
+        self.stamp = self._disk_stamp()
+
+    def _rebuild(self):
+        from Replaying_History import load_snapshots, replay_history
+
+        with stage('rebuild'):
+            snapshots = load_snapshots(self.data_dir)
+            state, tracking, exposure = replay_history(snapshots, self.journal.strategy, with_exposure=True)
+            self.journal.reset(state, tracking, exposure)
+        logger.info('journal rebuilt', extra={'fields': {'days': len(snapshots), 'last_date': self.journal.last_date}})
+
+    def _correct(self, blobs, manifest):
+        # Replaces the snapshots uploaded again with other contents and recomputes the journal from the day before the
+        # first of them. Returns the number of snapshots replaced. Their manifest entries are only updated once the
+        # journal has been recomputed, so an interrupted correction is found and done again on the next ingestion
+        journal = self.journal
+        with stage('manifest check'):
+            changed = changed_snapshots(blobs, manifest, self.data_dir)
+        if not changed:
+            return 0
+        last_date = journal.last_date
+        old_portfolio = journal.state.to_dataframe() if journal.state is not None else None
+        old_tracking = journal.tracking()
+        with stage('snapshot replacement', rows=len(changed)):
+            replace_snapshots(changed, self.data_dir)
+        first_day = changed[0][0][:10]
+        if last_date is None or first_day > last_date:
+            # Not applied yet, the catch-up applies them
+            for new_filename, blob in changed:
+                manifest[new_filename] = manifest_entry(blob)
+            return len(changed)
+
+        restored = journal.rewind(first_day)
+        if restored is None:
+            # No checkpoint that old
+            self._rebuild()
+        else:
+            self._catch_up()
+        for new_filename, blob in changed:
+            manifest[new_filename] = manifest_entry(blob)
+
+        corrections_dir = os.path.join(self.data_dir, 'corrections', time.strftime('%Y%m%d-%H%M%S'))
+        os.makedirs(corrections_dir, exist_ok=True)
+        positions = diff_positions(old_portfolio, journal.state.to_dataframe()) if old_portfolio is not None else None
+        tracking = diff_tracking(old_tracking, journal.tracking())
+        if positions is not None:
+            positions.to_csv(os.path.join(corrections_dir, 'positions.csv'), index=False)
+        tracking.to_csv(os.path.join(corrections_dir, 'tracking.csv'))
+        logger.info('corrected', extra={'fields': {
+            'days': [new_filename[:10] for new_filename, _ in changed], 'restored': restored,
+            'positions': len(positions) if positions is not None else 0, 'tracking_days': len(tracking),
+            'report': corrections_dir}})
+        return len(changed)
+
+    def _catch_up(self):
+        # Applies the snapshots in the data directory dated after the journal's last day, without notifications.
+        # Downloads only move a file there once it is applied, so these are days a rewind dropped, or that an
+        # interrupted recompute did not get to. Returns the number of days applied
+        journal = self.journal
+        file_names = sorted(name for name in os.listdir(self.data_dir) if name.endswith('.xlsx')
+                            and (journal.last_date is None or name[:10] > journal.last_date))
+        if not file_names:
+            return 0
+        with self._suppressed(True), stage('journal recompute', rows=len(file_names)):
+            for file_name in file_names:
+                journal.apply(read_snapshot(os.path.join(self.data_dir, file_name)), file_name[:10])
+        logger.info('caught up', extra={'fields': {'days': len(file_names), 'last_date': journal.last_date}})
+        return len(file_names)
+
+    def _ingest(self, bucket, prefix, progress, dates=None, historical=False, earlier=None):
+        blobs = list(bucket.list_blobs(prefix=prefix))
+        manifest = read_manifest(self.data_dir)
+        added = 0
+        try:
+            # Corrected days count as added, the snapshot has to be published again
+            added += self._correct(blobs, manifest)
+            added += self._catch_up()
+            added += self._download(bucket, prefix, progress, dates, historical, earlier, blobs, manifest)
+        finally:
+            write_manifest(self.data_dir, manifest)
+        return added
+
+    def _download(self, bucket, prefix, progress, dates, historical, earlier, blobs, manifest):
+        journal = self.journal
+        added = 0
+        by_filename = dict(missing_blobs(blobs, set(), dates))
+        for new_filename, new_dataframe in download_snapshots(bucket, prefix, self.data_dir, progress=progress,
+                                                               dates=dates, blobs=blobs):
+            manifest[new_filename] = manifest_entry(by_filename[new_filename])
+            day = new_filename[:10]
+            # A day already in the log, e.g. when a run stopped before moving its file into the data directory, or a
+            # day missing from the middle of the history that a backfill has to rebuild
+            if journal.last_date is not None and day <= journal.last_date:
+                if earlier is not None and day not in journal.dates:
+                    earlier.append(day)
+                continue
+            start = time.perf_counter()
+            skip_notifications = historical or day < (date.today() - self.notification_window).isoformat()
+            with self._suppressed(skip_notifications), stage('journal apply', rows=len(new_dataframe)):
+                journal.apply(new_dataframe, day, on_sold=self.on_sold, on_bought=self.on_bought)
+            added += 1
+            logger.info('applied', extra={'fields': {'date': day, 'rows': len(new_dataframe),
+                                                     'seconds': round(time.perf_counter() - start, 3),
+                                                     'notified': not skip_notifications}})
+        return added
+
+    def _suppressed(self, historical):
+        if self.suppressed is None:
+            return _no_suppression
+        return self.suppressed(historical)
+
+
+class _NoSuppression:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_no_suppression = _NoSuppression()
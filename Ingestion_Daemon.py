@@ -0,0 +1,128 @@
+import argparse
+import json
+import logging
+import os
+import signal
+import sys
+import threading
+import time
+from datetime import date
+
+# Exit codes
+EXIT_OK = 0
+EXIT_FAILED = 1  # An ingestion failed, or too many in a row when watching
+EXIT_USAGE = 2  # Bad arguments, argparse's own code
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: time, level, logger, event and the record's `fields`."""
+
+    def format(self, record):
+        entry = {'time': time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(record.created)) + 'Z',
+                 'level': record.levelname.lower(), 'logger': record.name, 'event': record.getMessage()}
+        entry.update(getattr(record, 'fields', {}))
+        if record.exc_info:
+            entry['error'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+def configure_logging(level=logging.INFO):
+    handler = logging.StreamHandler(sys.stderr)
+    handler.setFormatter(JsonFormatter())
+    root = logging.getLogger()
+    root.handlers[:] = [handler]
+    root.setLevel(level)
+
+
+def open_bucket(bucket_dir=None):
+    # A LocalBucket for a directory, otherwise the Firebase Storage bucket from .streamlit/secrets.toml
+    from Snapshot_Downloader import LocalBucket, firebase_bucket
+
+    if bucket_dir:
+        return LocalBucket(bucket_dir)
+    import streamlit as st
+
+    return firebase_bucket(st.secrets["firebase"]['my_project_settings'])
+
+
+def iso_date(value):
+    # argparse type for YYYY-MM-DD dates, kept as strings like the journal's
+    return date.fromisoformat(value).isoformat()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Ingest the new daily snapshots into the portfolio journal and publish the state the dashboard '
+                    'reads. Runs once unless --watch is given.')
+    parser.add_argument('--data-dir', default='data', help='directory with the snapshots, journal and app state')
+    parser.add_argument('--prefix', default='smart_impulse', help='folder of the snapshots in the bucket')
+    parser.add_argument('--bucket-dir', default=os.environ.get('SMART_IMPULSE_BUCKET_DIR'),
+                        help='local directory standing in for the Storage bucket')
+    parser.add_argument('--watch', action='store_true', help='keep polling the bucket until stopped')
+    parser.add_argument('--interval', type=float, default=300, help='seconds between polls with --watch')
+    parser.add_argument('--max-failures', type=int, default=5,
+                        help='consecutive failed polls after which --watch gives up')
+    parser.add_argument('--backfill', nargs=2, type=iso_date, metavar=('FROM', 'TO'),
+                        help='ingest the snapshots dated FROM to TO without notifications')
+    args = parser.parse_args(argv)
+    if args.watch and args.backfill:
+        parser.error('--backfill runs once, it can not be combined with --watch')
+    if args.backfill and args.backfill[0] > args.backfill[1]:
+        parser.error('--backfill FROM must not be after TO')
+
+    configure_logging()
+    log = logging.getLogger('ingestion')
+
+    from Ingestion import SharedIngestion
+    from Telegram_Bot import sold_stocks, bought_stocks, suppressed
+
+    os.makedirs(args.data_dir, exist_ok=True)
+    ingestion = SharedIngestion(args.data_dir, os.path.join(args.data_dir, 'smart_portfolio.csv'),
+                                os.path.join(args.data_dir, 'returns.csv'), min_interval=0,
+                                on_sold=sold_stocks, on_bought=bought_stocks, suppressed=suppressed)
+    try:
+        bucket = open_bucket(args.bucket_dir)
+    except Exception:
+        log.exception('bucket unavailable')
+        return EXIT_FAILED
+
+    def poll():
+        start = time.perf_counter()
+        if args.backfill:
+            snapshot = ingestion.backfill(bucket, args.prefix, *args.backfill)
+        else:
+            snapshot = ingestion.refresh(bucket, args.prefix, force=True)
+        log.info('poll done', extra={'fields': {'version': snapshot.version, 'last_date': snapshot.last_date,
+                                                'seconds': round(time.perf_counter() - start, 3)}})
+
+    if not args.watch:
+        try:
+            poll()
+        except Exception:
+            log.exception('ingestion failed')
+            return EXIT_FAILED
+        return EXIT_OK
+
+    # Stop between polls on SIGTERM or Ctrl+C
+    stopping = threading.Event()
+    for signal_number in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signal_number, lambda *_: stopping.set())
+    log.info('watching', extra={'fields': {'interval': args.interval, 'prefix': args.prefix}})
+    failures = 0
+    while not stopping.is_set():
+        try:
+            poll()
+            failures = 0
+        except Exception:
+            # A bad file stays out of the data directory and is tried again on the next poll
+            failures += 1
+            log.exception('ingestion failed', extra={'fields': {'failures': failures}})
+            if failures >= args.max_failures:
+                return EXIT_FAILED
+        stopping.wait(args.interval)
+    log.info('stopped')
+    return EXIT_OK
+
+
+if __name__ == '__main__':
+    sys.exit(main())
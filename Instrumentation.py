@@ -0,0 +1,140 @@
+import contextvars
+import functools
+import json
+import os
+import threading
+import time
+from collections import deque
+
+# Off unless SMART_IMPULSE_INSTRUMENTATION is set or enable() is called, and then a stage costs one attribute check
+enabled = bool(os.environ.get('SMART_IMPULSE_INSTRUMENTATION'))
+
+# Most recent stage records of the process, shared by every session
+_records = deque(maxlen=20000)
+_lock = threading.Lock()
+_last_run = 0
+# Run of the current context. Every Streamlit session reruns its script in its own thread, which starts with its own
+# context, so concurrent sessions keep their own run. Work handed to a pool carries it with carry_run
+_run = contextvars.ContextVar('run', default=0)
+_page_size = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+
+def enable(on=True):
+    global enabled
+    enabled = on
+
+
+def new_run():
+    # Starts a new run, e.g. a rerun of the Streamlit script, so records can be grouped by run
+    global _last_run
+    with _lock:
+        _last_run += 1
+        run = _last_run
+    _run.set(run)
+    return run
+
+
+def carry_run(function):
+    # The function bound to the caller's context, to submit to a thread pool without losing the run
+    return functools.partial(contextvars.copy_context().run, function)
+
+
+def _rss():
+    # Resident memory in bytes, 0 where /proc is not available
+    try:
+        with open('/proc/self/statm') as file:
+            return int(file.read().split()[1]) * _page_size
+    except (OSError, IndexError, ValueError):
+        return 0
+
+
+class _NullStage:
+    rows = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_null_stage = _NullStage()
+
+
+class _Stage:
+    def __init__(self, name, rows):
+        self.name = name
+        self.rows = rows
+
+    def __enter__(self):
+        self.run = _run.get()
+        self.memory = _rss()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, *exc_info):
+        seconds = time.perf_counter() - self.start
+        record = {'run': self.run, 'stage': self.name, 'time': time.time(), 'seconds': seconds, 'rows': self.rows,
+                  'memory_delta_mb': (_rss() - self.memory) / 2 ** 20, 'thread': threading.current_thread().name,
+                  'error': exc_type.__name__ if exc_type is not None else None}
+        with _lock:
+            _records.append(record)
+        return False
+
+
+def stage(name, rows=None):
+    # with stage('download', rows=n) as current: ... ; current.rows can also be set inside the block
+    return _Stage(name, rows) if enabled else _null_stage
+
+
+def timed(name, rows=None):
+    # Decorator recording every call as a stage, rows(result) gives the rows processed when passed
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not enabled:
+                return function(*args, **kwargs)
+            with _Stage(name, None) as current:
+                result = function(*args, **kwargs)
+                if rows is not None:
+                    current.rows = rows(result)
+            return result
+        return wrapper
+    return decorator
+
+
+def records():
+    with _lock:
+        return list(_records)
+
+
+def clear():
+    with _lock:
+        _records.clear()
+
+
+def to_jsonl(stage_records=None):
+    return ''.join(json.dumps(record) + '\n' for record in (records() if stage_records is None else stage_records))
+
+
+def export_jsonl(file_name):
+    with open(file_name, 'a') as file:
+        file.write(to_jsonl())
+
+
+def summary(stage_records=None):
+    # Calls, total, mean and p95 seconds, rows and memory growth per stage
+    import pandas as pd
+
+    dataframe = pd.DataFrame(records() if stage_records is None else stage_records)
+    if dataframe.empty:
+        return dataframe
+    grouped = dataframe.groupby('stage')
+    return pd.DataFrame({
+        'Calls': grouped.size(),
+        'Total (s)': grouped['seconds'].sum(),
+        'Mean (s)': grouped['seconds'].mean(),
+        'p95 (s)': grouped['seconds'].quantile(0.95),
+        'Rows': grouped['rows'].sum(min_count=1),
+        'Memory (MB)': grouped['memory_delta_mb'].sum(),
+    }).sort_values('Total (s)', ascending=False)
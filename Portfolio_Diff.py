@@ -0,0 +1,50 @@
+import numpy as np
+
+# Columns of a lot compared between two versions of the portfolio
+POSITION_COLUMNS = ['Quantity', 'Investment', 'Total Amount', 'ROI', 'Sell Date']
+
+TRACKING_COLUMNS = ['Total Amount', 'Investment']
+
+
+def _lots(portfolio_dataframe):
+    # Lots keyed by ticker and buy date, numbered in case a ticker was bought twice on one day
+    lots = portfolio_dataframe.rename_axis('Ticker').reset_index()
+    lots['Lot'] = lots.groupby(['Ticker', 'Buy Date']).cumcount()
+    columns = [column for column in POSITION_COLUMNS if column in lots.columns]
+    return lots.set_index(['Ticker', 'Buy Date', 'Lot'])[columns]
+
+
+def _differs(before, after):
+    # Element-wise difference of two aligned columns, missing on both sides counting as equal
+    both_missing = before.isna().to_numpy() & after.isna().to_numpy()
+    try:
+        equal = np.isclose(before.to_numpy(dtype=np.float64), after.to_numpy(dtype=np.float64), rtol=0, atol=1e-9)
+    except (TypeError, ValueError):
+        equal = before.to_numpy() == after.to_numpy()
+    return ~(equal | both_missing)
+
+
+def diff_positions(old_portfolio, new_portfolio):
+    # Lots added, removed or changed between two portfolio dataframes, with the values before and after
+    old_lots, new_lots = _lots(old_portfolio), _lots(new_portfolio)
+    joined = old_lots.join(new_lots, how='outer', lsuffix=' Before', rsuffix=' After')
+    added = ~joined.index.isin(old_lots.index)
+    removed = ~joined.index.isin(new_lots.index)
+    changed = np.zeros(len(joined), dtype=bool)
+    for column in old_lots.columns.intersection(new_lots.columns):
+        changed |= _differs(joined[f'{column} Before'], joined[f'{column} After'])
+    joined.insert(0, 'Change', np.select([added, removed], ['added', 'removed'], 'changed'))
+    return joined[added | removed | changed].reset_index()
+
+
+def diff_tracking(old_tracking, new_tracking):
+    # Days whose tracked total amount or investment changed, or that only one of the two has
+    joined = old_tracking[TRACKING_COLUMNS].join(new_tracking[TRACKING_COLUMNS], how='outer', lsuffix=' Before',
+                                                 rsuffix=' After')
+    changed = np.zeros(len(joined), dtype=bool)
+    for column in TRACKING_COLUMNS:
+        changed |= _differs(joined[f'{column} Before'], joined[f'{column} After'])
+    difference = joined[changed].copy()
+    for column in TRACKING_COLUMNS:
+        difference[f'{column} Change'] = difference[f'{column} After'] - difference[f'{column} Before']
+    return difference.rename_axis('Date')
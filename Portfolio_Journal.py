@@ -0,0 +1,277 @@
+import json
+import os
+import pickle
+import shutil
+import numpy as np
+import pandas as pd
+from Portfolio_State import PortfolioState, CATEGORICAL
+
+
+class PortfolioJournal:
+    """Append-only log of the portfolio events plus periodic checkpoints of the position state.
+
+    Every day appends its sells, buys, top-ups and a closing mark record (held prices and the smart_tracking
+    totals) to the events log. checkpoint.pkl holds the PortfolioState and tracking series up to a byte offset of
+    the log, so loading only replays the days written after it. Every checkpoint is also kept in checkpoints/ under
+    its last day, which the journal can be rewound to when an older snapshot is corrected: the latest keep_recent
+    ones, and the first one of each month before them.
+    """
+
+    def __init__(self, data_dir, checkpoint_every=20, strategy=None, keep_recent=30):
+        self.data_dir = data_dir
+        # Rules of a portfolio created by this journal, a loaded one keeps its own
+        self.strategy = strategy
+        self.checkpoint_path = os.path.join(data_dir, 'checkpoint.pkl')
+        self.history_dir = os.path.join(data_dir, 'checkpoints')
+        self.keep_recent = keep_recent
+        self.checkpoint_every = checkpoint_every
+        # Each reset starts a new log, so swapping the checkpoint is the only step that has to be atomic
+        self.generation = 0
+        self.state = None
+        # smart_tracking as growing lists, turned into a dataframe when asked for
+        self.dates = []
+        self.amounts = []
+        self.investments = []
+        # Exposure of the open positions by sector and by market cap at each day's close, arrays in category code
+        # order (None for the days before it was recorded)
+        self.exposures = {name: [] for name in CATEGORICAL}
+        self.days_since_checkpoint = 0
+
+    @property
+    def events_path(self):
+        return os.path.join(self.data_dir, f'events-{self.generation}.jsonl')
+
+    @property
+    def source(self):
+        # Log generation and length the in-memory journal matches, which changes with every append, reset or rewind
+        size = os.path.getsize(self.events_path) if os.path.exists(self.events_path) else 0
+        return self.generation, size
+
+    @property
+    def last_date(self):
+        return self.dates[-1] if self.dates else None
+
+    def load(self, csv_file_path=None, tracking_file_path=None):
+        # Latest checkpoint plus the days logged after it, or the legacy CSVs the first time
+        offset = 0
+        if os.path.exists(self.checkpoint_path):
+            with open(self.checkpoint_path, 'rb') as file:
+                checkpoint = pickle.load(file)
+            self.state = checkpoint['state']
+            self.dates, self.amounts, self.investments = checkpoint['tracking']
+            self.exposures = checkpoint.get('exposure') or self._current_exposure(len(self.dates))
+            self.generation = checkpoint['generation']
+            offset = checkpoint['offset']
+        elif csv_file_path is not None and os.path.exists(csv_file_path):
+            self.state = PortfolioState.from_dataframe(pd.read_csv(csv_file_path, index_col=0), self.strategy)
+            tracking = pd.read_csv(tracking_file_path, index_col=0)
+            self.dates = [str(date)[:10] for date in tracking.index]
+            self.amounts = tracking['Total Amount'].tolist()
+            self.investments = tracking['Investment'].tolist()
+            self.reset(self.state, self.tracking())
+            return self
+        self._replay_tail(offset)
+        return self
+
+    def _replay_tail(self, offset):
+        if not os.path.exists(self.events_path):
+            return
+        day = []
+        complete = offset
+        with open(self.events_path, 'rb') as file:
+            file.seek(offset)
+            for line in file:
+                if not line.endswith(b'\n'):
+                    break
+                event = json.loads(line)
+                day.append(event)
+                if event['type'] == 'mark':
+                    self._replay_day(day)
+                    day = []
+                    complete = file.tell()
+        # A crash in the middle of a day leaves a partial tail, drop it so the next append starts clean
+        if complete < os.path.getsize(self.events_path):
+            with open(self.events_path, 'r+b') as file:
+                file.truncate(complete)
+
+    def _replay_day(self, events):
+        mark = events[-1]
+        buys = [event for event in events if event['type'] == 'buy']
+        snapshot = pd.DataFrame({
+            'Price': mark['prices'] + [event['price'] for event in buys],
+            'Sector': [None] * len(mark['tickers']) + [event['sector'] for event in buys],
+            'Market Cap Category': [None] * len(mark['tickers']) + [event['market_cap'] for event in buys],
+        }, index=pd.Index(mark['tickers'] + [event['ticker'] for event in buys], name='Ticker'))
+        if self.state is None:
+            self.state = PortfolioState.create(snapshot, 1 / len(snapshot), mark['date'], self.strategy)
+        else:
+            self.state.update(snapshot, mark['date'])
+        self._track(mark['date'])
+        self.days_since_checkpoint += 1
+
+    def _track(self, date):
+        self.dates.append(date)
+        self.amounts.append(float(self.state.total('Total Amount')))
+        self.investments.append(float(self.state.total('Investment')))
+        for name, exposures in self.exposures.items():
+            exposures.append(self.state.exposure[name].copy())
+
+    def _current_exposure(self, n_days):
+        # Only the last day is known when the history did not record the exposure
+        return {name: [None] * (n_days - 1) + [self.state.exposure[name].copy()] if n_days else []
+                for name in CATEGORICAL}
+
+    def apply(self, new_dataframe, date, on_sold=None, on_bought=None):
+        # Create or update the portfolio with a day and append what happened to the log
+        if self.state is None:
+            self.state = PortfolioState.create(new_dataframe, 1 / len(new_dataframe), date, self.strategy)
+            changes = {'sold': [], 'held': [], 'second_entry': [], 'third_entry': [],
+                       'bought': self.state.open_rows()}
+        else:
+            changes = self.state.update(new_dataframe, date, on_sold=on_sold, on_bought=on_bought)
+        self._track(date)
+        self._append(self._events(date, changes))
+        self.days_since_checkpoint += 1
+        if self.days_since_checkpoint >= self.checkpoint_every:
+            self.checkpoint()
+
+    def _events(self, date, changes):
+        c = self.state.columns
+        ticker = self.state.ticker
+        events = []
+        for row in changes['sold']:
+            events.append({'type': 'sell', 'date': date, 'ticker': ticker[row], 'lot': row,
+                           'quantity': c['Quantity'][row], 'price': c['Today Price'][row]})
+        for row in changes['bought']:
+            events.append({'type': 'buy', 'date': date, 'ticker': ticker[row], 'lot': row,
+                           'price': c['Today Price'][row], 'sector': c['Sector'][row],
+                           'market_cap': c['Market Cap'][row], 'quantity': c['Quantity'][row]})
+        for entry in ('second_entry', 'third_entry'):
+            for row in changes[entry]:
+                events.append({'type': 'top_up', 'date': date, 'ticker': ticker[row], 'entry': entry,
+                               'price': c['Today Price'][row], 'amount': self.state.strategy.top_up})
+        # The mark closes the day, a day without it is not replayed
+        held = np.asarray(changes['held'], dtype=np.int64)
+        events.append({'type': 'mark', 'date': date, 'tickers': ticker[held].tolist(),
+                       'prices': c['Today Price'][held].tolist(), 'total_amount': self.amounts[-1],
+                       'investment': self.investments[-1]})
+        return events
+
+    def _append(self, events):
+        lines = ''.join(json.dumps(event, default=_to_json) + '\n' for event in events)
+        with open(self.events_path, 'ab') as file:
+            file.write(lines.encode())
+            file.flush()
+            os.fsync(file.fileno())
+
+    def checkpoint(self):
+        if self.state is None:
+            return
+        offset = os.path.getsize(self.events_path) if os.path.exists(self.events_path) else 0
+        checkpoint = {'state': self.state, 'tracking': (self.dates, self.amounts, self.investments),
+                      'exposure': self.exposures, 'generation': self.generation, 'offset': offset}
+        temporary_path = f'{self.checkpoint_path}.tmp'
+        with open(temporary_path, 'wb') as file:
+            pickle.dump(checkpoint, file, protocol=pickle.HIGHEST_PROTOCOL)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temporary_path, self.checkpoint_path)
+        self.days_since_checkpoint = 0
+        self._keep(self.last_date)
+
+    def _keep(self, date):
+        # The state by day for rewind. The tracking lists only grow, so the number of days is enough to cut them back
+        os.makedirs(self.history_dir, exist_ok=True)
+        history_path = self._history_path(date)
+        with open(f'{history_path}.tmp', 'wb') as file:
+            pickle.dump({'state': self.state, 'days': len(self.dates)}, file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(f'{history_path}.tmp', history_path)
+        checkpoint_dates = self.checkpoint_dates()
+        month = None
+        for day in checkpoint_dates[:-self.keep_recent]:
+            if day[:7] == month:
+                os.remove(self._history_path(day))
+            month = day[:7]
+
+    def _history_path(self, date):
+        return os.path.join(self.history_dir, f'{date}.pkl')
+
+    def checkpoint_dates(self):
+        # Days with a checkpoint to rewind to, in order
+        if not os.path.isdir(self.history_dir):
+            return []
+        return sorted(name[:-4] for name in os.listdir(self.history_dir) if name.endswith('.pkl'))
+
+    def rewind(self, date):
+        # Goes back to the latest checkpoint before a day (YYYY-MM-DD), dropping the days after it and the
+        # checkpoints from that day on. Returns the day the journal is back at, or None, without changing anything,
+        # when no checkpoint is that old
+        checkpoint_dates = self.checkpoint_dates()
+        earlier = [day for day in checkpoint_dates if day < date]
+        if not earlier:
+            return None
+        with open(self._history_path(earlier[-1]), 'rb') as file:
+            checkpoint = pickle.load(file)
+        days = checkpoint['days']
+        if days > len(self.dates) or self.dates[days - 1] != earlier[-1]:
+            return None
+        self.state = checkpoint['state']
+        del self.dates[days:], self.amounts[days:], self.investments[days:]
+        for exposures in self.exposures.values():
+            del exposures[days:]
+        for day in checkpoint_dates:
+            if day >= date:
+                os.remove(self._history_path(day))
+        self._new_log()
+        return self.last_date
+
+    def _new_log(self):
+        # Starts a new events log from the current state
+        old_events_path = self.events_path
+        self.generation += 1
+        open(self.events_path, 'wb').close()
+        self.checkpoint()
+        if os.path.exists(old_events_path):
+            os.remove(old_events_path)
+
+    def reset(self, state, tracking, exposure=None):
+        # Start over from a rebuilt state, e.g. after replaying the whole history with new rules. exposure has a
+        # dates x categories frame per categorical column, as replay_history returns it
+        self.state = state
+        self.dates = [date.strftime('%Y-%m-%d') for date in pd.to_datetime(tracking.index)]
+        self.amounts = tracking['Total Amount'].astype(float).tolist()
+        self.investments = tracking['Investment'].astype(float).tolist()
+        if exposure is None:
+            self.exposures = self._current_exposure(len(self.dates))
+        else:
+            self.exposures = {name: list(exposure[name].reindex(columns=list(state.categories[name]), fill_value=0)
+                                         .to_numpy(dtype=np.float64)) for name in CATEGORICAL}
+        # The checkpoints of the previous history do not lead to this state
+        shutil.rmtree(self.history_dir, ignore_errors=True)
+        self._new_log()
+
+    def tracking(self):
+        return pd.DataFrame({'Total Amount': self.amounts, 'Investment': self.investments},
+                            index=pd.to_datetime(self.dates))
+
+    def exposure(self):
+        # Daily exposure of the open positions, a dates x categories frame per categorical column. Categories
+        # that appeared later are 0 before, days without a record are left out
+        frames = {}
+        for name, exposures in self.exposures.items():
+            categories = list(self.state.categories[name]) if self.state is not None else []
+            values = np.zeros((len(exposures), len(categories)))
+            recorded = np.ones(len(exposures), dtype=bool)
+            for day, exposure in enumerate(exposures):
+                if exposure is None:
+                    recorded[day] = False
+                else:
+                    values[day, :len(exposure)] = exposure
+            frames[name] = pd.DataFrame(values[recorded], index=pd.to_datetime(self.dates)[recorded],
+                                        columns=pd.Index(categories, name=name))
+        return frames
+
+
+def _to_json(value):
+    # NumPy scalars from the state arrays
+    return value.item()
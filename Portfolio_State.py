@@ -0,0 +1,391 @@
+import re
+import numpy as np
+import pandas as pd
+from Strategy import DEFAULT_STRATEGY
+
+# Columns of the portfolio dataframe, in the order create_portfolio lays them out, with the dtype of their array
+COLUMNS = {
+    'Days Holding': np.int64,
+    'ROI': np.float64,
+    'Sector': object,
+    'Market Cap': object,
+    'Allocation': np.float64,
+    'Value': np.float64,
+    'Overdraft': np.float64,
+    'Total Amount': np.float64,
+    'Yesterday Price': np.float64,
+    'Today Price': np.float64,
+    'First Entry': bool,
+    'First Entry Price': np.float64,
+    'Days Since First Entry': np.int64,
+    'Second Entry': bool,
+    'Second Entry Price': np.float64,
+    'Days Since Second Entry': np.int64,
+    'Third Entry': bool,
+    'Third Entry Price': np.float64,
+    'Quantity': np.float64,
+    'Investment': np.float64,
+    'Buy Date': object,
+    'Sell Date': object,
+}
+
+# Columns the dataframe holds as categoricals
+CATEGORICAL = ('Sector', 'Market Cap')
+
+# Columns with a secondary index from their value to the lots that have it
+INDEXED = ('Ticker',) + CATEGORICAL
+
+# Suffix the old dataframes gave sold positions (TICKER.1, TICKER.2, ...)
+OLD_SUFFIX = re.compile(r'\.\d+$')
+
+
+class PortfolioState:
+    """Ledger of the portfolio's lots kept in preallocated NumPy arrays, one row per lot.
+
+    A lot is one holding of a ticker from its buy to its sell, its row number is its stable ID. Buying a ticker again
+    after selling it opens a new lot. Lots are indexed by ticker, sector, market cap and open/closed status.
+    """
+
+    # States pickled before strategies existed ran with the default one
+    strategy = DEFAULT_STRATEGY
+
+    def __init__(self, capacity=64, strategy=None):
+        if strategy is not None:
+            self.strategy = strategy
+        self.size = 0
+        # Number of daily updates applied, used to order the sold positions like the dataframe does
+        self.steps = 0
+        self.columns = {name: self._empty(dtype, capacity) for name, dtype in COLUMNS.items()}
+        # Ticker, open flag and the update in which the lot was sold
+        self.ticker = self._empty(object, capacity)
+        self.is_open = np.zeros(capacity, dtype=bool)
+        self.close_step = np.zeros(capacity, dtype=np.int64)
+        # Ticker -> row of its open lot
+        self.rows = {}
+        # Column -> value -> rows of every lot with that value, in buy order
+        self.indexes = {name: {} for name in INDEXED}
+        # Category code of every lot in the categorical columns, -1 when missing, and the categories in code order
+        self.codes = {name: np.full(capacity, -1, dtype=np.int32) for name in CATEGORICAL}
+        self.categories = {name: {} for name in CATEGORICAL}
+        self.dtypes = {}
+        # Total Amount of the open lots per category code, kept up to date by every buy, sell and price mark
+        self.exposure = {name: np.zeros(0) for name in CATEGORICAL}
+
+    @staticmethod
+    def _empty(dtype, capacity):
+        if dtype is object:
+            return np.full(capacity, None, dtype=object)
+        if dtype is np.float64:
+            return np.full(capacity, np.nan)
+        return np.zeros(capacity, dtype=dtype)
+
+    @classmethod
+    def create(cls, initial_dataframe, allocation, date, strategy=None):
+        # Same as create_portfolio, but backed by arrays
+        state = cls(capacity=max(64, 2 * len(initial_dataframe)), strategy=strategy)
+        state._append(initial_dataframe, allocation, date)
+        return state
+
+    @classmethod
+    def from_arrays(cls, columns, ticker, is_open, close_step, steps=0, strategy=None):
+        # Build the state from one array per column, rows in the order the lots were bought
+        n = len(ticker)
+        state = cls(capacity=max(64, 2 * n), strategy=strategy)
+        state.size = n
+        state.steps = steps
+        for name, values in columns.items():
+            state.columns[name][:n] = values
+        state.ticker[:n] = ticker
+        state.is_open[:n] = is_open
+        state.close_step[:n] = close_step
+        state.rows = dict(zip(ticker[is_open], np.flatnonzero(is_open)))
+        state._index(np.arange(n))
+        open_rows = state.open_rows()
+        state._expose(open_rows, state.columns['Total Amount'][open_rows])
+        return state
+
+    @classmethod
+    def from_dataframe(cls, portfolio_dataframe, strategy=None):
+        columns = {}
+        for name, dtype in COLUMNS.items():
+            values = portfolio_dataframe[name].to_numpy()
+            if dtype is object:
+                columns[name] = np.where(pd.isna(values), None, values)
+            else:
+                columns[name] = pd.to_numeric(values).astype(dtype)
+        tickers = portfolio_dataframe.index.to_numpy(dtype=object)
+        is_open = pd.isna(portfolio_dataframe['Sell Date']).to_numpy()
+        # Sold lots of the old dataframes are labelled TICKER.N
+        tickers = np.where(is_open, tickers, [OLD_SUFFIX.sub('', ticker) for ticker in tickers])
+        # Sold rows keep their order in the dataframe, newest sells first
+        close_step = np.zeros(len(tickers), dtype=np.int64)
+        close_step[~is_open] = -np.arange(1, (~is_open).sum() + 1)
+        return cls.from_arrays(columns, tickers, is_open, close_step, strategy=strategy)
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        # Checkpoints written before the lot indexes existed labelled their sold positions TICKER.N
+        if 'codes' not in state:
+            for name in ('label', 'labels', 'suffixes'):
+                self.__dict__.pop(name, None)
+            self.indexes = {name: {} for name in INDEXED}
+            self.codes = {name: np.full(len(self.is_open), -1, dtype=np.int32) for name in CATEGORICAL}
+            self.categories = {name: {} for name in CATEGORICAL}
+            self.dtypes = {}
+            self._index(np.arange(self.size))
+        # and before the exposure was kept
+        if 'exposure' not in state:
+            self.exposure = {name: np.zeros(0) for name in CATEGORICAL}
+            open_rows = self.open_rows()
+            self._expose(open_rows, self.columns['Total Amount'][open_rows])
+
+    def _index(self, rows):
+        # Adds new lots to the secondary indexes and gives them their category codes
+        index = self.indexes['Ticker']
+        for row, ticker in zip(rows.tolist(), self.ticker[rows]):
+            index.setdefault(ticker, []).append(row)
+        # Few distinct values, grouped at once
+        for name in CATEGORICAL:
+            codes, uniques = pd.factorize(self.columns[name][rows])
+            order = np.argsort(codes, kind='stable')
+            bounds = np.searchsorted(codes[order], np.arange(-1, len(uniques) + 1))
+            index = self.indexes[name]
+            for code, value in enumerate([None] + list(uniques)):
+                if bounds[code] < bounds[code + 1]:
+                    index.setdefault(value, []).extend(rows[order[bounds[code]:bounds[code + 1]]].tolist())
+            categories = self.categories[name]
+            to_global = np.array([categories.setdefault(value, len(categories)) for value in uniques] + [-1],
+                                 dtype=np.int32)
+            self.codes[name][rows] = to_global[codes]
+
+    def _expose(self, rows, amounts):
+        # Adds amounts of some lots, e.g. their change in value over a day, to the exposure of their categories
+        amounts = np.nan_to_num(amounts)
+        for name in CATEGORICAL:
+            n_categories = len(self.categories[name])
+            if len(self.exposure[name]) < n_categories:
+                self.exposure[name] = np.append(self.exposure[name], np.zeros(n_categories - len(self.exposure[name])))
+            exposure = self.exposure[name]
+            codes = self.codes[name][rows]
+            known = codes >= 0
+            exposure += np.bincount(codes[known], weights=amounts[known], minlength=len(exposure))
+
+    def _reserve(self, extra):
+        capacity = len(self.is_open)
+        if self.size + extra <= capacity:
+            return
+        capacity = max(2 * capacity, self.size + extra)
+        for name, array in self.columns.items():
+            self.columns[name] = self._grow(array, COLUMNS[name], capacity)
+        self.ticker = self._grow(self.ticker, object, capacity)
+        self.is_open = self._grow(self.is_open, bool, capacity)
+        self.close_step = self._grow(self.close_step, np.int64, capacity)
+        for name, codes in self.codes.items():
+            grown = np.full(capacity, -1, dtype=np.int32)
+            grown[:len(codes)] = codes
+            self.codes[name] = grown
+
+    def _grow(self, array, dtype, capacity):
+        grown = self._empty(dtype, capacity)
+        grown[:len(array)] = array
+        return grown
+
+    def _append(self, dataframe, allocation, date):
+        n = len(dataframe)
+        self._reserve(n)
+        rows = np.arange(self.size, self.size + n)
+        self.size += n
+        c = self.columns
+        prices = dataframe['Price'].to_numpy(dtype=np.float64)
+        value = allocation * self.strategy.capital
+        c['Days Holding'][rows] = 0
+        c['ROI'][rows] = 0
+        c['Sector'][rows] = dataframe['Sector'].to_numpy(dtype=object)
+        c['Market Cap'][rows] = dataframe['Market Cap Category'].to_numpy(dtype=object)
+        c['Allocation'][rows] = allocation
+        c['Value'][rows] = value
+        c['Overdraft'][rows] = 0
+        c['Total Amount'][rows] = value
+        c['Today Price'][rows] = prices
+        c['First Entry'][rows] = True
+        c['First Entry Price'][rows] = prices
+        c['Days Since First Entry'][rows] = 0
+        c['Second Entry'][rows] = False
+        c['Days Since Second Entry'][rows] = 0
+        c['Third Entry'][rows] = False
+        c['Quantity'][rows] = value / prices
+        c['Investment'][rows] = value
+        c['Buy Date'][rows] = date
+        tickers = dataframe.index.to_numpy(dtype=object)
+        self.ticker[rows] = tickers
+        self.is_open[rows] = True
+        self.rows.update(zip(tickers, rows))
+        self._index(rows)
+        self._expose(rows, c['Total Amount'][rows])
+        return rows
+
+    def row(self, ticker):
+        # Row of the open lot in a ticker, or None if it is not held
+        return self.rows.get(ticker)
+
+    def open_rows(self):
+        return np.flatnonzero(self.is_open[:self.size])
+
+    def lots(self, ticker=None, sector=None, market_cap=None, status=None):
+        # IDs of the lots matching every filter given, in buy order. status is 'open' or 'closed'
+        rows = None
+        for name, value in (('Ticker', ticker), ('Sector', sector), ('Market Cap', market_cap)):
+            if value is not None:
+                matches = np.asarray(self.indexes[name].get(value, []), dtype=np.int64)
+                rows = matches if rows is None else np.intersect1d(rows, matches, assume_unique=True)
+        if rows is None:
+            rows = np.arange(self.size)
+        if status is not None:
+            rows = rows[self.is_open[rows] == (status == 'open')]
+        return rows
+
+    def open_on(self, date):
+        # IDs of the lots held at the close of a day (YYYY-MM-DD): bought on it or before and sold after it
+        n = self.size
+        date = str(date)[:10]
+        buy_date = self.columns['Buy Date'][:n].astype('U10')
+        sell_date = np.where(self.is_open[:n], '', self.columns['Sell Date'][:n]).astype('U10')
+        held = (buy_date <= date) & (self.is_open[:n] | (sell_date > date))
+        return np.flatnonzero(held)
+
+    def realized_pnl(self, by='Sector'):
+        # Gain of the sold lots (value when sold minus the amount invested), summed per value of an indexed column
+        c = self.columns
+        pnl = {}
+        for value, rows in self.indexes[by].items():
+            rows = np.asarray(rows, dtype=np.int64)
+            rows = rows[~self.is_open[rows]]
+            if len(rows):
+                pnl[value] = np.nansum(c['Total Amount'][rows] - c['Investment'][rows])
+        return pd.Series(pnl, name='Realized P&L', dtype=np.float64).rename_axis(by).sort_index()
+
+    def update(self, final_dataframe, date, on_sold=None, on_bought=None):
+        c = self.columns
+        strategy = self.strategy
+        open_rows = self.open_rows()
+        positions = final_dataframe.index.get_indexer(self.ticker[open_rows])
+        held = positions >= 0
+        sold_rows = open_rows[~held]
+        rows = open_rows[held]
+        positions = positions[held]
+
+        # Close the positions missing from today's list
+        if len(sold_rows):
+            c['Sell Date'][sold_rows] = date
+            self.is_open[sold_rows] = False
+            self.close_step[sold_rows] = self.steps
+            for ticker in self.ticker[sold_rows]:
+                del self.rows[ticker]
+            self._expose(sold_rows, -c['Total Amount'][sold_rows])
+            # Send Telegram message if there are sold stocks
+            if on_sold is not None:
+                on_sold(self.to_dataframe(sold_rows))
+
+        # Update Pricing
+        today_price = final_dataframe['Price'].to_numpy(dtype=np.float64)[positions]
+        c['Yesterday Price'][rows] = c['Today Price'][rows]
+        c['Today Price'][rows] = today_price
+        c['Days Holding'][rows] += 1
+
+        # Update Daily Count
+        second_entry = c['Second Entry'][rows]
+        third_entry = c['Third Entry'][rows]
+        c['Days Since First Entry'][rows[~second_entry]] += 1
+        c['Days Since Second Entry'][rows[second_entry & ~third_entry]] += 1
+
+        # Second Entry Action
+        entering = ~second_entry & ((c['Days Since First Entry'][rows] == strategy.entry_days) | (
+                today_price > c['First Entry Price'][rows] * strategy.entry_gain))
+        second_entered = entered = rows[entering]
+        c['Second Entry'][entered] = True
+        c['Second Entry Price'][entered] = today_price[entering]
+        c['Investment'][entered] += strategy.top_up
+        c['Quantity'][entered] += strategy.top_up / c['Second Entry Price'][entered]
+
+        # Third Entry Action
+        second_entry = c['Second Entry'][rows]
+        entering = second_entry & ~third_entry & ((c['Days Since Second Entry'][rows] == strategy.entry_days) | (
+                today_price > c['Second Entry Price'][rows] * strategy.entry_gain))
+        third_entered = entered = rows[entering]
+        c['Third Entry'][entered] = True
+        c['Third Entry Price'][entered] = today_price[entering]
+        c['Investment'][entered] += strategy.top_up
+        c['Quantity'][entered] += strategy.top_up / c['Third Entry Price'][entered]
+
+        # Update Allocation and Value
+        total_amount = c['Quantity'][rows] * today_price
+        self._expose(rows, np.nan_to_num(total_amount) - np.nan_to_num(c['Total Amount'][rows]))
+        c['Total Amount'][rows] = total_amount
+        with np.errstate(divide='ignore', invalid='ignore'):
+            c['Allocation'][rows] = total_amount / np.nansum(total_amount)
+            c['ROI'][rows] = (total_amount / c['Investment'][rows] - 1) * 100
+
+        # Add new stocks that were not in the portfolio before
+        held_rows = rows
+        new_rows = rows[:0]
+        new_stocks = final_dataframe.index.difference(self.ticker[rows])
+        if not new_stocks.empty:
+            new_rows = self._append(final_dataframe.loc[new_stocks], strategy.new_allocation, date)
+            # Send Telegram message with the new stocks
+            if on_bought is not None:
+                on_bought(self.to_dataframe(new_rows))
+            rows = np.concatenate([rows, new_rows])
+
+        # Calculating the Overdraft
+        total_amount = c['Total Amount'][rows]
+        total = np.nansum(total_amount)
+        if total > strategy.overdraft_cap:
+            c['Value'][rows] = total_amount * (strategy.overdraft_cap / total)
+            c['Overdraft'][rows] = total_amount - c['Value'][rows]
+        else:
+            c['Value'][rows] = total_amount
+            c['Overdraft'][rows] = 0
+
+        self.steps += 1
+        # Rows touched by the day, for whoever records what happened
+        return {'sold': sold_rows, 'held': held_rows, 'second_entry': second_entered, 'third_entry': third_entered,
+                'bought': new_rows}
+
+    def exposure_of(self, name):
+        # Total Amount of the open lots per value of a categorical column
+        return pd.Series(self.exposure[name], index=list(self.categories[name]), name='Total Amount')
+
+    def total(self, name):
+        # Sum of a column over every position, open and sold, as in smart_portfolio[name].sum()
+        return np.nansum(self.columns[name][:self.size])
+
+    def order(self):
+        # Open lots in the order they were bought, then sold lots, most recent sells first
+        n = self.size
+        open_rows = self.open_rows()
+        sold_rows = np.flatnonzero(~self.is_open[:n])
+        sold_rows = sold_rows[np.argsort(-self.close_step[sold_rows], kind='stable')]
+        return np.concatenate([open_rows, sold_rows])
+
+    def _dtype(self, name):
+        # Sorted categories of a column, as pd.Categorical would have them, and the sorted position of each code
+        categories = list(self.categories[name])
+        if name not in self.dtypes or len(self.dtypes[name][1]) != len(categories) + 1:
+            order = sorted(range(len(categories)), key=lambda code: str(categories[code]))
+            position = np.full(len(categories) + 1, -1, dtype=np.int32)
+            position[order] = np.arange(len(categories))
+            self.dtypes[name] = (pd.CategoricalDtype([categories[code] for code in order]), position)
+        return self.dtypes[name]
+
+    def to_dataframe(self, rows=None, by_lot=False):
+        # The portfolio dataframe, indexed by ticker (sold lots repeat it), or by lot ID with a Ticker column
+        if rows is None:
+            rows = self.order()
+        data = {name: self.columns[name][rows] for name in COLUMNS}
+        # A few sectors and caps repeated over every lot, stored once each
+        for name in CATEGORICAL:
+            dtype, position = self._dtype(name)
+            data[name] = pd.Categorical.from_codes(position[self.codes[name][rows]], dtype=dtype)
+        if by_lot:
+            return pd.DataFrame(dict(Ticker=self.ticker[rows], **data), index=pd.Index(rows, name='Lot'))
+        return pd.DataFrame(data, index=pd.Index(self.ticker[rows], name='Ticker'))
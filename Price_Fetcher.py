@@ -0,0 +1,113 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import pandas as pd
+
+
+class TokenBucket:
+    """Allows `rate` calls per second on average, with bursts of up to `capacity` calls."""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class PriceFetcher:
+    """Runs price requests in size-bounded batches on a worker pool under a rate limit.
+
+    Requests for a (ticker, start) already being fetched, by this or another session, wait for that fetch
+    instead of starting a new one. Failures are reported per ticker.
+    """
+
+    def __init__(self, source, batch_size=50, max_workers=4, rate=2.0, burst=4):
+        self.source = source
+        self.batch_size = batch_size
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        self.bucket = TokenBucket(rate, burst)
+        self.lock = threading.RLock()
+        self.in_flight = {}
+
+    def _call(self, tickers, start):
+        self.bucket.acquire()
+        return self.source.history(tickers, start=start)
+
+    def _fetch_batch(self, tickers, start):
+        # Close series and errors per ticker, splitting a failed batch in halves to isolate the bad tickers
+        closes = {}
+        errors = {}
+        try:
+            close_prices = self._call(tickers, start)
+        except Exception as error:
+            if len(tickers) == 1:
+                return closes, {tickers[0]: error}
+            middle = len(tickers) // 2
+            for half in (tickers[:middle], tickers[middle:]):
+                half_closes, half_errors = self._fetch_batch(half, start)
+                closes.update(half_closes)
+                errors.update(half_errors)
+            return closes, errors
+        for ticker in tickers:
+            # A tail starts at a day already stored, so it is never empty for a ticker that still trades
+            close = close_prices[ticker].dropna() if ticker in close_prices else None
+            if close is None or close.empty:
+                errors[ticker] = LookupError(f'no prices for {ticker}')
+            else:
+                closes[ticker] = close
+        return closes, errors
+
+    def _release(self, keys):
+        with self.lock:
+            for key in keys:
+                self.in_flight.pop(key, None)
+
+    def fetch(self, requests):
+        # requests maps tickers to their start date (None for the whole history).
+        # Returns ({ticker: Close series}, {ticker: error})
+        futures = {}
+        new_requests = {}
+        with self.lock:
+            for ticker, start in requests.items():
+                key = (ticker, None if start is None else pd.Timestamp(start))
+                if key in self.in_flight:
+                    futures[ticker] = self.in_flight[key]
+                else:
+                    new_requests.setdefault(key[1], []).append(ticker)
+            for start, tickers in new_requests.items():
+                for first in range(0, len(tickers), self.batch_size):
+                    batch = tickers[first:first + self.batch_size]
+                    keys = [(ticker, start) for ticker in batch]
+                    future = self.executor.submit(self._fetch_batch, batch, start)
+                    for ticker, key in zip(batch, keys):
+                        self.in_flight[key] = future
+                        futures[ticker] = future
+                    # Registered first, so a batch that is already done is released right away
+                    future.add_done_callback(lambda _, keys=keys: self._release(keys))
+
+        closes = {}
+        errors = {}
+        for ticker, future in futures.items():
+            try:
+                batch_closes, batch_errors = future.result()
+            except Exception as error:
+                errors[ticker] = error
+                continue
+            if ticker in batch_errors:
+                errors[ticker] = batch_errors[ticker]
+            else:
+                closes[ticker] = batch_closes[ticker]
+        return closes, errors
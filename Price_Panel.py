@@ -0,0 +1,97 @@
+import json
+import os
+import shutil
+import numpy as np
+import pandas as pd
+
+
+def day_number(date):
+    # Days since 1970-01-01 of a date, timestamp or YYYY-MM-DD string
+    return int(np.datetime64(pd.Timestamp(date).date(), 'D').astype(np.int64))
+
+
+class PricePanel:
+    """Series sharing one set of days, as a contiguous float32 (day x column) matrix and an int64 day index.
+
+    Days are counted from 1970-01-01 and sorted, so a window is found with two binary searches and returned as a view
+    of the matrix. A saved panel is opened memory-mapped, every session and process reading it shares the same pages.
+    """
+
+    def __init__(self, days, columns, values):
+        self.days = days
+        self.columns = list(columns)
+        self.values = values
+        self.positions = {column: position for position, column in enumerate(self.columns)}
+
+    @classmethod
+    def from_frame(cls, frame):
+        # From a dates x columns dataframe
+        days = pd.DatetimeIndex(frame.index).to_numpy(dtype='datetime64[D]').astype(np.int64)
+        return cls(days, frame.columns, np.ascontiguousarray(frame.to_numpy(dtype=np.float32)))
+
+    @property
+    def dates(self):
+        return pd.DatetimeIndex(self.days.astype('datetime64[D]'), name='Date')
+
+    @property
+    def nbytes(self):
+        return self.values.nbytes + self.days.nbytes
+
+    def bounds(self, from_date, to_date):
+        # Rows of the days between two dates, both included
+        first = int(np.searchsorted(self.days, day_number(from_date), side='left'))
+        last = int(np.searchsorted(self.days, day_number(to_date), side='right'))
+        return first, max(first, last)
+
+    def window(self, from_date, to_date):
+        # (days, values) between two dates, both views of the panel
+        first, last = self.bounds(from_date, to_date)
+        return self.days[first:last], self.values[first:last]
+
+    def frame(self, from_date, to_date, columns=None):
+        # Dataframe of a window, on a view of the panel unless some columns are picked
+        days, values = self.window(from_date, to_date)
+        if columns is not None:
+            values = values[:, [self.positions[column] for column in columns]]
+        else:
+            columns = self.columns
+        return pd.DataFrame(values, index=pd.DatetimeIndex(days.astype('datetime64[D]'), name='Date'), columns=columns,
+                            copy=False)
+
+    def save(self, directory, meta=None):
+        # Writes the panel to a new directory in one rename and returns it memory-mapped from there.
+        # A directory already written, e.g. by another process, is kept as it is
+        if not os.path.exists(directory):
+            temporary_dir = f'{directory}.{os.getpid()}.tmp'
+            shutil.rmtree(temporary_dir, ignore_errors=True)
+            os.makedirs(temporary_dir)
+            np.save(os.path.join(temporary_dir, 'days.npy'), self.days)
+            np.save(os.path.join(temporary_dir, 'values.npy'), self.values)
+            with open(os.path.join(temporary_dir, 'columns.json'), 'w') as file:
+                json.dump({'columns': self.columns, 'meta': meta or {}}, file)
+            try:
+                os.rename(temporary_dir, directory)
+            except OSError:
+                shutil.rmtree(temporary_dir, ignore_errors=True)
+        return self.open(directory)[0]
+
+    @classmethod
+    def open(cls, directory):
+        # (panel, meta) of a saved panel, or (None, None) if there is none
+        if not os.path.exists(os.path.join(directory, 'columns.json')):
+            return None, None
+        with open(os.path.join(directory, 'columns.json')) as file:
+            header = json.load(file)
+        days = np.load(os.path.join(directory, 'days.npy'))
+        values = np.load(os.path.join(directory, 'values.npy'), mmap_mode='r')
+        return cls(days, header['columns'], values), header['meta']
+
+
+def remove_old_panels(parent_dir, keep):
+    # Deletes the saved panels in a directory except the ones named in keep. Sessions still reading a deleted panel
+    # keep their mapping, the files are freed once they let go of it
+    if not os.path.isdir(parent_dir):
+        return
+    for name in os.listdir(parent_dir):
+        if name not in keep:
+            shutil.rmtree(os.path.join(parent_dir, name), ignore_errors=True)
@@ -0,0 +1,165 @@
+import os
+import threading
+import time
+from urllib.parse import quote
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+from Price_Fetcher import PriceFetcher
+
+
+class YahooPriceSource:
+    """Daily closes from Yahoo! Finance."""
+
+    def history(self, tickers, start=None):
+        # Close prices (dates x tickers) from start, or the whole history when start is None
+        import yfinance as yf
+
+        if start is None:
+            data = yf.download(tickers, period='max', auto_adjust=True, progress=False)
+        else:
+            data = yf.download(tickers, start=start, auto_adjust=True, progress=False)
+        close_prices = data['Close']
+        if isinstance(close_prices, pd.Series):
+            close_prices = close_prices.to_frame(tickers[0])
+        close_prices.index = pd.DatetimeIndex(close_prices.index).tz_localize(None)
+        return close_prices
+
+
+class LocalPriceSource:
+    """Fixed close prices (dates x tickers), standing in for Yahoo! Finance offline.
+
+    Each call can be slowed down by `latency` seconds, and fails if it asks for one of the `failing` tickers.
+    """
+
+    def __init__(self, close_prices, latency=0.0, failing=()):
+        self.close_prices = close_prices
+        self.latency = latency
+        self.failing = set(failing)
+        self.requests = []
+
+    @classmethod
+    def from_csv(cls, file_name):
+        return cls(pd.read_csv(file_name, index_col=0, parse_dates=True))
+
+    def history(self, tickers, start=None):
+        self.requests.append((list(tickers), start))
+        time.sleep(self.latency)
+        if self.failing.intersection(tickers):
+            raise RuntimeError(f'failed to fetch {sorted(self.failing.intersection(tickers))}')
+        close_prices = self.close_prices.reindex(columns=list(tickers))
+        if start is not None:
+            close_prices = close_prices[close_prices.index >= pd.Timestamp(start)]
+        return close_prices
+
+
+class PriceStore:
+    """Close histories kept on disk, one Arrow file per ticker, topped up with only the missing tail."""
+
+    def __init__(self, directory, source=None, max_age=12 * 3600, fetcher=None):
+        self.directory = directory
+        if fetcher is None:
+            fetcher = PriceFetcher(source if source is not None else YahooPriceSource())
+        self.fetcher = fetcher
+        # Tickers checked less than max_age seconds ago are not fetched again
+        self.max_age = max_age
+        self.histories = {}
+        self.errors = {}
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, ticker):
+        return os.path.join(self.directory, quote(ticker, safe='') + '.arrow')
+
+    def history(self, ticker):
+        # Stored Close series of a ticker and when it was last checked, (None, 0) if never fetched
+        if ticker not in self.histories:
+            path = self._path(ticker)
+            if os.path.exists(path):
+                with pa.OSFile(path, 'rb') as source:
+                    table = pa.ipc.open_file(source).read_all()
+                close = pd.Series(table.column('Close').to_numpy(), index=pd.DatetimeIndex(table.column('Date').to_numpy()),
+                                  name=ticker)
+                self.histories[ticker] = (close, float(table.schema.metadata[b'checked']))
+            else:
+                self.histories[ticker] = (None, 0)
+        return self.histories[ticker]
+
+    def _save(self, ticker, close, checked):
+        table = pa.table({'Date': pa.array(close.index.to_numpy(dtype='datetime64[ns]')),
+                          'Close': pa.array(close.to_numpy(dtype=np.float64))})
+        table = table.replace_schema_metadata({b'checked': str(checked).encode()})
+        temporary_path = f'{self._path(ticker)}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with pa.OSFile(temporary_path, 'wb') as sink:
+            with pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+        os.replace(temporary_path, self._path(ticker))
+        self.histories[ticker] = (close, checked)
+
+    def update(self, tickers):
+        # Fetch the whole history of new tickers and only the days from the one before the last stored for the others.
+        # Returns the tickers that could not be fetched with their errors
+        now = time.time()
+        requests = {}
+        for ticker in dict.fromkeys(tickers):
+            close, checked = self.history(ticker)
+            if close is None:
+                requests[ticker] = None
+            elif now - checked < self.max_age:
+                continue
+            elif len(close) < 2:
+                requests[ticker] = None
+            else:
+                # The last stored day may have been a close taken while the market was open, so it is always
+                # fetched again. The day before it is final and fetched too, a change there means the history was
+                # adjusted for a split or dividend
+                requests[ticker] = close.index[-2]
+
+        fetched, errors = self.fetcher.fetch(requests)
+        refetch = {}
+        for ticker, tail in fetched.items():
+            start = requests[ticker]
+            if start is None:
+                self._save(ticker, tail.rename(ticker), now)
+                continue
+            close, _ = self.history(ticker)
+            if tail.empty or tail.index[-1] < close.index[-1]:
+                # Delisted, or no prices for the last stored day: the history is kept as it is
+                errors[ticker] = LookupError(f'no prices for {ticker} since {start.date()}')
+                continue
+            if tail.index[0] == start and not np.isclose(tail.iloc[0], close.loc[start]):
+                refetch[ticker] = None
+                continue
+            self._save(ticker, pd.concat([close[close.index <= start], tail[tail.index > start]]).rename(ticker), now)
+
+        if refetch:
+            fetched, refetch_errors = self.fetcher.fetch(refetch)
+            errors.update(refetch_errors)
+            for ticker, close in fetched.items():
+                self._save(ticker, close.rename(ticker), now)
+        self.errors = errors
+        return errors
+
+    def first_trade_date(self, ticker):
+        close, _ = self.history(ticker)
+        return close.index[0].date() if close is not None and not close.empty else None
+
+    def closes(self, tickers, start=None):
+        # Close prices (dates x tickers) from start, for the tickers that have prices
+        histories = [self.history(ticker)[0] for ticker in tickers]
+        close_prices = pd.concat([close for close in histories if close is not None], axis=1)
+        if start is not None:
+            close_prices = close_prices[close_prices.index >= pd.Timestamp(start)]
+        return close_prices
+
+
+# One fetcher for the whole process, so every Streamlit session shares its rate limit and in-flight requests
+_shared_fetcher = None
+_shared_fetcher_lock = threading.Lock()
+
+
+def shared_fetcher():
+    global _shared_fetcher
+    with _shared_fetcher_lock:
+        if _shared_fetcher is None:
+            _shared_fetcher = PriceFetcher(YahooPriceSource())
+        return _shared_fetcher
@@ -0,0 +1,233 @@
+import argparse
+import os
+import time
+import numpy as np
+import pandas as pd
+from Ingestion import FileLock, publish
+from Portfolio_Journal import PortfolioJournal
+from Portfolio_State import PortfolioState
+from Strategy import DEFAULT_STRATEGY
+
+
+class SnapshotPanel:
+    """Every daily snapshot as one (day x ticker) price and membership panel."""
+
+    def __init__(self, dates, tickers, prices, members, first_order, sectors, sector_codes, caps, cap_codes):
+        self.dates = dates
+        self.tickers = tickers
+        self.prices = prices
+        self.members = members
+        # Position of each ticker in the first snapshot, which is the row order create_portfolio keeps
+        self.first_order = first_order
+        self.sectors = sectors
+        self.sector_codes = sector_codes
+        self.caps = caps
+        self.cap_codes = cap_codes
+
+
+def build_panel(snapshots):
+    # snapshots is a list of (date, dataframe) in date order, dataframes as returned by excel_to_dataframe
+    dates = [date for date, _ in snapshots]
+    frames = [dataframe for _, dataframe in snapshots]
+    all_tickers = pd.Index(np.concatenate([frame.index.to_numpy(dtype=object) for frame in frames]))
+    tickers = all_tickers.unique().sort_values()
+    sectors, sector_values = pd.factorize(pd.concat([frame['Sector'] for frame in frames]))
+    caps, cap_values = pd.factorize(pd.concat([frame['Market Cap Category'] for frame in frames]))
+
+    n_days, n_tickers = len(frames), len(tickers)
+    prices = np.full((n_days, n_tickers), np.nan)
+    members = np.zeros((n_days, n_tickers), dtype=bool)
+    sector_codes = np.full((n_days, n_tickers), -1, dtype=np.int32)
+    cap_codes = np.full((n_days, n_tickers), -1, dtype=np.int32)
+    offset = 0
+    for day, frame in enumerate(frames):
+        columns = tickers.get_indexer(frame.index)
+        prices[day, columns] = frame['Price'].to_numpy(dtype=np.float64)
+        members[day, columns] = True
+        sector_codes[day, columns] = sectors[offset:offset + len(frame)]
+        cap_codes[day, columns] = caps[offset:offset + len(frame)]
+        offset += len(frame)
+
+    first_order = np.zeros(n_tickers, dtype=np.int64)
+    first_order[tickers.get_indexer(frames[0].index)] = np.arange(len(frames[0]))
+    # Missing sectors and caps are coded -1, which picks the trailing None
+    sector_values = np.append(np.asarray(sector_values, dtype=object), None)
+    cap_values = np.append(np.asarray(cap_values, dtype=object), None)
+    return SnapshotPanel(dates, tickers, prices, members, first_order, sector_values, sector_codes, cap_values,
+                         cap_codes)
+
+
+def _first_step(condition, steps, starts, never):
+    # First holding step in each position where the condition holds, or `never`
+    return np.minimum.reduceat(np.where(condition, steps, never), starts)
+
+
+def replay_history(snapshots, strategy=None, with_overdraft=False, with_exposure=False):
+    # Replays every snapshot at once and returns the same PortfolioState and smart_tracking frame as feeding
+    # the files one by one to create_portfolio and update_portfolio. with_overdraft adds the daily Overdraft
+    # of the open positions to the tracking frame, with_exposure also returns their daily exposure by sector and
+    # market cap as PortfolioJournal.exposure does
+    panel = snapshots if isinstance(snapshots, SnapshotPanel) else build_panel(snapshots)
+    strategy = strategy if strategy is not None else DEFAULT_STRATEGY
+    n_days = len(panel.dates)
+
+    # One element per (position, day held), positions contiguous and days increasing
+    ticker_of, day = np.nonzero(panel.members.T)
+    new_run = np.ones(len(day), dtype=bool)
+    new_run[1:] = (ticker_of[1:] != ticker_of[:-1]) | (day[1:] != day[:-1] + 1)
+    starts = np.flatnonzero(new_run)
+    ends = np.append(starts[1:], len(day))
+    position = np.cumsum(new_run) - 1
+    lot_ticker = ticker_of[starts]
+    buy_day = day[starts]
+    last_day = day[ends - 1]
+    step = day - buy_day[position]
+    price = panel.prices[day, ticker_of]
+
+    # Buys: the first snapshot is split equally, later buys get the new allocation
+    allocation = np.where(buy_day == 0, 1 / panel.members[0].sum(), strategy.new_allocation)
+    first_value = allocation * strategy.capital
+    first_price = price[starts]
+    never = n_days + 1
+
+    # Second Entry: entry_days after the first entry or an entry_gain over its price
+    second_step = _first_step(
+        (step >= 1) & ((step == strategy.entry_days) | (price > first_price[position] * strategy.entry_gain)),
+        step, starts, never)
+    second_price = np.where(second_step < never, price[starts + np.minimum(second_step, ends - starts - 1)], np.nan)
+
+    # Third Entry: the same after the second entry
+    since_second = step - second_step[position]
+    third_step = _first_step((since_second >= 1) & (
+        (since_second == strategy.entry_days) | (price > second_price[position] * strategy.entry_gain)),
+        step, starts, never)
+    third_price = np.where(third_step < never, price[starts + np.minimum(third_step, ends - starts - 1)], np.nan)
+
+    # Quantity, Investment and Total Amount for every day held
+    has_second = step >= second_step[position]
+    has_third = step >= third_step[position]
+    quantity = first_value[position] / first_price[position]
+    top_up = strategy.top_up
+    quantity = quantity + np.where(has_second, top_up / second_price[position], 0)
+    quantity = quantity + np.where(has_third, top_up / third_price[position], 0)
+    investment = first_value[position] + np.where(has_second, top_up, 0) + np.where(has_third, top_up, 0)
+    total_amount = np.where(step == 0, first_value[position], quantity * price)
+
+    # Daily sums: Allocation is over the positions held since before the day, the Overdraft over all open ones
+    amounts = np.nan_to_num(total_amount)
+    held_sum = np.bincount(day, weights=np.where(step >= 1, amounts, 0), minlength=n_days)
+    open_sum = np.bincount(day, weights=amounts, minlength=n_days)
+
+    # Every position as it looks on its last day held
+    last = ends - 1
+    last_step = step[last]
+    last_amount = total_amount[last]
+    last_sum = open_sum[last_day]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        last_allocation = np.where(last_step == 0, allocation, last_amount / held_sum[last_day])
+        scaled = (last_day > 0) & (last_sum > strategy.overdraft_cap)
+        last_value = np.where(scaled, last_amount * (strategy.overdraft_cap / last_sum), last_amount)
+        last_roi = np.where(last_step == 0, 0, (last_amount / investment[last] - 1) * 100)
+    second_reached = last_step >= second_step
+    third_reached = last_step >= third_step
+
+    # Smart tracking: open positions plus the sold ones, frozen at their last day
+    sold = last_day < n_days - 1
+    sold_amount = np.bincount(last_day[sold] + 1, weights=np.nan_to_num(last_amount[sold]), minlength=n_days)
+    sold_investment = np.bincount(last_day[sold] + 1, weights=investment[last][sold], minlength=n_days)
+    tracking = pd.DataFrame({
+        'Total Amount': open_sum + np.cumsum(sold_amount),
+        'Investment': np.bincount(day, weights=investment, minlength=n_days) + np.cumsum(sold_investment),
+    }, index=pd.to_datetime(panel.dates))
+    if with_overdraft:
+        # The first day is only bought, the cap applies from the first update on
+        overdraft = np.maximum(open_sum - strategy.overdraft_cap, 0)
+        overdraft[0] = 0
+        tracking['Overdraft'] = overdraft
+
+    # Rows in the order they were bought: first snapshot order, then alphabetical within each day
+    rank = np.where(buy_day == 0, panel.first_order[lot_ticker], lot_ticker)
+    order = np.lexsort((rank, buy_day))
+    tickers = panel.tickers.to_numpy(dtype=object)[lot_ticker]
+    dates = np.asarray(panel.dates, dtype=object)
+    columns = {
+        'Days Holding': last_step,
+        'ROI': last_roi,
+        'Sector': panel.sectors[panel.sector_codes[buy_day, lot_ticker]],
+        'Market Cap': panel.caps[panel.cap_codes[buy_day, lot_ticker]],
+        'Allocation': last_allocation,
+        'Value': last_value,
+        'Overdraft': last_amount - last_value,
+        'Total Amount': last_amount,
+        'Yesterday Price': np.where(last_step >= 1, price[np.maximum(last - 1, 0)], np.nan),
+        'Today Price': price[last],
+        'First Entry': np.ones(len(starts), dtype=bool),
+        'First Entry Price': first_price,
+        'Days Since First Entry': np.minimum(last_step, second_step),
+        'Second Entry': second_reached,
+        'Second Entry Price': np.where(second_reached, second_price, np.nan),
+        'Days Since Second Entry': np.where(second_reached, np.minimum(last_step, third_step) - second_step, 0),
+        'Third Entry': third_reached,
+        'Third Entry Price': np.where(third_reached, third_price, np.nan),
+        'Quantity': quantity[last],
+        'Investment': investment[last],
+        'Buy Date': dates[buy_day],
+        'Sell Date': np.where(sold, dates[np.minimum(last_day + 1, n_days - 1)], None),
+    }
+    columns = {name: values[order] for name, values in columns.items()}
+    tickers, sold, last_day = tickers[order], sold[order], last_day[order]
+
+    close_step = np.where(sold, last_day, 0)
+    state = PortfolioState.from_arrays(columns, tickers, ~sold, close_step, steps=n_days - 1, strategy=strategy)
+    if not with_exposure:
+        return state, tracking
+
+    # Total Amount of the positions open each day, summed per (day, category) of their lot
+    exposure = {}
+    for name, values, codes in (('Sector', panel.sectors, panel.sector_codes),
+                                ('Market Cap', panel.caps, panel.cap_codes)):
+        lot_codes = codes[buy_day, lot_ticker][position]
+        known = lot_codes >= 0
+        n_values = len(values) - 1
+        sums = np.bincount(day[known] * n_values + lot_codes[known], weights=amounts[known],
+                           minlength=n_days * n_values).reshape(n_days, n_values)
+        exposure[name] = pd.DataFrame(sums, index=pd.to_datetime(panel.dates),
+                                      columns=pd.Index(values[:-1], name=name))
+    return state, tracking, exposure
+
+
+def load_snapshots(data_dir):
+    # Every downloaded snapshot in the data directory, in date order
+    from Snapshot_Cache import read_snapshots
+
+    file_names = sorted(name for name in os.listdir(data_dir) if name.endswith('.xlsx'))
+    return read_snapshots([os.path.join(data_dir, name) for name in file_names])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Rebuild the smart portfolio from every downloaded snapshot.')
+    parser.add_argument('--data-dir', default='data', help='directory with the daily .xlsx snapshots')
+    parser.add_argument('--output-dir', default=None, help='where to write the CSVs (defaults to --data-dir)')
+    args = parser.parse_args()
+    output_dir = args.output_dir or args.data_dir
+
+    start = time.perf_counter()
+    snapshots = load_snapshots(args.data_dir)
+    loaded = time.perf_counter()
+    state, tracking, exposure = replay_history(snapshots, with_exposure=True)
+    replayed = time.perf_counter()
+
+    os.makedirs(output_dir, exist_ok=True)
+    # The app starts from the journal checkpoint, the CSVs are kept as an export. The lock keeps a running app or
+    # daemon from appending to the journal while it is replaced, and the new portfolio is published before release
+    with FileLock(os.path.join(output_dir, '.ingest.lock')):
+        journal = PortfolioJournal(output_dir)
+        journal.reset(state, tracking, exposure)
+        publish(output_dir, journal)
+    state.to_dataframe().to_csv(os.path.join(output_dir, 'smart_portfolio.csv'))
+    tracking.to_csv(os.path.join(output_dir, 'returns.csv'))
+    print(f'Replayed {len(snapshots)} snapshots: loading {loaded - start:.2f}s, replay {replayed - loaded:.2f}s')
+
+
+if __name__ == '__main__':
+    main()
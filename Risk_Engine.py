@@ -0,0 +1,321 @@
+import os
+import pickle
+import numpy as np
+import pandas as pd
+
+# Trading days a year, daily figures are annualized with it
+PERIODS = 252
+
+
+class RiskEngine:
+    """Risk metrics of daily return series, kept as online accumulators.
+
+    Each series has a Welford mean and squared deviation, the sum of its squared returns below the target, its
+    co-moments with every benchmark over the days it has a return, its wealth and running peak, and its last `window`
+    returns in a ring buffer with their own Welford mean and deviation. A new day updates all of them in constant time,
+    however long the history. A batch of days or of new series is reduced with numpy and merged with Chan's formulas.
+    """
+
+    def __init__(self, names, benchmarks, window=63, risk_free=0.0):
+        self.benchmarks = list(benchmarks)
+        self.window = window
+        # Daily return Sharpe and Sortino are measured against
+        self.target = risk_free / PERIODS
+        self.names = []
+        self.positions = {}
+        self.dates = []
+        # (date, Total Amount, Investment) of the last tracking day fed, see update_risk_engine
+        self.tracked = None
+        n_benchmarks = len(self.benchmarks)
+        self.n = np.zeros(0)
+        self.mean = np.zeros(0)
+        self.m2 = np.zeros(0)
+        self.downside = np.zeros(0)
+        self.benchmark_mean = np.zeros((0, n_benchmarks))
+        self.benchmark_m2 = np.zeros((0, n_benchmarks))
+        self.comoment = np.zeros((0, n_benchmarks))
+        self.wealth = np.zeros(0)
+        self.peak = np.zeros(0)
+        self.max_drawdown = np.zeros(0)
+        # Ring buffer of the last `window` days, head is the slot the next day goes to
+        self.ring = np.zeros((window, 0))
+        self.head = 0
+        self.rolling_n = np.zeros(0)
+        self.rolling_mean = np.zeros(0)
+        self.rolling_m2 = np.zeros(0)
+        self.since_resync = 0
+        self._grow(names)
+
+    @property
+    def last_date(self):
+        return self.dates[-1] if self.dates else None
+
+    def _grow(self, names):
+        names = [name for name in names if name not in self.positions]
+        k = len(names)
+        for name in names:
+            self.positions[name] = len(self.names)
+            self.names.append(name)
+
+        def extend(array, fill=0.0):
+            return np.concatenate([array, np.full((k,) + array.shape[1:], fill)])
+
+        self.n, self.mean, self.m2, self.downside = (extend(array) for array in (self.n, self.mean, self.m2,
+                                                                                 self.downside))
+        self.benchmark_mean = extend(self.benchmark_mean)
+        self.benchmark_m2 = extend(self.benchmark_m2)
+        self.comoment = extend(self.comoment)
+        self.wealth = extend(self.wealth, 1.0)
+        self.peak = extend(self.peak, 1.0)
+        self.max_drawdown = extend(self.max_drawdown)
+        self.ring = np.concatenate([self.ring, np.full((self.window, k), np.nan)], axis=1)
+        self.rolling_n = extend(self.rolling_n)
+        self.rolling_mean = extend(self.rolling_mean)
+        self.rolling_m2 = extend(self.rolling_m2)
+        return slice(len(self.names) - k, len(self.names))
+
+    def update(self, date, returns, benchmark_returns):
+        # One day: returns of every series in `names` order (NaN when a series has none) and of every benchmark
+        x = np.asarray(returns, dtype=np.float64)
+        y = np.asarray(benchmark_returns, dtype=np.float64)
+        valid = ~np.isnan(x)
+        xv = x[valid]
+        n = self.n[valid] + 1
+        self.n[valid] = n
+        dx = xv - self.mean[valid]
+        mean = self.mean[valid] + dx / n
+        self.mean[valid] = mean
+        self.m2[valid] += dx * (xv - mean)
+        dy = y - self.benchmark_mean[valid]
+        benchmark_mean = self.benchmark_mean[valid] + dy / n[:, None]
+        self.benchmark_mean[valid] = benchmark_mean
+        self.benchmark_m2[valid] += dy * (y - benchmark_mean)
+        self.comoment[valid] += dx[:, None] * (y - benchmark_mean)
+        self.downside[valid] += np.minimum(xv - self.target, 0) ** 2
+
+        # Drawdown from the running peak of each series' wealth
+        self.wealth[valid] *= 1 + xv
+        self.peak = np.maximum(self.peak, self.wealth)
+        self.max_drawdown = np.minimum(self.max_drawdown, self.wealth / self.peak - 1)
+
+        # The day replaces the oldest one in the window
+        self._remove(self.ring[self.head])
+        self._add(x)
+        self.ring[self.head] = x
+        self.head = (self.head + 1) % self.window
+        self.dates.append(date)
+        self.since_resync += 1
+        if self.since_resync >= self.window:
+            # Adding and removing leaves rounding errors behind, start again from the buffer once per window
+            self._resync()
+
+    def _add(self, x):
+        valid = ~np.isnan(x)
+        n = self.rolling_n[valid] + 1
+        self.rolling_n[valid] = n
+        delta = x[valid] - self.rolling_mean[valid]
+        mean = self.rolling_mean[valid] + delta / n
+        self.rolling_mean[valid] = mean
+        self.rolling_m2[valid] += delta * (x[valid] - mean)
+
+    def _remove(self, x):
+        valid = ~np.isnan(x)
+        n = self.rolling_n[valid] - 1
+        self.rolling_n[valid] = n
+        delta = x[valid] - self.rolling_mean[valid]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            mean = np.where(n > 0, self.rolling_mean[valid] - delta / n, 0)
+        self.rolling_mean[valid] = mean
+        self.rolling_m2[valid] = np.where(n > 0, self.rolling_m2[valid] - delta * (x[valid] - mean), 0)
+
+    def _resync(self):
+        n, mean, m2 = _welford(self.ring)
+        self.rolling_n, self.rolling_mean, self.rolling_m2 = n, mean, m2
+        self.since_resync = 0
+
+    def extend(self, dates, returns, benchmark_returns):
+        # A batch of days (days x series and days x benchmarks), e.g. a backfill, reduced with numpy
+        x = np.asarray(returns, dtype=np.float64).reshape(len(dates), len(self.names))
+        y = np.asarray(benchmark_returns, dtype=np.float64).reshape(len(dates), len(self.benchmarks))
+        if not len(dates):
+            return
+        self._merge(slice(None), x, y)
+        # The batch's last days go to the next slots of the ring
+        m = min(len(dates), self.window)
+        slots = (self.head + np.arange(m)) % self.window
+        self.ring[slots] = x[-m:]
+        self.head = (self.head + m) % self.window
+        self._resync()
+        self.dates.extend(dates)
+
+    def add_series(self, names, returns=None, benchmark_returns=None):
+        # New series, with their returns over the days already fed (days x new series, aligned with `dates`) or
+        # starting from the next day
+        columns = self._grow(names)
+        if returns is None or not len(self.dates):
+            return
+        x = np.asarray(returns, dtype=np.float64).reshape(len(self.dates), columns.stop - columns.start)
+        y = np.asarray(benchmark_returns, dtype=np.float64).reshape(len(self.dates), len(self.benchmarks))
+        self._merge(columns, x, y)
+        # The last days are the slots before the head
+        m = min(len(self.dates), self.window)
+        slots = (self.head - np.arange(m, 0, -1)) % self.window
+        self.ring[slots, columns] = x[-m:]
+        self._resync()
+
+    def _merge(self, columns, x, y):
+        # Folds the moments of a batch into the accumulators of some columns, with Chan et al.'s pairwise update
+        n_b, mean_b, m2_b, benchmark_mean_b, benchmark_m2_b, comoment_b = _comoments(x, y)
+        n_a = self.n[columns]
+        n = n_a + n_b
+        with np.errstate(divide='ignore', invalid='ignore'):
+            share = np.where(n > 0, n_b / n, 0)
+            weight = np.where(n > 0, n_a * n_b / n, 0)
+        dx = mean_b - self.mean[columns]
+        dy = benchmark_mean_b - self.benchmark_mean[columns]
+        self.n[columns] = n
+        self.mean[columns] += dx * share
+        self.m2[columns] += m2_b + dx ** 2 * weight
+        self.benchmark_mean[columns] += dy * share[:, None]
+        self.benchmark_m2[columns] += benchmark_m2_b + dy ** 2 * weight[:, None]
+        self.comoment[columns] += comoment_b + dx[:, None] * dy * weight[:, None]
+        self.downside[columns] += np.nansum(np.minimum(x - self.target, 0) ** 2, axis=0)
+
+        wealth = self.wealth[columns] * np.cumprod(1 + np.nan_to_num(x), axis=0)
+        peak = np.maximum(self.peak[columns], np.maximum.accumulate(wealth, axis=0))
+        self.max_drawdown[columns] = np.minimum(self.max_drawdown[columns], (wealth / peak - 1).min(axis=0))
+        self.wealth[columns] = wealth[-1]
+        self.peak[columns] = peak[-1]
+
+    def metrics(self):
+        # One row per series, annualized. Beta and correlation are over the days the series has a return
+        annual = np.sqrt(PERIODS)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            std = np.where(self.n > 1, np.sqrt(self.m2 / (self.n - 1)), np.nan)
+            rolling_std = np.where(self.rolling_n > 1, np.sqrt(self.rolling_m2 / (self.rolling_n - 1)), np.nan)
+            excess = np.where(self.n > 0, self.mean - self.target, np.nan)
+            downside_std = np.sqrt(self.downside / self.n)
+            beta = self.comoment / self.benchmark_m2
+            correlation = self.comoment / np.sqrt(self.m2[:, None] * self.benchmark_m2)
+            metrics = pd.DataFrame({
+                'Days': self.n.astype(np.int64),
+                'Volatility': std * annual,
+                f'Volatility {self.window}d': rolling_std * annual,
+                'Sharpe': excess / std * annual,
+                'Sortino': excess / downside_std * annual,
+                'Max Drawdown': self.max_drawdown,
+                'Drawdown': self.wealth / self.peak - 1,
+            }, index=pd.Index(self.names, name='Series'))
+        for position, benchmark in enumerate(self.benchmarks):
+            metrics[f'Beta {benchmark}'] = beta[:, position]
+            metrics[f'Correlation {benchmark}'] = correlation[:, position]
+        return metrics.replace([np.inf, -np.inf], np.nan)
+
+    def save(self, path):
+        temporary_path = f'{path}.{os.getpid()}.tmp'
+        with open(temporary_path, 'wb') as file:
+            pickle.dump(self, file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temporary_path, path)
+        return self
+
+    @classmethod
+    def load(cls, path):
+        # The engine saved at path, or None if there is none
+        if not os.path.exists(path):
+            return None
+        with open(path, 'rb') as file:
+            return pickle.load(file)
+
+
+def _welford(x):
+    # Count, mean and squared deviation of every column, NaNs left out
+    valid = ~np.isnan(x)
+    n = valid.sum(axis=0).astype(np.float64)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean = np.where(n > 0, np.where(valid, x, 0).sum(axis=0) / n, 0)
+    m2 = (np.where(valid, x - mean, 0) ** 2).sum(axis=0)
+    return n, mean, m2
+
+
+def _comoments(x, y):
+    # Moments of each column of x (days x series, NaN on the days a series has no return) and of the benchmarks y
+    # (days x benchmarks) over that column's days, computed on deviations so the sums do not cancel out
+    n, mean, m2 = _welford(x)
+    valid = (~np.isnan(x)).astype(np.float64)
+    centered = np.where(valid > 0, x - mean, 0)
+    shifted = y - y.mean(axis=0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        offset = np.where(n[:, None] > 0, (valid.T @ shifted) / n[:, None], 0)
+    benchmark_mean = np.where(n[:, None] > 0, y.mean(axis=0) + offset, 0)
+    benchmark_m2 = valid.T @ shifted ** 2 - n[:, None] * offset ** 2
+    comoment = centered.T @ shifted
+    return n, mean, m2, benchmark_mean, benchmark_m2, comoment
+
+
+def tracking_returns(tracking, closes, benchmark_closes, after=None):
+    # Daily returns on the tracking days after `after` (all of them when None): the portfolio's net of the money
+    # invested that day, and the benchmarks' and stocks' from their closes as of each day. A dataframe with a
+    # Portfolio column, the benchmarks and the stocks, without the days a benchmark has no return
+    dates = pd.DatetimeIndex(tracking.index)
+    start = 0 if after is None else max(int(dates.searchsorted(pd.Timestamp(after), side='right')) - 1, 0)
+    days = dates[start:]
+    amount = tracking['Total Amount'].to_numpy(dtype=np.float64)[start:]
+    investment = tracking['Investment'].to_numpy(dtype=np.float64)[start:]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        portfolio = (amount[1:] - np.diff(investment)) / amount[:-1] - 1
+
+        def price_returns(prices):
+            prices = prices.sort_index().reindex(days, method='ffill').to_numpy(dtype=np.float64)
+            return prices[1:] / prices[:-1] - 1
+
+        benchmark_returns = price_returns(benchmark_closes)
+        stock_returns = price_returns(closes)
+    keep = ~np.isnan(benchmark_returns).any(axis=1)
+    return pd.DataFrame(np.column_stack([portfolio, benchmark_returns, stock_returns])[keep], index=days[1:][keep],
+                        columns=['Portfolio'] + list(benchmark_closes.columns) + list(closes.columns))
+
+
+def update_risk_engine(engine, tracking, closes, benchmark_closes, window=63, batch_days=5):
+    # Brings an engine up to the last tracking day. New stocks get their history in one batch, new days go one at a
+    # time, or as one batch past batch_days. An engine whose last day no longer matches the tracking series, e.g.
+    # after the journal was rebuilt, is replaced by a new one fed the whole history in one batch
+    benchmarks = list(benchmark_closes.columns)
+    if engine is not None and (engine.benchmarks != benchmarks or not _matches(engine, tracking)):
+        engine = None
+    if engine is None:
+        engine = RiskEngine(['Portfolio'] + benchmarks, benchmarks, window)
+
+    new = [ticker for ticker in closes.columns if ticker not in engine.positions]
+    if new and engine.dates:
+        # Their returns over the days already fed
+        history = tracking_returns(tracking.loc[:engine.last_date], closes[new], benchmark_closes)
+        history = history.reindex(pd.to_datetime(engine.dates))
+        engine.add_series(new, history[new].to_numpy(), history[benchmarks].to_numpy())
+    elif new:
+        engine.add_series(new)
+
+    returns = tracking_returns(tracking, closes, benchmark_closes, engine.last_date)
+    dates = [day.strftime('%Y-%m-%d') for day in returns.index]
+    benchmark_returns = returns[benchmarks].to_numpy()
+    returns = returns.reindex(columns=engine.names).to_numpy()
+    if len(dates) > batch_days:
+        engine.extend(dates, returns, benchmark_returns)
+    else:
+        for day, day_returns, day_benchmark_returns in zip(dates, returns, benchmark_returns):
+            engine.update(day, day_returns, day_benchmark_returns)
+    if len(tracking):
+        engine.tracked = (tracking.index[-1].strftime('%Y-%m-%d'), float(tracking['Total Amount'].iloc[-1]),
+                          float(tracking['Investment'].iloc[-1]))
+    return engine
+
+
+def _matches(engine, tracking):
+    # Whether the tracking series still has the values the engine last saw on its last day
+    if engine.tracked is None:
+        return False
+    date, amount, investment = engine.tracked
+    day = pd.Timestamp(date)
+    if day not in tracking.index:
+        return False
+    row = tracking.loc[day]
+    return bool(np.isclose(row['Total Amount'], amount) and np.isclose(row['Investment'], investment))
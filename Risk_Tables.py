@@ -0,0 +1,36 @@
+import streamlit as st
+
+# Metrics shown as percentages
+PERCENTAGES = ['Volatility', 'Max Drawdown', 'Drawdown']
+
+
+def generate_risk_tables(risk_metrics, portfolio_dataframe, benchmarks):
+    # Risk of the portfolio next to the indexes, then of every open holding against one index
+    st.header('Portfolio Risk', divider='gray')
+    rolling = next(column for column in risk_metrics.columns if column.startswith('Volatility '))
+    percentages = PERCENTAGES + [rolling]
+
+    def column_config(columns):
+        config = {column: st.column_config.NumberColumn(format='%.1f%%') for column in columns if column in percentages}
+        config.update({column: st.column_config.NumberColumn(format='%.2f') for column in columns
+                       if column not in percentages and column != 'Days'})
+        return config
+
+    def as_shown(metrics):
+        metrics = metrics.copy()
+        metrics[percentages] = metrics[percentages] * 100
+        return metrics
+
+    summary = as_shown(risk_metrics.loc[['Portfolio'] + benchmarks])
+    st.dataframe(summary, column_config=column_config(summary.columns))
+
+    holdings = portfolio_dataframe.index[portfolio_dataframe['Sell Date'].isna()].unique()
+    holdings = risk_metrics.index.intersection(holdings)
+    if not len(holdings):
+        return
+    st.header('Holdings Risk', divider='gray')
+    benchmark = st.selectbox('Beta and correlation against', benchmarks, 0)
+    columns = ['Days', 'Volatility', rolling, 'Sharpe', 'Sortino', 'Max Drawdown', 'Drawdown', f'Beta {benchmark}',
+               f'Correlation {benchmark}']
+    holdings_metrics = as_shown(risk_metrics.loc[holdings])[columns].sort_values('Volatility', ascending=False)
+    st.dataframe(holdings_metrics, height=300, column_config=column_config(columns))
@@ -0,0 +1,82 @@
+import hashlib
+import os
+import pyarrow as pa
+from Snapshot_Reader import read_excel_snapshot, CLEANING_VERSION
+
+# Columns of the cleaned snapshot kept in the cache, besides the Ticker index
+SNAPSHOT_COLUMNS = ['Price', 'Market Cap ($M USD)', 'Market Cap Category', 'Sector']
+
+
+def cache_path(file_name):
+    # data/2024-09-24.xlsx is cached as data/2024-09-24.arrow
+    return os.path.splitext(file_name)[0] + '.arrow'
+
+
+def file_hash(file_name):
+    digest = hashlib.sha256()
+    with open(file_name, 'rb') as file:
+        for chunk in iter(lambda: file.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _metadata(source_hash):
+    return {b'source_sha256': source_hash.encode(), b'cleaning_version': str(CLEANING_VERSION).encode()}
+
+
+def _read_cached(file_name, source_hash):
+    # Memory-mapped Arrow table for the snapshot, or None if there is no valid cache for these source bytes
+    path = cache_path(file_name)
+    if not os.path.exists(path):
+        return None
+    try:
+        reader = pa.ipc.open_file(pa.memory_map(path, 'r'))
+    except (pa.ArrowInvalid, OSError):
+        return None
+    metadata = reader.schema.metadata or {}
+    if any(metadata.get(key) != value for key, value in _metadata(source_hash).items()):
+        return None
+    return reader.read_all()
+
+
+def _write_cache(file_name, dataframe, source_hash):
+    dataframe = dataframe[SNAPSHOT_COLUMNS].astype({'Price': 'float64', 'Market Cap ($M USD)': 'float64'})
+    table = pa.Table.from_pandas(dataframe)
+    table = table.replace_schema_metadata({**table.schema.metadata, **_metadata(source_hash)})
+    # Write next to the final path and rename, so a crash never leaves a half written cache behind
+    path = cache_path(file_name)
+    temporary_path = f'{path}.{os.getpid()}.tmp'
+    with pa.OSFile(temporary_path, 'wb') as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    os.replace(temporary_path, path)
+    return table
+
+
+def read_snapshot_table(file_name):
+    # Cleaned snapshot as an Arrow table, parsing the Excel file only when its cache is missing or stale
+    source_hash = file_hash(file_name)
+    table = _read_cached(file_name, source_hash)
+    if table is None:
+        table = _write_cache(file_name, read_excel_snapshot(file_name), source_hash)
+    return table
+
+
+def read_snapshot(file_name):
+    # Drop-in replacement for excel_to_dataframe backed by the cache, with the columns the portfolio uses
+    return read_snapshot_table(file_name).to_pandas(split_blocks=True)
+
+
+def read_snapshot_tables(file_names):
+    # Many days at once as one table with a 'Date' column, the days are concatenated without copying
+    tables = []
+    for file_name in file_names:
+        table = read_snapshot_table(file_name)
+        date = os.path.basename(file_name)[:10]
+        tables.append(table.append_column('Date', pa.array([date] * table.num_rows, pa.string())))
+    return pa.concat_tables(tables)
+
+
+def read_snapshots(file_names):
+    # Many days at once as a list of (date, dataframe), the input of replay_history
+    return [(os.path.basename(file_name)[:10], read_snapshot(file_name)) for file_name in file_names]
@@ -0,0 +1,207 @@
+import base64
+import hashlib
+import json
+import os
+import shutil
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from Snapshot_Cache import read_snapshot, cache_path
+from Instrumentation import carry_run, stage
+
+
+class DownloadError(RuntimeError):
+    pass
+
+
+class LocalBlob:
+    """A file in a LocalBucket, with the part of the Firebase Storage blob API the downloader uses."""
+
+    def __init__(self, root, name):
+        self.root = root
+        self.name = name
+        self.md5_hash = md5_hash(os.path.join(root, name))
+        # Changes when the file is written again, like a Storage blob's generation when it is uploaded again
+        self.generation = os.stat(os.path.join(root, name)).st_mtime_ns
+
+    def download_to_filename(self, filename):
+        shutil.copyfile(os.path.join(self.root, self.name), filename)
+
+
+class LocalBucket:
+    """Directory standing in for the Firebase Storage bucket, to run the ingestion offline."""
+
+    def __init__(self, root):
+        self.root = root
+
+    def list_blobs(self, prefix=''):
+        blobs = []
+        for directory, _, file_names in os.walk(self.root):
+            for file_name in file_names:
+                name = os.path.relpath(os.path.join(directory, file_name), self.root).replace(os.sep, '/')
+                if name.startswith(prefix):
+                    blobs.append(LocalBlob(self.root, name))
+        return sorted(blobs, key=lambda blob: blob.name)
+
+
+def md5_hash(file_name):
+    # Base64 MD5 of a file, the format Firebase Storage uses for blob.md5_hash
+    digest = hashlib.md5()
+    with open(file_name, 'rb') as file:
+        for chunk in iter(lambda: file.read(1 << 20), b''):
+            digest.update(chunk)
+    return base64.b64encode(digest.digest()).decode()
+
+
+def firebase_bucket(settings, bucket_name='smt-bot-staging'):
+    # The Firebase Storage bucket, initializing the Firebase app with the service account settings the first time
+    from firebase_admin import credentials, initialize_app, _apps, storage
+
+    if not _apps:  # Check if no Firebase app is initialized
+        initialize_app(credentials.Certificate(dict(settings)), {'storageBucket': bucket_name})
+    return storage.bucket()
+
+
+def missing_blobs(blobs, local_files, dates=None):
+    # Blobs whose snapshot is not in the data directory yet, in date order, one per date.
+    # dates is an optional (first, last) range of YYYY-MM-DD dates, both included
+    missing = {}
+    for blob in blobs:
+        original_filename = os.path.basename(blob.name)
+        if original_filename:  # Skip directories or empty filenames
+            new_filename = original_filename[-15:]
+            if dates is not None and not dates[0] <= new_filename[:10] <= dates[1]:
+                continue
+            if new_filename not in local_files and new_filename not in missing:
+                missing[new_filename] = blob
+    return sorted(missing.items())
+
+
+# Blob each snapshot in the data directory was downloaded from: {new_filename: {'name', 'generation', 'md5'}}
+MANIFEST_FILE = 'manifest.json'
+
+
+def read_manifest(data_dir):
+    path = os.path.join(data_dir, MANIFEST_FILE)
+    if not os.path.exists(path):
+        return {}
+    with open(path) as file:
+        return json.load(file)
+
+
+def write_manifest(data_dir, manifest):
+    path = os.path.join(data_dir, MANIFEST_FILE)
+    temporary_path = f'{path}.{os.getpid()}.tmp'
+    with open(temporary_path, 'w') as file:
+        json.dump(manifest, file, indent=1, sort_keys=True)
+    os.replace(temporary_path, path)
+
+
+def manifest_entry(blob):
+    return {'name': blob.name, 'generation': getattr(blob, 'generation', None), 'md5': blob.md5_hash}
+
+
+def changed_snapshots(blobs, manifest, data_dir):
+    # Snapshots in the data directory whose blob was uploaded again with other contents, as (new_filename, blob) in
+    # date order. Blobs uploaded again with the same contents, and files downloaded before the manifest existed
+    # (compared by their MD5), are recorded in the manifest as they are
+    local_files = set(os.listdir(data_dir))
+    changed = []
+    for new_filename, blob in missing_blobs(blobs, set()):
+        if new_filename not in local_files:
+            continue
+        entry = manifest.get(new_filename)
+        if entry == manifest_entry(blob):
+            continue
+        if blob.md5_hash is not None:
+            local_md5 = entry['md5'] if entry is not None else md5_hash(os.path.join(data_dir, new_filename))
+            same = blob.md5_hash == local_md5
+        else:
+            same = entry is None or entry['generation'] == getattr(blob, 'generation', None)
+        if same:
+            manifest[new_filename] = manifest_entry(blob)
+        else:
+            changed.append((new_filename, blob))
+    return changed
+
+
+def _fetch(blob, local_path, parse, retries, backoff):
+    # Download, verify and parse one blob, retrying transient failures
+    for attempt in range(retries + 1):
+        try:
+            with stage('download'):
+                blob.download_to_filename(local_path)
+            if blob.md5_hash is not None and md5_hash(local_path) != blob.md5_hash:
+                raise DownloadError(f'checksum mismatch for {blob.name}')
+            break
+        except Exception as error:
+            if attempt == retries:
+                raise DownloadError(f'could not download {blob.name}: {error}') from error
+            time.sleep(backoff * 2 ** attempt)
+    with stage('parse') as current:
+        dataframe = parse(local_path)
+        current.rows = len(dataframe)
+    return dataframe
+
+
+def replace_snapshots(changed, data_dir, parse=read_snapshot, retries=3, backoff=1.0):
+    # Downloads the new version of some snapshots in the data directory, (new_filename, blob) pairs. Every one is
+    # verified and parsed before any local file is replaced
+    staging_dir = os.path.join(data_dir, '.replacements')
+    shutil.rmtree(staging_dir, ignore_errors=True)
+    os.makedirs(staging_dir)
+    for new_filename, blob in changed:
+        _fetch(blob, os.path.join(staging_dir, new_filename), parse, retries, backoff)
+    for new_filename, _ in changed:
+        staged_path = os.path.join(staging_dir, new_filename)
+        os.replace(staged_path, os.path.join(data_dir, new_filename))
+        if os.path.exists(cache_path(staged_path)):
+            os.replace(cache_path(staged_path), cache_path(os.path.join(data_dir, new_filename)))
+    shutil.rmtree(staging_dir, ignore_errors=True)
+
+
+def download_snapshots(bucket, prefix, data_dir, parse=read_snapshot, max_workers=8, retries=3, backoff=1.0,
+                       progress=None, dates=None, blobs=None):
+    # Downloads and parses the missing snapshots on a thread pool and yields (new_filename, dataframe) in date order.
+    # A snapshot only lands in data_dir once the caller asks for the next one, so a file there has been applied.
+    # blobs is the bucket's listing, if the caller already has it
+    with stage('blob listing') as current:
+        if blobs is None:
+            blobs = bucket.list_blobs(prefix=prefix)
+        pending_files = missing_blobs(blobs, set(os.listdir(data_dir)), dates)
+        current.rows = len(pending_files)
+    staging_dir = os.path.join(data_dir, '.incoming')
+    shutil.rmtree(staging_dir, ignore_errors=True)
+    os.makedirs(staging_dir)
+
+    total = len(pending_files)
+    queued = iter(pending_files)
+    in_flight = deque()
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        def submit_next():
+            for new_filename, blob in queued:
+                staged_path = os.path.join(staging_dir, new_filename)
+                future = executor.submit(carry_run(_fetch), blob, staged_path, parse, retries, backoff)
+                in_flight.append((new_filename, staged_path, future))
+                return
+
+        # Keep the pool busy without holding more than a couple of parsed days per worker
+        for _ in range(2 * max_workers):
+            submit_next()
+        done = 0
+        try:
+            while in_flight:
+                new_filename, staged_path, future = in_flight.popleft()
+                dataframe = future.result()
+                yield new_filename, dataframe
+                # The caller applied the day, move it into the data directory with its cache
+                os.replace(staged_path, os.path.join(data_dir, new_filename))
+                if os.path.exists(cache_path(staged_path)):
+                    os.replace(cache_path(staged_path), cache_path(os.path.join(data_dir, new_filename)))
+                done += 1
+                if progress is not None:
+                    progress(done, total, new_filename)
+                submit_next()
+        finally:
+            for _, _, future in in_flight:
+                future.cancel()
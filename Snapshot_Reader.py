@@ -0,0 +1,157 @@
+import posixpath
+import zipfile
+from xml.etree.ElementTree import iterparse
+import numpy as np
+import pandas as pd
+
+# Version of the cleaning done by read_excel_snapshot, bump it when the cleaning changes so cached snapshots are rebuilt
+CLEANING_VERSION = 2
+
+# Columns every daily snapshot must have
+SNAPSHOT_SHEET_COLUMNS = ['Ticker', 'Sector', 'Price', 'Market Cap ($M USD)']
+
+MAIN = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+RELATIONSHIPS = '{http://schemas.openxmlformats.org/officeDocument/2006/relationships}'
+PACKAGE_RELATIONSHIPS = '{http://schemas.openxmlformats.org/package/2006/relationships}'
+CELL = f'{MAIN}c'
+ROW = f'{MAIN}row'
+
+
+class SnapshotError(ValueError):
+    pass
+
+
+def _first_sheet(archive):
+    # Path of the first worksheet inside the .xlsx, the one pd.read_excel reads by default
+    with archive.open('xl/workbook.xml') as workbook:
+        sheet = next(element for _, element in iterparse(workbook) if element.tag == f'{MAIN}sheet')
+    relation_id = sheet.get(f'{RELATIONSHIPS}id')
+    with archive.open('xl/_rels/workbook.xml.rels') as relations:
+        for _, element in iterparse(relations):
+            if element.tag == f'{PACKAGE_RELATIONSHIPS}Relationship' and element.get('Id') == relation_id:
+                target = element.get('Target')
+                return target.lstrip('/') if target.startswith('/') else posixpath.join('xl', target)
+    raise SnapshotError('workbook without worksheets')
+
+
+def _shared_strings(archive):
+    if 'xl/sharedStrings.xml' not in archive.namelist():
+        return []
+    strings = []
+    with archive.open('xl/sharedStrings.xml') as file:
+        for _, element in iterparse(file):
+            if element.tag == f'{MAIN}si':
+                strings.append(''.join(text.text or '' for text in element.iter(f'{MAIN}t')))
+                element.clear()
+    return strings
+
+
+def _column_number(letters):
+    # "AB" -> 27
+    number = 0
+    for letter in letters:
+        number = number * 26 + ord(letter) - 64
+    return number - 1
+
+
+def _cell_value(cell, strings):
+    kind = cell.get('t')
+    if kind == 'inlineStr':
+        return ''.join(text.text or '' for text in cell.iter(f'{MAIN}t'))
+    value = cell.findtext(f'{MAIN}v')
+    if value is None or kind == 'e':
+        return None
+    if kind == 's':
+        return strings[int(value)]
+    if kind == 'str':
+        return value
+    if kind == 'b':
+        return value == '1'
+    number = float(value)
+    return int(number) if number.is_integer() else number
+
+
+def _read_columns(file_name, names):
+    # Streams the first worksheet and keeps only the cells under the given header names
+    with zipfile.ZipFile(file_name) as archive:
+        strings = _shared_strings(archive)
+        with archive.open(_first_sheet(archive)) as sheet:
+            header = None
+            wanted = {}
+            rows = []
+            filled = []
+            cells = {}
+            has_values = False
+            column = -1
+            column_numbers = {}
+            for _, element in iterparse(sheet):
+                tag = element.tag
+                if tag == CELL:
+                    reference = element.get('r')
+                    if reference:
+                        letters = reference.rstrip('0123456789')
+                        column = column_numbers.get(letters)
+                        if column is None:
+                            column = column_numbers[letters] = _column_number(letters)
+                    else:
+                        column += 1
+                    if header is None or column in wanted:
+                        cells[column] = _cell_value(element, strings)
+                    has_values = has_values or len(element) > 0
+                    element.clear()
+                elif tag == ROW:
+                    if header is None:
+                        header = cells
+                        missing = [name for name in names if name not in header.values()]
+                        if missing:
+                            raise SnapshotError(f'{file_name}: missing columns {missing}')
+                        wanted = {column: name for column, name in header.items() if name in names}
+                    else:
+                        # Rows left out of the XML are blank rows of the sheet
+                        number = int(element.get('r', len(rows) + 2))
+                        filled.extend([False] * (number - len(rows) - 2))
+                        rows.extend([{}] * (number - len(rows) - 2))
+                        rows.append(cells)
+                        filled.append(has_values)
+                    cells = {}
+                    has_values = False
+                    column = -1
+                    element.clear()
+    if header is None:
+        raise SnapshotError(f'{file_name}: empty sheet')
+    return {name: [row.get(column) for row in rows] for column, name in wanted.items()}, filled
+
+
+def _to_numbers(values):
+    # Removing the "$" and "," from every value at once, anything left that is not a number becomes NaN
+    text = pd.Series(values, dtype=object).astype('string').str.replace(r'[$,]', '', regex=True).str.strip()
+    return pd.to_numeric(text, errors='coerce').to_numpy(dtype=np.float64)
+
+
+# Function to read a daily snapshot, streaming only the needed columns and checking them before they are used
+def read_excel_snapshot(file_name):
+    columns, filled = _read_columns(file_name, SNAPSHOT_SHEET_COLUMNS)
+    # Drop trailing blank rows, then the 'Summary' row
+    n_rows = len(filled)
+    while n_rows and not filled[n_rows - 1]:
+        n_rows -= 1
+    n_rows = max(n_rows - 1, 0)
+    columns = {name: values[:n_rows] for name, values in columns.items()}
+
+    index = pd.Index(columns['Ticker'], name='Ticker', dtype=object)
+    if index.isna().any():
+        raise SnapshotError(f'{file_name}: {index.isna().sum()} rows without a ticker')
+    if index.has_duplicates:
+        raise SnapshotError(f'{file_name}: duplicate tickers {sorted(index[index.duplicated()].unique())}')
+    price = _to_numbers(columns['Price'])
+    if np.isnan(price).any():
+        raise SnapshotError(f'{file_name}: non-numeric prices for {list(index[np.isnan(price)])}')
+
+    market_cap = _to_numbers(columns['Market Cap ($M USD)'])
+    return pd.DataFrame({
+        'Price': price,
+        'Market Cap ($M USD)': market_cap,
+        'Market Cap Category': np.select([market_cap < 2000, market_cap <= 10000], ['Small', 'Medium'],
+                                         'Large').astype(object),
+        'Sector': np.array(columns['Sector'], dtype=object),
+    }, index=index)
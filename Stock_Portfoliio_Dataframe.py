@@ -1,66 +1,152 @@
+import numpy as np
 import streamlit as st
 
+# Columns of the summary table
+SUMMARY_COLUMNS = ['Ticker', 'Days Holding', 'ROI', 'Sector', 'Market Cap', 'Total Amount', 'Investment']
 
-def generate_summarized_visualization(portfolio_dataframe):
-    # Filter rows where 'Sell Date' is missing (assuming the column is named 'Sell Date')
-    filtered_dataframe = portfolio_dataframe[portfolio_dataframe['Sell Date'].isna()].sort_values('Buy Date', ascending=False)
+# Rows the summary shows, the full table pages through the rest
+SUMMARY_ROWS = 100
 
-    # Select only the columns 'a', 'b', and 'c'
-    filtered_dataframe = filtered_dataframe[
-        ['Days Holding', 'ROI', 'Sector', 'Market Cap', 'Total Amount', 'Investment']]
+PAGE_SIZES = [25, 50, 100, 250]
 
-    # Tabela de Portfólio no topo
-    st.header(f'Stock Portfolio', divider='gray')
+STATUSES = ['All', 'Open', 'Closed']
 
-    def color_negative_red(value):
-        color = 'red' if value < 0 else 'green'
-        return f'color: {color}'
+# Sort option keeping the portfolio's own order: open lots as bought, then sold lots, latest sells first
+PORTFOLIO_ORDER = 'Portfolio order'
 
-    col1, col2 = st.columns(2)
-    with col1:  # Apply coloring and formatting
-        colored_portfolio = filtered_dataframe.style.applymap(color_negative_red, subset=['ROI'])
-        colored_portfolio = colored_portfolio.format({'ROI': '{:.2f}%'})
-        colored_portfolio = colored_portfolio.format({'Allocation': '{:.2f}'})
+FORMATS = {'ROI': '{:.2f}%', 'Allocation': '{:.2f}'}
 
-        # Display dataframe
-        st.dataframe(data=colored_portfolio, height=300)
 
-    with col2:
-        sum_amount = int(filtered_dataframe["Total Amount"].sum())
-        sum_investment = int(filtered_dataframe["Investment"].sum())
-        percentage_return = ((sum_amount / sum_investment) - 1) * 100
+class PortfolioView:
+    """The portfolio dataframe prepared once per version for paged tables.
 
-        st.metric(label=f'Total Amount', value=sum_amount)
+    Lots are kept with a unique row number, the filters have their arrays ready (open flag, sector codes, ROI) and
+    the sort order of a column is computed the first time it is asked for and reused by every later page. The totals
+    of the open and of all the positions are summed once here instead of on every render.
+    """
 
-        st.metric(label=f'Total Investment', value=sum_investment)
+    def __init__(self, portfolio_dataframe):
+        # Sold lots repeat their ticker, which is kept as a column
+        self.frame = portfolio_dataframe.rename_axis('Ticker').reset_index()
+        self.is_open = self.frame['Sell Date'].isna().to_numpy()
+        self.roi = self.frame['ROI'].to_numpy(dtype=np.float64)
+        sectors = self.frame['Sector'].astype('category')
+        self.sectors = list(sectors.cat.categories)
+        self.sector_codes = sectors.cat.codes.to_numpy()
+        self.orders = {}
+        amount = self.frame['Total Amount'].to_numpy(dtype=np.float64)
+        investment = self.frame['Investment'].to_numpy(dtype=np.float64)
+        self.totals = {'Open': (np.nansum(amount[self.is_open]), np.nansum(investment[self.is_open])),
+                       'All': (np.nansum(amount), np.nansum(investment))}
+        # Open positions, latest buys first
+        self.open_rows = self.select('Open', sort='Buy Date', ascending=False)
 
-        st.metric(label=f'Total Return', value=f'{percentage_return:.2f}%')
+    def order(self, column, ascending=True):
+        # Rows sorted by a column, missing values last, cached per column and direction
+        key = (column, ascending)
+        if key not in self.orders:
+            self.orders[key] = self.frame[column].sort_values(ascending=ascending, kind='stable',
+                                                              na_position='last').index.to_numpy()
+        return self.orders[key]
 
+    def select(self, status='All', sectors=None, roi_range=None, sort=None, ascending=True):
+        # Row numbers matching the filters, in the sort order
+        mask = np.ones(len(self.frame), dtype=bool)
+        if status != 'All':
+            mask &= self.is_open == (status == 'Open')
+        if sectors:
+            codes = [self.sectors.index(sector) for sector in sectors if sector in self.sectors]
+            mask &= np.isin(self.sector_codes, codes)
+        if roi_range is not None:
+            mask &= (self.roi >= roi_range[0]) & (self.roi <= roi_range[1])
+        order = self.order(sort, ascending) if sort is not None else np.arange(len(self.frame))
+        return order[mask[order]]
 
-def generate_dataframe_visualization(portfolio_dataframe):
-    # Tabela de Portfólio no topo
-    st.header(f'Stock Portfolio', divider='gray')
+    def page(self, rows, columns=None):
+        page = self.frame.iloc[rows]
+        return page[columns] if columns is not None else page
 
-    def color_negative_red(value):
-        color = 'red' if value < 0 else 'green'
-        return f'color: {color}'
 
-    colored_portfolio = portfolio_dataframe.style.applymap(color_negative_red, subset=['ROI'])
-    colored_portfolio = colored_portfolio.format({'ROI': '{:.2f}%'})
-    colored_portfolio = colored_portfolio.format({'Allocation': '{:.2f}'})
-    st.dataframe(data=colored_portfolio, height=300)
+@st.cache_resource(max_entries=2)
+def _cached_view(version, _portfolio_dataframe):
+    return PortfolioView(_portfolio_dataframe)
 
-    col1, col2, col3 = st.columns(3)
 
-    sum_amount = int(portfolio_dataframe["Total Amount"].sum())
-    sum_investment = int(portfolio_dataframe["Investment"].sum())
+def portfolio_view(portfolio_dataframe, version=None):
+    # One view per portfolio version, shared by the reruns and sessions showing it
+    if version is None:
+        return PortfolioView(portfolio_dataframe)
+    return _cached_view(version, portfolio_dataframe)
+
+
+def _styled(page):
+    # Only the rows shown are styled, the ROI colored with one vectorized call per page
+    def color_negative_red(roi):
+        return np.where(roi < 0, 'color: red', 'color: green')
+
+    styled = page.style.apply(color_negative_red, subset=['ROI'])
+    return styled.format({column: format for column, format in FORMATS.items() if column in page.columns})
+
+
+def _show_totals(totals, columns):
+    # Metrics of the totals the view summed, one per column given
+    sum_amount, sum_investment = (int(total) for total in totals)
     percentage_return = ((sum_amount / sum_investment) - 1) * 100
+    metrics = [('Total Amount', sum_amount), ('Total Investment', sum_investment),
+               ('Total Return', f'{percentage_return:.2f}%')]
+    for column, (label, value) in zip(columns, metrics):
+        column.metric(label=label, value=value)
+
+
+def generate_summarized_visualization(view):
+    # Tabela de Portfólio no topo: the open positions, latest buys first
+    st.header(f'Stock Portfolio', divider='gray')
 
+    col1, col2 = st.columns(2)
     with col1:
-        st.metric(label=f'Total Amount', value=sum_amount)
+        rows = view.open_rows
+        st.dataframe(data=_styled(view.page(rows[:SUMMARY_ROWS], SUMMARY_COLUMNS)), height=300, hide_index=True)
+        if len(rows) > SUMMARY_ROWS:
+            st.caption(f'Latest {SUMMARY_ROWS} of {len(rows):,} open positions, all of them are in the table below')
 
-    with col2:
-        st.metric(label=f'Total Investment', value=sum_investment)
+    _show_totals(view.totals['Open'], [col2] * 3)
+
+
+def generate_dataframe_visualization(view):
+    # Tabela de Portfólio: every lot, filtered, sorted and paged on the server
+    st.header(f'Stock Portfolio', divider='gray')
 
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        status = st.selectbox('Positions', STATUSES, 0, key='portfolio_status')
+    with col2:
+        sectors = st.multiselect('Sector', view.sectors, [], key='portfolio_sectors')
+    with col3:
+        roi_range = None
+        finite = view.roi[np.isfinite(view.roi)]
+        if len(finite) and finite.min() < finite.max():
+            low, high = float(np.floor(finite.min())), float(np.ceil(finite.max()))
+            selected = st.slider('ROI (%)', low, high, (low, high), key=f'portfolio_roi_{low}_{high}')
+            roi_range = None if selected == (low, high) else selected
+
+    col1, col2, col3, col4 = st.columns(4)
+    with col1:
+        sort = st.selectbox('Sort by', [PORTFOLIO_ORDER] + list(view.frame.columns), 0, key='portfolio_sort')
+    with col2:
+        ascending = st.toggle('Ascending', True, key='portfolio_ascending')
+    rows = view.select(status, sectors, roi_range, None if sort == PORTFOLIO_ORDER else sort, ascending)
     with col3:
-        st.metric(label=f'Total Return', value=f'{percentage_return:.2f}%')
+        page_size = st.selectbox('Rows per page', PAGE_SIZES, 1, key='portfolio_page_size')
+    with col4:
+        # Not capped by the widget, the number of pages changes with the filters
+        page = st.number_input('Page', min_value=1, value=1, step=1, key='portfolio_page')
+
+    n_pages = max(1, -(-len(rows) // page_size))
+    page = min(int(page), n_pages)
+    start = (page - 1) * page_size
+    shown = rows[start:start + page_size]
+    st.dataframe(data=_styled(view.page(shown)), height=300, hide_index=True)
+    st.caption(f'Rows {start + 1 if len(shown) else 0:,}-{start + len(shown):,} of {len(rows):,}, '
+               f'page {page} of {n_pages}')
+
+    _show_totals(view.totals['All'], st.columns(3))
@@ -0,0 +1,35 @@
+class Strategy:
+    """Rules the portfolio is managed by.
+
+    A position gets a second entry `entry_days` days after its first one or once the price is `entry_gain` times the
+    first entry price, and a third entry the same way after the second. Each of them invests `top_up` dollars. The
+    first snapshot is split equally over `capital`, later buys get `new_allocation` of it, and once the open positions
+    are worth more than `overdraft_cap` the excess is counted as overdraft.
+    """
+
+    FIELDS = ('entry_days', 'entry_gain', 'top_up', 'new_allocation', 'overdraft_cap', 'capital')
+
+    def __init__(self, entry_days=90, entry_gain=1.2, top_up=1500, new_allocation=0.02, overdraft_cap=100000,
+                 capital=100000):
+        self.entry_days = entry_days
+        self.entry_gain = entry_gain
+        self.top_up = top_up
+        self.new_allocation = new_allocation
+        self.overdraft_cap = overdraft_cap
+        self.capital = capital
+
+    def to_dict(self):
+        return {field: getattr(self, field) for field in self.FIELDS}
+
+    def __eq__(self, other):
+        return isinstance(other, Strategy) and self.to_dict() == other.to_dict()
+
+    def __hash__(self):
+        return hash(tuple(self.to_dict().values()))
+
+    def __repr__(self):
+        return f'Strategy({", ".join(f"{field}={value!r}" for field, value in self.to_dict().items())})'
+
+
+# The rules the smart portfolio has always been run with
+DEFAULT_STRATEGY = Strategy()
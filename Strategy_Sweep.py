@@ -0,0 +1,159 @@
+import argparse
+import itertools
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+import numpy as np
+import pandas as pd
+from Replaying_History import SnapshotPanel, build_panel, load_snapshots, replay_history
+from Strategy import Strategy, DEFAULT_STRATEGY
+
+# Panel arrays put in shared memory, the other fields are small and pickled to each worker once
+SHARED_ARRAYS = ('prices', 'members', 'sector_codes', 'cap_codes')
+SMALL_FIELDS = ('dates', 'tickers', 'first_order', 'sectors', 'caps')
+
+
+class SharedPanel:
+    """A SnapshotPanel whose (day x ticker) arrays live in shared memory, mapped by every worker instead of copied."""
+
+    def __init__(self, panel):
+        self.blocks = []
+        layout = {}
+        for name in SHARED_ARRAYS:
+            array = getattr(panel, name)
+            block = shared_memory.SharedMemory(create=True, size=max(1, array.nbytes))
+            np.ndarray(array.shape, array.dtype, buffer=block.buf)[...] = array
+            self.blocks.append(block)
+            layout[name] = (block.name, array.shape, array.dtype.str)
+        self.descriptor = (layout, {name: getattr(panel, name) for name in SMALL_FIELDS})
+
+    def close(self):
+        for block in self.blocks:
+            block.close()
+            block.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def attach_panel(descriptor):
+    # The SnapshotPanel of a SharedPanel descriptor, with views on the shared arrays, and the blocks to keep open
+    layout, small = descriptor
+    blocks = []
+    arrays = {}
+    for name, (block_name, shape, dtype) in layout.items():
+        # The pool's processes share the creator's resource tracker, which unlinks the block once
+        block = shared_memory.SharedMemory(name=block_name)
+        blocks.append(block)
+        arrays[name] = np.ndarray(shape, np.dtype(dtype), buffer=block.buf)
+    panel = SnapshotPanel(small['dates'], small['tickers'], arrays['prices'], arrays['members'], small['first_order'],
+                          small['sectors'], arrays['sector_codes'], small['caps'], arrays['cap_codes'])
+    return panel, blocks
+
+
+# Panel of a worker process, attached once by the pool initializer
+_panel = None
+_blocks = None
+
+
+def _init_worker(descriptor):
+    global _panel, _blocks
+    _panel, _blocks = attach_panel(descriptor)
+
+
+def run_strategy(panel, strategy):
+    # Final ROI, peak overdraft and the tracking curve of one strategy over the whole history
+    _, tracking = replay_history(panel, strategy, with_overdraft=True)
+    final_amount = tracking['Total Amount'].iloc[-1]
+    final_investment = tracking['Investment'].iloc[-1]
+    summary = dict(strategy.to_dict(), **{
+        'ROI': (final_amount / final_investment - 1) * 100,
+        'Peak Overdraft': tracking['Overdraft'].max(),
+        'Total Amount': final_amount,
+        'Investment': final_investment,
+    })
+    return summary, tracking
+
+
+def _run_in_worker(strategy):
+    summary, tracking = run_strategy(_panel, strategy)
+    return summary, tracking.to_numpy()
+
+
+def strategy_grid(**choices):
+    # Every combination of the given values, e.g. strategy_grid(entry_days=[60, 90], top_up=[1000, 1500]),
+    # the other rules keep their default
+    fields = [field for field in Strategy.FIELDS if field in choices]
+    unknown = set(choices) - set(fields)
+    if unknown:
+        raise ValueError(f'unknown strategy fields: {sorted(unknown)}')
+    default = DEFAULT_STRATEGY.to_dict()
+    return [Strategy(**dict(default, **dict(zip(fields, values))))
+            for values in itertools.product(*(choices[field] for field in fields))]
+
+
+def run_sweep(snapshots, strategies, max_workers=None):
+    # Replays the history once per strategy on a process pool sharing one panel.
+    # Returns a dataframe with one row per strategy and the tracking curve (Total Amount, Investment, Overdraft)
+    # of each, keyed by the row number
+    panel = snapshots if isinstance(snapshots, SnapshotPanel) else build_panel(snapshots)
+    index = pd.to_datetime(panel.dates)
+    summaries = []
+    curves = {}
+    with SharedPanel(panel) as shared_panel:
+        with ProcessPoolExecutor(max_workers=max_workers, initializer=_init_worker,
+                                 initargs=(shared_panel.descriptor,)) as executor:
+            for config, (summary, curve) in enumerate(executor.map(_run_in_worker, strategies)):
+                summaries.append(summary)
+                curves[config] = pd.DataFrame(curve, index=index, columns=['Total Amount', 'Investment', 'Overdraft'])
+    results = pd.DataFrame(summaries)
+    results.index.name = 'Config'
+    return results, curves
+
+
+def write_sweep(output_dir, results, curves):
+    os.makedirs(output_dir, exist_ok=True)
+    results.to_csv(os.path.join(output_dir, 'results.csv'))
+    tracking = pd.concat(curves, names=['Config', 'Date'])
+    tracking.to_csv(os.path.join(output_dir, 'tracking.csv'))
+
+
+def read_sweep(output_dir):
+    # (results, tracking) written by write_sweep, or None if there is no sweep yet
+    results_path = os.path.join(output_dir, 'results.csv')
+    if not os.path.exists(results_path):
+        return None
+    results = pd.read_csv(results_path, index_col='Config')
+    tracking = pd.read_csv(os.path.join(output_dir, 'tracking.csv'), index_col=['Config', 'Date'], parse_dates=['Date'])
+    return results, tracking
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay the snapshot history for a grid of strategy rules.')
+    parser.add_argument('--data-dir', default='data', help='directory with the daily .xlsx snapshots')
+    parser.add_argument('--output-dir', default=None, help='where to write the results (defaults to DATA_DIR/sweep)')
+    parser.add_argument('--workers', type=int, default=None)
+    for field, default in DEFAULT_STRATEGY.to_dict().items():
+        # Days are whole numbers, the other rules can take any value
+        parser.add_argument(f'--{field.replace("_", "-")}', type=int if field == 'entry_days' else float, nargs='+',
+                            default=[default])
+    args = parser.parse_args()
+    output_dir = args.output_dir or os.path.join(args.data_dir, 'sweep')
+
+    start = time.perf_counter()
+    panel = build_panel(load_snapshots(args.data_dir))
+    loaded = time.perf_counter()
+    strategies = strategy_grid(**{field: getattr(args, field) for field in Strategy.FIELDS})
+    results, curves = run_sweep(panel, strategies, args.workers)
+    swept = time.perf_counter()
+    write_sweep(output_dir, results, curves)
+    print(f'Replayed {len(panel.dates)} snapshots for {len(strategies)} strategies: '
+          f'loading {loaded - start:.2f}s, sweep {swept - loaded:.2f}s')
+
+
+if __name__ == '__main__':
+    main()
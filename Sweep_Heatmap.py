@@ -0,0 +1,34 @@
+import streamlit as st
+from Strategy import Strategy
+
+METRICS = ['ROI', 'Peak Overdraft']
+
+
+def plot_sweep_heatmap(results):
+    # Heatmap of a strategy sweep metric over two of the swept rules, averaged over the other ones
+    import plotly.graph_objects as go
+
+    st.header('Strategy Sensitivity', divider='gray')
+    swept = [field for field in Strategy.FIELDS if results[field].nunique() > 1]
+    if not swept:
+        st.caption('The last sweep only ran one strategy')
+        return
+
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        metric = st.selectbox('Metric', METRICS)
+    with col2:
+        x_field = st.selectbox('Horizontal axis', swept, 0)
+    with col3:
+        y_choices = [field for field in swept if field != x_field] or [x_field]
+        y_field = st.selectbox('Vertical axis', y_choices, 0)
+
+    heatmap = results.pivot_table(index=y_field, columns=x_field, values=metric, aggfunc='mean')
+    fig = go.Figure(data=[go.Heatmap(z=heatmap.to_numpy(), x=[str(value) for value in heatmap.columns],
+                                     y=[str(value) for value in heatmap.index], colorscale='RdYlGn'
+                                     if metric == 'ROI' else 'Reds', colorbar=dict(title=metric))])
+    fig.update_layout(xaxis_title=x_field, yaxis_title=y_field)
+    st.plotly_chart(fig)
+    others = [field for field in swept if field not in (x_field, y_field)]
+    if others:
+        st.caption(f'Averaged over {", ".join(others)}')
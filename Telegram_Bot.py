@@ -1,16 +1,214 @@
-import telegram
 import asyncio
+import atexit
+import logging
+import threading
+import time
+from contextlib import contextmanager
 import streamlit as st
+from Instrumentation import stage
 
+logger = logging.getLogger('telegram')
 
-def send_message(message):
-    bot_token = st.secrets["telegram"]["bot_token"]
-    bot = telegram.Bot(token=bot_token)
-    chat_id = st.secrets["telegram"]["chat_id"]
-    message_to_send = message
-    asyncio.run(bot.send_message(chat_id=chat_id, text=message_to_send))
+# Telegram rejects longer messages
+MAX_MESSAGE_LENGTH = 4096
+
+
+def split_message(lines, max_length=MAX_MESSAGE_LENGTH):
+    # Joins lines into as few messages as fit the limit, cutting a line only when it is longer than the limit itself
+    chunks = []
+    current = ''
+    for line in lines:
+        while len(line) > max_length:
+            if current:
+                chunks.append(current)
+                current = ''
+            chunks.append(line[:max_length])
+            line = line[max_length:]
+        if not line:
+            continue
+        if not current:
+            current = line
+        elif len(current) + 1 + len(line) <= max_length:
+            current += '\n' + line
+        else:
+            chunks.append(current)
+            current = line
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def _seconds(retry_after):
+    # RetryAfter.retry_after is an int or a timedelta depending on the python-telegram-bot version
+    return retry_after.total_seconds() if hasattr(retry_after, 'total_seconds') else float(retry_after)
+
+
+class TelegramDispatcher:
+    """Sends notifications from a background thread that owns one event loop and one Bot client.
+
+    notify() only queues the text. The thread merges whatever piled up into as few messages as Telegram allows,
+    keeps min_interval seconds between messages and retries flood control and network errors with backoff.
+    """
+
+    def __init__(self, token, chat_id, base_url='https://api.telegram.org/bot', min_interval=1.0, retries=5,
+                 backoff=1.0, linger=0.5):
+        self.token = token
+        self.chat_id = chat_id
+        self.base_url = base_url
+        self.min_interval = min_interval
+        self.retries = retries
+        self.backoff = backoff
+        # How long to wait for the rest of a burst before sending it
+        self.linger = linger
+        self.lock = threading.Lock()
+        self.idle = threading.Condition(self.lock)
+        # Notifications queued and not sent or given up on yet
+        self.pending = 0
+        self.suppressed_depth = 0
+        self.sent = 0
+        self.failed = 0
+        self.dropped = 0
+        self.loop = asyncio.new_event_loop()
+        self.queue = None
+        ready = threading.Event()
+        self.thread = threading.Thread(target=self._run, args=(ready,), name='telegram-dispatcher', daemon=True)
+        self.thread.start()
+        ready.wait()
+
+    def _run(self, ready):
+        asyncio.set_event_loop(self.loop)
+        self.queue = asyncio.Queue()
+        ready.set()
+        self.loop.run_until_complete(self._work())
+        self.loop.close()
+
+    async def _work(self):
+        # python-telegram-bot is only imported by the dispatcher thread, the first time something is sent
+        import telegram
+
+        bot = telegram.Bot(self.token, base_url=self.base_url)
+        last_sent = None
+        running = True
+        while running:
+            messages = [await self.queue.get()]
+            if messages[0] is not None:
+                await asyncio.sleep(self.linger)
+            while not self.queue.empty():
+                messages.append(self.queue.get_nowait())
+            if None in messages:
+                running = False
+                messages = [message for message in messages if message is not None]
+
+            lines = [line for message in messages for line in message.split('\n')]
+            for chunk in split_message(lines):
+                if last_sent is not None:
+                    await asyncio.sleep(max(0.0, last_sent + self.min_interval - self.loop.time()))
+                with stage('telegram send', rows=chunk.count('\n') + 1):
+                    await self._send(bot, chunk)
+                last_sent = self.loop.time()
+            with self.idle:
+                self.pending -= len(messages)
+                self.idle.notify_all()
+        await bot.shutdown()
+
+    async def _send(self, bot, text):
+        from telegram.error import BadRequest, RetryAfter, TelegramError
+
+        for attempt in range(self.retries + 1):
+            try:
+                await bot.send_message(chat_id=self.chat_id, text=text)
+                self.sent += 1
+                return
+            except RetryAfter as error:
+                delay = _seconds(error.retry_after)
+            except BadRequest as error:
+                # Retrying a message Telegram refused would fail the same way
+                logger.error('telegram message refused', extra={'fields': {'error': str(error)}})
+                break
+            except TelegramError as error:
+                delay = self.backoff * 2 ** attempt
+                logger.warning('telegram send failed', extra={'fields': {'error': str(error), 'attempt': attempt + 1,
+                                                                         'retry_in': round(delay, 1)}})
+            if attempt < self.retries:
+                await asyncio.sleep(delay)
+        self.failed += 1
+
+    def notify(self, message):
+        with self.lock:
+            if self.suppressed_depth:
+                self.dropped += 1
+                return
+            self.pending += 1
+        self.loop.call_soon_threadsafe(self.queue.put_nowait, message)
 
-    print("Message sent!")
+    @contextmanager
+    def suppressed(self, active=True):
+        # Drops the notifications made inside, e.g. while replaying historical days
+        with self.lock:
+            self.suppressed_depth += int(active)
+        try:
+            yield
+        finally:
+            with self.lock:
+                self.suppressed_depth -= int(active)
+
+    def flush(self, timeout=None):
+        # Waits until every queued notification was sent or given up on
+        with self.idle:
+            return self.idle.wait_for(lambda: self.pending == 0, timeout)
+
+    def close(self, timeout=10):
+        if not self.thread.is_alive():
+            return
+        self.flush(timeout)
+        self.loop.call_soon_threadsafe(self.queue.put_nowait, None)
+        self.thread.join(timeout)
+
+
+# One dispatcher for the whole process, created the first time something is sent
+_dispatcher = None
+_dispatcher_lock = threading.Lock()
+
+
+def dispatcher():
+    global _dispatcher
+    with _dispatcher_lock:
+        if _dispatcher is None:
+            _dispatcher = TelegramDispatcher(st.secrets["telegram"]["bot_token"], st.secrets["telegram"]["chat_id"])
+            atexit.register(_dispatcher.close)
+        return _dispatcher
+
+
+def use_dispatcher(new_dispatcher):
+    # Sends through another dispatcher from now on, e.g. one pointed at benchmarks/fake_bot_api.py to run offline
+    global _dispatcher
+    with _dispatcher_lock:
+        _dispatcher = new_dispatcher
+
+
+# Notifications are dropped while this is above zero, without creating the dispatcher (or reading its secrets)
+_suppressed_depth = 0
+
+
+@contextmanager
+def suppressed(active=True):
+    # Drops the notifications sent inside, e.g. while replaying historical days
+    global _suppressed_depth
+    with _dispatcher_lock:
+        _suppressed_depth += int(active)
+    try:
+        yield
+    finally:
+        with _dispatcher_lock:
+            _suppressed_depth -= int(active)
+
+
+def send_message(message):
+    # Queued, the dispatcher thread sends it
+    with _dispatcher_lock:
+        if _suppressed_depth:
+            return
+    dispatcher().notify(message)
 
 
 def sold_stocks(dataframe):
@@ -0,0 +1,109 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# Modules the dashboard imports, its own and the heavy third-party ones they use
+MODULES = ['streamlit', 'pandas', 'pyarrow', 'plotly.graph_objects', 'yfinance', 'telegram', 'firebase_admin',
+           'App_State', 'Stock_Portfoliio_Dataframe', 'Snapshot_Downloader', 'Portfolio_Journal', 'Telegram_Bot',
+           'Getting_Returns', 'Price_Store', 'Donut_Charts', 'Growth_Tables']
+
+IMPORT_TIME = '''
+import time
+start = time.perf_counter()
+import {module}
+print(time.perf_counter() - start)
+'''
+
+# Runs the app headless with streamlit.testing in a fresh interpreter, logged in or not, and prints the time to the
+# first render: the login form, or the summary drawn from the saved app state
+FIRST_RENDER = '''
+import contextlib, io, os, re, sys, time
+from streamlit.testing.v1 import AppTest
+os.chdir({data_root!r})
+os.environ['SMART_IMPULSE_BUCKET_DIR'] = {bucket_dir!r}
+start = time.perf_counter()
+app = AppTest.from_file({app!r}, default_timeout=120)
+if {logged_in!r}:
+    app.session_state['password_correct'] = True
+output = io.StringIO()
+with contextlib.redirect_stdout(output):
+    app.run()
+elapsed = time.perf_counter() - start
+match = re.search(r'First render after ([0-9.]+)s', output.getvalue())
+print(match.group(1) if match else ('' if {logged_in!r} else elapsed))
+'''
+
+
+def run_python(code):
+    result = subprocess.run([sys.executable, '-c', code], cwd=ROOT, capture_output=True, text=True)
+    lines = result.stdout.strip().splitlines()
+    if result.returncode != 0 or not lines or not lines[-1]:
+        return None
+    return float(lines[-1])
+
+
+def best_of(code, repeat):
+    timings = [run_python(code) for _ in range(repeat)]
+    timings = [timing for timing in timings if timing is not None]
+    return min(timings) if timings else None
+
+
+def write_app_state(data_dir, n_positions):
+    # Saved state of a portfolio with n_positions open lots, like the one written after an update
+    import numpy as np
+    import pandas as pd
+    from App_State import write_app_state as write
+    from Portfolio_State import PortfolioState
+
+    rng = np.random.default_rng(0)
+    snapshot = pd.DataFrame({
+        'Price': rng.uniform(1, 900, n_positions),
+        'Sector': rng.choice(['Technology', 'Healthcare', 'Energy'], n_positions),
+        'Market Cap Category': rng.choice(['Large', 'Mid', 'Small'], n_positions),
+    }, index=pd.Index([f'T{i:05d}' for i in range(n_positions)], name='Ticker'))
+    state = PortfolioState.create(snapshot, 1 / n_positions, '2024-01-02')
+    tracking = pd.DataFrame({'Total Amount': [state.total('Total Amount')], 'Investment': [state.total('Investment')]},
+                            index=pd.to_datetime(['2024-01-02']))
+    write(data_dir, '2024-01-02', state.to_dataframe(), tracking)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Import times and time to first render of the dashboard.')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--positions', type=int, default=500)
+    parser.add_argument('--history', default=os.path.join(ROOT, 'benchmarks', 'cold_start.jsonl'),
+                        help='JSON lines file each run is appended to, to follow the numbers over time')
+    args = parser.parse_args()
+
+    results = {'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'python': sys.version.split()[0], 'imports': {}}
+    print(f'{"module":>28} {"import":>9}')
+    for module in MODULES:
+        timing = best_of(IMPORT_TIME.format(module=module), args.repeat)
+        results['imports'][module] = timing
+        print(f'{module:>28} {"n/a" if timing is None else f"{timing:.3f}s":>9}')
+
+    with tempfile.TemporaryDirectory() as data_root:
+        bucket_dir = os.path.join(data_root, 'bucket')
+        os.makedirs(os.path.join(data_root, 'data'))
+        os.makedirs(bucket_dir)
+        write_app_state(os.path.join(data_root, 'data'), args.positions)
+        for name, logged_in in (('login_form', False), ('summary', True)):
+            code = FIRST_RENDER.format(data_root=data_root, bucket_dir=bucket_dir, logged_in=logged_in,
+                                       app=os.path.join(ROOT, 'streamlit_app.py'))
+            timing = best_of(code, args.repeat)
+            results[f'first_render_{name}'] = timing
+            print(f'{"first render " + name:>28} {"n/a" if timing is None else f"{timing:.3f}s":>9}')
+
+    with open(args.history, 'a') as file:
+        file.write(json.dumps(results) + '\n')
+
+
+if __name__ == '__main__':
+    main()
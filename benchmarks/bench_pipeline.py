@@ -0,0 +1,181 @@
+import argparse
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+import warnings
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import numpy as np  # noqa: E402
+import pandas as pd  # noqa: E402
+from Creating_Portfolio import excel_to_dataframe, create_portfolio, update_portfolio  # noqa: E402
+from Getting_Returns import create_mean_cumulative_returns, INDEXES  # noqa: E402
+from Growth_Tables import generate_tables  # noqa: E402
+from Price_Fetcher import PriceFetcher  # noqa: E402
+from Price_Panel import PricePanel  # noqa: E402
+from Price_Store import PriceStore, LocalPriceSource  # noqa: E402
+from Replaying_History import replay_history  # noqa: E402
+from Stock_Portfoliio_Dataframe import generate_dataframe_visualization, PortfolioView  # noqa: E402
+from Telegram_Bot import TelegramDispatcher, use_dispatcher  # noqa: E402
+from fake_bot_api import FakeBotApi  # noqa: E402
+from synthetic_data import write_snapshots, price_panel  # noqa: E402
+
+BASELINE = os.path.join(ROOT, 'benchmarks', 'baseline.json')
+
+# Differences below these are timer and allocator noise, whatever the tolerance
+MIN_DIFFERENCE = {'seconds': 0.05, 'peak_mb': 1.0}
+
+
+# Each stage does its work on the shared context and returns how many items it processed, and what they are
+def read_sheets(context):
+    context['days'] = [(os.path.basename(file_name)[:10], excel_to_dataframe(file_name))
+                       for file_name in context['file_names']]
+    return sum(len(dataframe) for _, dataframe in context['days']), 'rows'
+
+
+def create(context):
+    date, initial_dataframe = context['days'][0]
+    context['portfolio'] = create_portfolio(initial_dataframe, 1 / len(initial_dataframe), date)
+    return len(initial_dataframe), 'rows'
+
+
+def update(context):
+    portfolio = context['portfolio']
+    tracking = [(portfolio['Total Amount'].sum(), portfolio['Investment'].sum())]
+    for date, dataframe in context['days'][1:]:
+        portfolio = update_portfolio(portfolio, dataframe, date)
+        tracking.append((portfolio['Total Amount'].sum(), portfolio['Investment'].sum()))
+    context['final_portfolio'] = portfolio
+    context['tracking'] = tracking
+    return len(context['days']) - 1, 'days'
+
+
+def check_replay(context):
+    # The replay of the whole history has to end with the same portfolio and tracking as the day-by-day updates
+    state, tracking = replay_history(context['days'])
+    pd.testing.assert_frame_equal(state.to_dataframe(), context['final_portfolio'])
+    np.testing.assert_allclose(tracking[['Total Amount', 'Investment']].to_numpy(), context['tracking'], rtol=1e-12,
+                               atol=1e-8)
+
+
+def returns(context):
+    # A new store each time, so the stub provider serves every ticker like a first run. The Yahoo! Finance rate
+    # limit is lifted, it would be all the benchmark measures
+    fetcher = PriceFetcher(LocalPriceSource(context['prices']), rate=1e6, burst=1e6)
+    with tempfile.TemporaryDirectory() as directory:
+        price_store = PriceStore(directory, fetcher=fetcher)
+        stock_returns, _ = create_mean_cumulative_returns(context['final_portfolio'], price_store)
+    context['panel'] = PricePanel.from_frame(stock_returns.T)
+    fetcher.executor.shutdown()
+    return len(stock_returns), 'tickers'
+
+
+def tables(context):
+    panel = context['panel']
+    generate_tables(panel.frame(panel.dates[0], panel.dates[-1]), context['final_portfolio'])
+    return len(panel.columns), 'tickers'
+
+
+def styler(context):
+    generate_dataframe_visualization(PortfolioView(context['final_portfolio']))
+    return len(context['final_portfolio']), 'rows'
+
+
+STAGES = [('excel_to_dataframe', read_sheets), ('create_portfolio', create), ('update_portfolio', update),
+          ('create_mean_cumulative_returns', returns), ('generate_tables', tables), ('styler_rendering', styler)]
+
+
+def measure(stage, context, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        items, unit = stage(context)
+        timings.append(time.perf_counter() - start)
+    # Peak memory in a separate run, tracemalloc slows the timed ones down
+    tracemalloc.start()
+    stage(context)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {'seconds': min(timings), 'items': items, 'unit': unit, 'peak_mb': peak / 2 ** 20}
+
+
+def compare(results, baseline, tolerance):
+    # Stages slower or hungrier than the baseline by more than the tolerance
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        for key in ('seconds', 'peak_mb'):
+            if (result[key] > baseline[name][key] * (1 + tolerance)
+                    and result[key] - baseline[name][key] > MIN_DIFFERENCE[key]):
+                regressions.append(f'{name} {key}: {result[key]:.3f} vs {baseline[name][key]:.3f}')
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the portfolio pipeline on synthetic data, offline.')
+    parser.add_argument('--tickers', type=int, default=500)
+    parser.add_argument('--days', type=int, default=40)
+    parser.add_argument('--turnover', type=float, default=0.05)
+    parser.add_argument('--price-days', type=int, default=750)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--baseline', default=BASELINE)
+    parser.add_argument('--save-baseline', action='store_true', help='Store this run as the new baseline')
+    parser.add_argument('--tolerance', type=float, default=0.3,
+                        help='Allowed slowdown or memory growth against the baseline, as a fraction')
+    args = parser.parse_args()
+    config = {'tickers': args.tickers, 'days': args.days, 'turnover': args.turnover, 'price_days': args.price_days}
+
+    # Streamlit calls run in bare mode, without a browser to send the elements to, and warn about it on every call
+    logging.disable(logging.WARNING)
+    warnings.simplefilter('ignore', FutureWarning)
+    fake_bot_api = FakeBotApi()
+    dispatcher = TelegramDispatcher('0:benchmark', 1, base_url=fake_bot_api.base_url, min_interval=0, linger=0)
+    use_dispatcher(dispatcher)
+
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        context = {'file_names': write_snapshots(directory, args.tickers, args.days, args.turnover)}
+        tickers = sorted(set().union(*(pd.read_excel(file_name, usecols=['Ticker'])['Ticker'].iloc[:-1]
+                                       for file_name in context['file_names'])))
+        context['prices'] = price_panel(tickers + INDEXES, args.price_days)
+
+        print(f'{"stage":>32} {"time":>9} {"throughput":>20} {"peak":>10}')
+        for name, stage in STAGES:
+            result = measure(stage, context, args.repeat)
+            results[name] = result
+            throughput = f'{result["items"] / result["seconds"]:,.0f} {result["unit"]}/s'
+            print(f'{name:>32} {result["seconds"]:>8.3f}s {throughput:>20} {result["peak_mb"]:>8.1f}MB')
+            if stage is update:
+                check_replay(context)
+    dispatcher.close()
+    fake_bot_api.close()
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as file:
+            json.dump({'config': config, 'results': results}, file, indent=2)
+        print(f'Saved the baseline to {args.baseline}')
+        return 0
+    if not os.path.exists(args.baseline):
+        print('No baseline to compare against, store one with --save-baseline')
+        return 0
+    with open(args.baseline) as file:
+        baseline = json.load(file)
+    if baseline['config'] != config:
+        print(f'The baseline was measured with {baseline["config"]}, run with the same sizes to compare')
+        return 0
+    regressions = compare(results, baseline['results'], args.tolerance)
+    for regression in regressions:
+        print(f'Regression: {regression}')
+    if not regressions:
+        print(f'No stage regressed by more than {args.tolerance:.0%} against the baseline')
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
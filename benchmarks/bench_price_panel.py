@@ -0,0 +1,83 @@
+import argparse
+import os
+import sys
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from Getting_Returns import ReturnIndex  # noqa: E402
+from Price_Panel import PricePanel  # noqa: E402
+from synthetic_data import price_panel  # noqa: E402
+
+SECTORS = ['Technology', 'Healthcare', 'Financial', 'Energy', 'Industrials', 'Consumer Cyclical', 'Utilities']
+CAPS = ['Small', 'Medium', 'Large']
+
+
+def best_of(function, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def megabytes(n_bytes):
+    return n_bytes / 2 ** 20
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare the stock dataframe with the float32 price panel.')
+    parser.add_argument('--tickers', type=int, nargs='+', default=[1000, 5000])
+    parser.add_argument('--days', type=int, default=2520, help='trading days of history, 10 years by default')
+    parser.add_argument('--window', type=int, default=365, help='calendar days selected')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    print(f'{"tickers":>8} {"prices MB":>16} {"returns MB":>16} {"saved per 1k":>13} {"sector/cap MB":>14} '
+          f'{"filter":>9} {"window":>9}')
+    for n_tickers in args.tickers:
+        tickers = [f'T{number:05d}' for number in range(n_tickers)]
+        closes = price_panel(tickers, args.days)
+        indexes = price_panel(['^GSPC', '^IXIC', '^DJI'], args.days, late_listings=0)
+
+        # The stock dataframe the app kept before: a Date column and one float64 column per ticker
+        stock_df = closes.reset_index().rename(columns={'index': 'Date'})
+        frame_bytes = stock_df.memory_usage(deep=True).sum()
+        # Before, the return index kept float64 sums and datetime64[ns] dates
+        return_index = ReturnIndex(closes, indexes)
+        old_returns_bytes = return_index.sums.values.size * 8 + return_index.sums.days.size * 8
+
+        with tempfile.TemporaryDirectory() as directory:
+            panel = PricePanel.from_frame(closes).save(os.path.join(directory, 'prices'))
+            return_index = return_index.save(os.path.join(directory, 'returns'))
+            new_returns_bytes = return_index.sums.nbytes
+            saved = frame_bytes - panel.nbytes + old_returns_bytes - new_returns_bytes
+
+            # Portfolio frame with one lot per ticker, sector and cap as strings and as categoricals
+            rng = np.random.default_rng(0)
+            portfolio = pd.DataFrame({'Sector': rng.choice(SECTORS, n_tickers).astype(object),
+                                      'Market Cap': rng.choice(CAPS, n_tickers).astype(object)}, index=tickers)
+            object_bytes = portfolio.memory_usage(deep=True).sum()
+            categorical_bytes = portfolio.astype('category').memory_usage(deep=True).sum()
+
+            to_date = closes.index[-1].date()
+            from_date = to_date - pd.Timedelta(days=args.window)
+            filter_time = best_of(lambda: stock_df[(stock_df['Date'].dt.date >= from_date)
+                                                   & (stock_df['Date'].dt.date <= to_date)], args.repeat)
+            window_time = best_of(lambda: panel.frame(from_date, to_date), args.repeat)
+            window = panel.frame(from_date, to_date)
+            assert np.shares_memory(window.to_numpy(), panel.values)
+            del window, return_index
+
+        print(f'{n_tickers:>8} {megabytes(frame_bytes):>7.1f} -> {megabytes(panel.nbytes):<5.1f} '
+              f'{megabytes(old_returns_bytes):>7.1f} -> {megabytes(new_returns_bytes):<5.1f} '
+              f'{megabytes(saved) * 1000 / n_tickers:>10.1f} MB {megabytes(object_bytes):>6.2f} -> '
+              f'{megabytes(categorical_bytes):<5.2f} {filter_time * 1000:>7.2f}ms {window_time * 1000:>7.3f}ms')
+
+
+if __name__ == '__main__':
+    main()
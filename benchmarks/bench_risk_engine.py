@@ -0,0 +1,69 @@
+import argparse
+import os
+import sys
+import time
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from Risk_Engine import RiskEngine, PERIODS  # noqa: E402
+
+
+def recompute(returns, benchmark_returns, window):
+    # The metrics from the whole history with pandas, what each rerun would do without the engine
+    wealth = (1 + returns.fillna(0)).cumprod()
+    metrics = pd.DataFrame({
+        'Volatility': returns.std() * np.sqrt(PERIODS),
+        f'Volatility {window}d': returns.iloc[-window:].std() * np.sqrt(PERIODS),
+        'Sharpe': returns.mean() / returns.std() * np.sqrt(PERIODS),
+        'Sortino': returns.mean() / np.sqrt((np.minimum(returns, 0) ** 2).mean()) * np.sqrt(PERIODS),
+        'Max Drawdown': (wealth / np.maximum(wealth.cummax(), 1) - 1).min().clip(upper=0),
+    })
+    for benchmark in benchmark_returns.columns:
+        metrics[f'Beta {benchmark}'] = returns.apply(lambda series: series.cov(benchmark_returns[benchmark])) \
+            / benchmark_returns[benchmark].var()
+        metrics[f'Correlation {benchmark}'] = returns.corrwith(benchmark_returns[benchmark])
+    return metrics
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare a daily risk engine update with recomputing the history.')
+    parser.add_argument('--tickers', type=int, nargs='+', default=[100, 1000])
+    parser.add_argument('--days', type=int, nargs='+', default=[250, 2520])
+    parser.add_argument('--window', type=int, default=63)
+    parser.add_argument('--repeat', type=int, default=20, help='days streamed to time the update')
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    benchmarks = ['S&P 500', 'NASDAQ', 'Dow Jones']
+    print(f'{"tickers":>8} {"days":>6} {"recompute":>11} {"batch":>9} {"update":>10} {"max diff":>9}')
+    for n_tickers in args.tickers:
+        for n_days in args.days:
+            names = ['Portfolio'] + [f'T{number:05d}' for number in range(n_tickers)]
+            dates = [day.strftime('%Y-%m-%d') for day in pd.bdate_range('2000-01-03', periods=n_days + args.repeat)]
+            returns = rng.normal(0.0004, 0.02, (len(dates), len(names)))
+            benchmark_returns = rng.normal(0.0003, 0.01, (len(dates), len(benchmarks)))
+
+            start = time.perf_counter()
+            expected = recompute(pd.DataFrame(returns, columns=names), pd.DataFrame(benchmark_returns,
+                                                                                   columns=benchmarks), args.window)
+            recompute_time = time.perf_counter() - start
+
+            engine = RiskEngine(names, benchmarks, args.window)
+            start = time.perf_counter()
+            engine.extend(dates[:n_days], returns[:n_days], benchmark_returns[:n_days])
+            batch_time = time.perf_counter() - start
+            start = time.perf_counter()
+            for day in range(n_days, len(dates)):
+                engine.update(dates[day], returns[day], benchmark_returns[day])
+            update_time = (time.perf_counter() - start) / args.repeat
+
+            metrics = engine.metrics()[expected.columns]
+            difference = np.nanmax(np.abs(metrics.to_numpy() - expected.to_numpy()))
+            print(f'{n_tickers:>8} {n_days:>6} {recompute_time * 1000:>9.1f}ms {batch_time * 1000:>7.1f}ms '
+                  f'{update_time * 1000:>8.3f}ms {difference:>9.1e}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,44 @@
+import argparse
+import os
+import sys
+import tempfile
+import time
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from Creating_Portfolio import excel_to_dataframe  # noqa: E402
+from Snapshot_Reader import read_excel_snapshot  # noqa: E402
+from synthetic_data import write_sheet  # noqa: E402
+
+
+def best_of(function, file_name, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function(file_name)
+        timings.append(time.perf_counter() - start)
+    return min(timings), result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare excel_to_dataframe with read_excel_snapshot.')
+    parser.add_argument('--rows', type=int, nargs='+', default=[1000, 5000, 20000])
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    print(f'{"rows":>8} {"excel_to_dataframe":>20} {"read_excel_snapshot":>20} {"speedup":>8}')
+    with tempfile.TemporaryDirectory() as directory:
+        for n_rows in args.rows:
+            file_name = os.path.join(directory, f'{n_rows}.xlsx')
+            write_sheet(file_name, n_rows)
+            old_time, old = best_of(excel_to_dataframe, file_name, args.repeat)
+            new_time, new = best_of(read_excel_snapshot, file_name, args.repeat)
+            # Both readers must agree on everything the portfolio uses
+            pd.testing.assert_frame_equal(old[new.columns].astype({'Price': float, 'Market Cap ($M USD)': float}),
+                                          new, check_index_type=False)
+            print(f'{n_rows:>8} {old_time:>19.3f}s {new_time:>19.3f}s {old_time / new_time:>7.1f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+import json
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from Telegram_Bot import MAX_MESSAGE_LENGTH  # noqa: E402
+
+
+class FakeBotApi:
+    """Bot API server on localhost that records the messages sent to it, to run the dispatcher offline.
+
+    The first `flood` sendMessage calls are answered with flood control asking to retry after `retry_after` seconds.
+    """
+
+    def __init__(self, flood=0, retry_after=1):
+        self.messages = []
+        self.calls = 0
+        self.flood = flood
+        self.retry_after = retry_after
+        self.lock = threading.Lock()
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get('Content-Length', 0))).decode()
+                if self.headers.get('Content-Type', '').startswith('application/json'):
+                    parameters = json.loads(body or '{}')
+                else:
+                    parameters = {key: values[0] for key, values in parse_qs(body).items()}
+                method = urlparse(self.path).path.rsplit('/', 1)[-1]
+                status, response = fake._answer(method, parameters)
+                payload = json.dumps(response).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            do_GET = do_POST
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    @property
+    def base_url(self):
+        return f'http://127.0.0.1:{self.server.server_address[1]}/bot'
+
+    def _answer(self, method, parameters):
+        if method == 'getMe':
+            return 200, {'ok': True, 'result': {'id': 1, 'is_bot': True, 'first_name': 'Fake', 'username': 'fake_bot'}}
+        if method != 'sendMessage':
+            return 404, {'ok': False, 'error_code': 404, 'description': 'Not Found'}
+        with self.lock:
+            self.calls += 1
+            if self.calls <= self.flood:
+                return 429, {'ok': False, 'error_code': 429, 'parameters': {'retry_after': self.retry_after},
+                             'description': f'Too Many Requests: retry after {self.retry_after}'}
+            if len(parameters.get('text', '')) > MAX_MESSAGE_LENGTH:
+                return 400, {'ok': False, 'error_code': 400, 'description': 'Bad Request: message is too long'}
+            self.messages.append((time.monotonic(), parameters['text']))
+            chat = {'id': int(parameters['chat_id']), 'type': 'private'}
+            return 200, {'ok': True, 'result': {'message_id': len(self.messages), 'date': int(time.time()),
+                                                'chat': chat, 'text': parameters['text']}}
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
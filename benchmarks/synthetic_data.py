@@ -0,0 +1,124 @@
+import argparse
+import os
+import numpy as np
+import pandas as pd
+
+SECTORS = ['Technology', 'Healthcare', 'Energy', 'Financial Services', 'Industrials', 'Consumer Cyclical',
+           'Utilities', 'Real Estate']
+INDUSTRIES = ['Software', 'Biotechnology', 'Oil & Gas', 'Banks', 'Aerospace', 'Retail', 'Utilities', 'REIT']
+
+# Columns of the daily sheets in the smart_impulse bucket, in their order
+SHEET_COLUMNS = ['Ticker', 'Company', 'Sector', 'Industry', 'Price', 'Change (%)', 'Volume', 'Market Cap ($M USD)']
+
+
+def sheet_dataframe(tickers, prices, market_caps, sectors, industries, rng):
+    # One day in the sheet layout: '$' prices and market caps with thousands separators, and a trailing 'Summary' row
+    n_rows = len(tickers)
+    dataframe = pd.DataFrame({
+        'Ticker': tickers,
+        'Company': [f'Company {ticker}' for ticker in tickers],
+        'Sector': sectors,
+        'Industry': industries,
+        'Price': [f'${price:.2f}' for price in prices],
+        'Change (%)': rng.normal(0, 2, n_rows).round(2),
+        'Volume': rng.integers(1000, 10000000, n_rows),
+        'Market Cap ($M USD)': [f'${market_cap:,.2f}' for market_cap in market_caps],
+    }, columns=SHEET_COLUMNS)
+    dataframe = dataframe.astype(object)
+    dataframe.loc[n_rows] = ['Summary'] + [None] * (len(SHEET_COLUMNS) - 1)
+    return dataframe
+
+
+def write_sheet(file_name, n_rows, seed=0):
+    # A single snapshot with n_rows random tickers
+    rng = np.random.default_rng(seed)
+    tickers = [f'T{i:05d}' for i in range(n_rows)]
+    sheet_dataframe(tickers, rng.uniform(1, 900, n_rows), rng.lognormal(8, 2, n_rows), rng.choice(SECTORS, n_rows),
+                    rng.choice(INDUSTRIES, n_rows), rng).to_excel(file_name, index=False)
+
+
+def generate_snapshots(n_tickers, n_days, turnover=0.05, start='2024-01-02', seed=0):
+    # Yields (date, sheet dataframe) for n_days business days. Each day a `turnover` share of the list is replaced,
+    # by new tickers or by ones that left before, and prices follow a random walk with some jumps
+    rng = np.random.default_rng(seed)
+    dates = pd.bdate_range(start, periods=n_days)
+    n_changes = int(round(n_tickers * turnover))
+    n_universe = n_tickers + n_changes * max(n_days - 1, 0)
+    universe = np.array([f'T{i:05d}' for i in range(n_universe)])
+    sectors = rng.choice(SECTORS, n_universe)
+    industries = rng.choice(INDUSTRIES, n_universe)
+    shares = rng.lognormal(3, 1.5, n_universe)
+    prices = rng.uniform(5, 300, n_universe)
+
+    members = np.arange(n_tickers)
+    next_new = n_tickers
+    left = []
+    for day, date in enumerate(dates):
+        if day:
+            log_returns = rng.normal(0.0005, 0.025, n_universe)
+            jumps = rng.random(n_universe) < 0.01
+            log_returns[jumps] += rng.normal(0.05, 0.15, jumps.sum())
+            prices *= np.exp(log_returns)
+            if n_changes:
+                leaving = rng.choice(len(members), n_changes, replace=False)
+                left.extend(members[leaving].tolist())
+                members = np.delete(members, leaving)
+                # A third of the entries are tickers coming back, the rest are new
+                n_back = min(n_changes // 3, len(left) - n_changes)
+                back = [left.pop(rng.integers(len(left) - n_changes)) for _ in range(max(n_back, 0))]
+                new = list(range(next_new, next_new + n_changes - len(back)))
+                next_new += len(new)
+                members = np.concatenate([members, back, new]).astype(np.int64)
+        order = rng.permutation(members)
+        yield date, sheet_dataframe(universe[order].tolist(), prices[order], (prices * shares)[order], sectors[order],
+                                    industries[order], rng)
+
+
+def write_snapshots(directory, n_tickers, n_days, turnover=0.05, start='2024-01-02', seed=0):
+    # Writes the daily sheets as YYYY-MM-DD.xlsx, the names the downloader keeps, and returns their paths
+    os.makedirs(directory, exist_ok=True)
+    file_names = []
+    for date, dataframe in generate_snapshots(n_tickers, n_days, turnover, start, seed):
+        file_name = os.path.join(directory, f'{date:%Y-%m-%d}.xlsx')
+        dataframe.to_excel(file_name, index=False)
+        file_names.append(file_name)
+    return file_names
+
+
+def price_panel(tickers, n_days, start='2020-01-02', seed=0, late_listings=0.2):
+    # Close prices (business days x tickers). A `late_listings` share of the tickers only starts trading partway
+    # through, and a few days are missing here and there, like in the Yahoo! Finance histories
+    rng = np.random.default_rng(seed)
+    dates = pd.bdate_range(start, periods=n_days)
+    log_returns = rng.normal(0.0003, 0.02, (n_days, len(tickers)))
+    closes = rng.uniform(5, 300, len(tickers)) * np.exp(np.cumsum(log_returns, axis=0))
+    late = rng.random(len(tickers)) < late_listings
+    first_days = rng.integers(0, max(1, n_days // 2), len(tickers))
+    closes[np.arange(n_days)[:, None] < np.where(late, first_days, 0)] = np.nan
+    closes[rng.random(closes.shape) < 0.001] = np.nan
+    return pd.DataFrame(closes, index=dates, columns=list(tickers))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Write synthetic daily snapshots and close prices.')
+    parser.add_argument('directory', help='Where to write the sheets, e.g. bucket/smart_impulse for a LocalBucket')
+    parser.add_argument('--tickers', type=int, default=500)
+    parser.add_argument('--days', type=int, default=60)
+    parser.add_argument('--turnover', type=float, default=0.05)
+    parser.add_argument('--start', default='2024-01-02')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--prices', help='Also write close prices for every ticker and index to this CSV file')
+    args = parser.parse_args()
+
+    file_names = write_snapshots(args.directory, args.tickers, args.days, args.turnover, args.start, args.seed)
+    print(f'Wrote {len(file_names)} snapshots to {args.directory}')
+    if args.prices:
+        tickers = sorted(set().union(*(pd.read_excel(file_name, usecols=['Ticker'])['Ticker'].iloc[:-1]
+                                       for file_name in file_names)))
+        panel = price_panel(tickers + ['^GSPC', '^IXIC', '^DJI'], 750, seed=args.seed)
+        panel.to_csv(args.prices)
+        print(f'Wrote prices for {len(panel.columns)} tickers to {args.prices}')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,16 +1,13 @@
+import time
+
+# Measured from the first line, so the time to first render includes the imports
+script_start = time.perf_counter()
+
 import os
-from firebase_admin import credentials, storage, initialize_app, _apps, get_app
-import streamlit as st
-from Creating_Portfolio import excel_to_dataframe, create_portfolio, update_portfolio
-import pandas as pd
-import math
-import plotly.graph_objects as go
-from datetime import timedelta
-from Donut_Charts import plot_charts
-from Growth_Tables import generate_tables
-from Stock_Portfoliio_Dataframe import generate_summarized_visualization, generate_dataframe_visualization
-from Getting_Returns import create_mean_cumulative_returns
 import hmac
+from datetime import date, timedelta
+import streamlit as st
+from Instrumentation import new_run, stage
 
 # Page Settings
 st.set_page_config(
@@ -39,6 +36,8 @@ def check_password():
             st.secrets.passwords[st.session_state["username"]],
         ):
             st.session_state["password_correct"] = True
+            # Admins listed in the secrets also see the instrumentation panel
+            st.session_state["is_admin"] = st.session_state["username"] in st.secrets.get("admins", [])
             del st.session_state["password"]  # Don't store the username or password.
             del st.session_state["username"]
         else:
@@ -58,6 +57,8 @@ def check_password():
 if not check_password():
     st.stop()
 
+new_run()
+
 # Set the title that appears at the top of the page and summary of the project.
 '''
 # :earth_americas: Portfolio Tracking for Smart Impulse
@@ -71,103 +72,168 @@ and portfolio distribution, with real-time updates delivered through Telegram.
 '''
 
 
-# Cache the Firebase initialization to avoid multiple initializations
-@st.cache_resource(ttl=timedelta(hours=24))
-def init_firebase():
-    if not _apps:  # Check if no Firebase app is initialized
-        firebase_credentials = dict(st.secrets["firebase"]['my_project_settings'])
-        cred = credentials.Certificate(firebase_credentials)
-        return initialize_app(cred, {
-            'storageBucket': 'smt-bot-staging'
-        })
-    else:
-        return get_app()
-
-
-# Initialize Firebase
-firebase_app = init_firebase()
-
-# Access the Storage bucket
-bucket = storage.bucket()
-
 # Folder and local paths
 folder_path = 'smart_impulse'
 data_dir = 'data'
 csv_file_path = os.path.join(data_dir, 'smart_portfolio.csv')
 tracking_file_path = os.path.join(data_dir, 'returns.csv')
 
+# With SMART_IMPULSE_INGESTION=daemon the app only reads the state published by Ingestion_Daemon.py
+read_only = os.environ.get('SMART_IMPULSE_INGESTION') == 'daemon'
+
 # Ensure the 'data' directory exists
 if not os.path.exists(data_dir):
     os.makedirs(data_dir)
 
-# Check if the smart portfolio CSV already exists
-if os.path.exists(csv_file_path):
-    # Load the existing portfolio from CSV
-    smart_portfolio = pd.read_csv(csv_file_path, index_col=0)
-    smart_tracking = pd.read_csv(tracking_file_path, index_col=0)
-    porfolio_created = True
-    print("Smart portfolio loaded from CSV.")
-else:
-    smart_portfolio = pd.DataFrame()  # Start with an empty DataFrame
-    # Create a new DataFrame to store filename, smart_amounts, and smart_investments
-    smart_tracking = pd.DataFrame(columns=['Total Amount', 'Investment'])
-    porfolio_created = False
-
-# List all files in the specified folder in Firebase Storage
-blobs = list(bucket.list_blobs(prefix=folder_path))
-
-# Get the list of files already downloaded in the "data" directory
-local_files = os.listdir(data_dir)
-
-# Download files not in the "data" directory
-for blob in blobs:
-    original_filename = os.path.basename(blob.name)
-
-    if original_filename:  # Skip directories or empty filenames
-        new_filename = original_filename[-15:]
-
-        # Download only if the file does not exist locally
-        if new_filename not in local_files:
-            local_path = os.path.join(data_dir, new_filename)
-            blob.download_to_filename(local_path)
-            print(f'File downloaded to {local_path}')
-            new_dataframe = excel_to_dataframe(local_path)
-
-            # Create or update the portfolio
-            if smart_portfolio.empty:
-                smart_portfolio = create_portfolio(new_dataframe, 1 / len(new_dataframe), new_filename[:10])
-            else:
-                smart_portfolio = update_portfolio(smart_portfolio, new_dataframe, new_filename[:10])
-            smart_tracking.loc[pd.to_datetime(new_filename[:10])] = [smart_portfolio['Total Amount'].sum(),
-                                                                     smart_portfolio['Investment'].sum()]
-            # Save the portfolio to CSV after every update
-            smart_portfolio.to_csv(csv_file_path)
-            smart_tracking.to_csv(tracking_file_path)
-            print(f'Smart portfolio updated and saved to {csv_file_path}')
-            local_files = os.listdir(data_dir)
+# First render from the state saved by the last update, before the heavy modules are imported
+from App_State import read_app_state
+from Stock_Portfoliio_Dataframe import generate_summarized_visualization, generate_dataframe_visualization, \
+    portfolio_view
+
+app_state = read_app_state(data_dir)
+summary = st.empty()
+if app_state is not None:
+    with summary.container():
+        generate_summarized_visualization(portfolio_view(app_state['portfolio'], app_state.get('version', 0)))
+    print(f'First render after {time.perf_counter() - script_start:.3f}s')
 
-print('All missing files have been downloaded.')
+import math
+import pandas as pd
+from Snapshot_Downloader import DownloadError, LocalBucket, firebase_bucket
+from Snapshot_Reader import SnapshotError
+from Ingestion import SharedIngestion, PortfolioSnapshot
+from Telegram_Bot import sold_stocks, bought_stocks, suppressed
+from Donut_Charts import plot_charts, plot_exposure_drift, portfolio_exposure
+from Growth_Tables import generate_tables
+from Risk_Tables import generate_risk_tables
+from Getting_Returns import create_return_index, ReturnIndex, INDEXES
+from Price_Panel import PricePanel, remove_old_panels
+from Price_Store import PriceStore, shared_fetcher
+from Chart_Downsampling import downsample
+from Risk_Engine import RiskEngine, update_risk_engine
+
+
+# Cache the Firebase initialization to avoid multiple initializations
+@st.cache_resource(ttl=timedelta(hours=24))
+def init_firebase():
+    return firebase_bucket(st.secrets["firebase"]['my_project_settings'])
+
+
+# One portfolio per server process shared by every session, the bucket is checked for new files at most every
+# five minutes and only one session (or process) ingests them while the others wait for its snapshot
+@st.cache_resource
+def shared_ingestion():
+    return SharedIngestion(data_dir, csv_file_path, tracking_file_path, min_interval=300,
+                           on_sold=sold_stocks, on_bought=bought_stocks, suppressed=suppressed)
 
-generate_summarized_visualization(smart_portfolio)
 
+# Download the missing files in parallel and update the portfolio with them in date order
+download_progress = st.empty()
 
-# Cache stock data to avoid multiple Yahoo! Finance requests
-@st.cache_data(ttl=timedelta(hours=24))
-def get_stock_data():
-    # Generate returns and cumulative returns
-    smart_returns, smart_cumulative_returns = create_mean_cumulative_returns(smart_portfolio)
-    stock_df = smart_returns.T.reset_index()
-    stock_df = stock_df.rename(columns={'index': 'Date'})
-    stock_df['Date'] = pd.to_datetime(stock_df['Date'])
-    return stock_df, smart_cumulative_returns
 
+def show_download_progress(done, total, new_filename):
+    download_progress.progress(done / total, text=f'Updated the portfolio with {new_filename} ({done}/{total})')
 
-# Getting the stock data DataFrames
-stock_df, stock_returns = get_stock_data()
+
+if read_only:
+    # The ingestion daemon (python Ingestion_Daemon.py --watch) keeps the app state up to date
+    if app_state is None:
+        st.info('The portfolio has not been published yet, start the ingestion daemon')
+        st.stop()
+    snapshot = PortfolioSnapshot(app_state.get('version', 0), app_state['last_date'], app_state['portfolio'],
+                                 app_state['tracking'], app_state.get('exposure'))
+else:
+    # A local directory can stand in for the Storage bucket to run the app offline
+    local_bucket_dir = os.environ.get('SMART_IMPULSE_BUCKET_DIR')
+    bucket = LocalBucket(local_bucket_dir) if local_bucket_dir else init_firebase()
+    ingestion = shared_ingestion()
+    try:
+        with stage('ingestion'):
+            snapshot = ingestion.refresh(bucket, folder_path, progress=show_download_progress)
+    except (SnapshotError, DownloadError) as error:
+        # The bad file is left out of the data directory, so it is downloaded and checked again on the next run
+        st.error(f'The portfolio could not be updated: {error}')
+        snapshot = ingestion.current()
+        if snapshot is None:
+            st.stop()
+    download_progress.empty()
+smart_portfolio = snapshot.portfolio if snapshot.portfolio is not None else pd.DataFrame()
+smart_tracking = snapshot.tracking
+# Daily exposure of the open positions, only the last day for a state published before it was kept
+exposure = snapshot.exposure if snapshot.exposure is not None else portfolio_exposure(smart_portfolio,
+                                                                                        snapshot.last_date)
+
+# Redraw the summary if the update published a new version since the first render
+if app_state is None or app_state.get('version', 0) != snapshot.version:
+    with summary.container():
+        generate_summarized_visualization(portfolio_view(smart_portfolio, snapshot.version))
+
+
+# Prices and returns are built once a day per portfolio version and saved as memory-mapped panels, which every
+# session and server process maps instead of holding its own copy
+panels_dir = os.path.join(data_dir, 'panels')
+
+
+@st.cache_resource(ttl=timedelta(hours=24), max_entries=2)
+def get_stock_data(data_key):
+    price_dir = os.path.join(panels_dir, data_key, 'prices')
+    returns_dir = os.path.join(panels_dir, data_key, 'returns')
+    price_panel, meta = PricePanel.open(price_dir)
+    smart_return_index = ReturnIndex.open(returns_dir)
+    if price_panel is None or smart_return_index is None:
+        # Generate returns and cumulative returns
+        price_store = PriceStore(os.path.join(data_dir, 'prices'), fetcher=shared_fetcher())
+        smart_returns, smart_return_index = create_return_index(smart_portfolio, price_store)
+        smart_return_index = smart_return_index.save(returns_dir)
+        meta = {'errors': sorted(price_store.errors)}
+        price_panel = PricePanel.from_frame(smart_returns.T).save(price_dir, meta)
+        remove_old_panels(panels_dir, keep={data_key})
+    return price_panel, smart_return_index, meta['errors']
+
+
+# Risk metrics are kept by an engine saved next to the journal, which only takes in the days and stocks added since
+risk_engine_path = os.path.join(data_dir, 'risk_engine.pkl')
+
+
+@st.cache_resource(ttl=timedelta(hours=24), max_entries=2)
+def get_risk_metrics(data_key, _tickers):
+    # Closes are read from the price store, get_stock_data has brought them up to date
+    price_store = PriceStore(os.path.join(data_dir, 'prices'), fetcher=shared_fetcher())
+    closes = price_store.closes(list(_tickers))
+    index_closes = price_store.closes(INDEXES).rename(columns=ReturnIndex.INDEX_NAMES)
+    engine = update_risk_engine(RiskEngine.load(risk_engine_path), smart_tracking, closes, index_closes)
+    engine.save(risk_engine_path)
+    return engine.metrics(), engine.benchmarks
+
+
+# Charts are reduced to at most this many points per series before they are sent to the browser
+chart_points = 500
+
+
+# Cached per chart, period and selection. The data key is part of it so new data is not hidden
+@st.cache_data(ttl=timedelta(hours=24), max_entries=64)
+def downsample_chart(chart, period, selection, data_key, _dataframe, series_name, value_name):
+    return downsample(_dataframe, chart_points, series_name, value_name)
+
+
+def line_chart(chart, period, selection, dataframe, series_name='Series', value_name='Value'):
+    with stage(f'{chart} chart', rows=dataframe.size):
+        chart_data, dropped = downsample_chart(chart, period, selection, data_key, dataframe, series_name, value_name)
+        st.line_chart(chart_data, x='Date', y=value_name, color=series_name)
+    if dropped:
+        st.caption(f'Showing {len(chart_data):,} of {len(chart_data) + dropped:,} points ({dropped:,} left out)')
+
+
+# Getting the price panel and the return index, prices are refreshed daily
+data_key = f'{snapshot.version}-{date.today().isoformat()}'
+with stage('stock data'):
+    price_panel, return_index, failed_tickers = get_stock_data(data_key)
+if failed_tickers:
+    st.warning(f"No prices could be fetched for {', '.join(failed_tickers)}")
 
 # Timeframe selection
-min_date = stock_df['Date'].min().date()
-max_date = stock_df['Date'].max().date()
+min_date = price_panel.dates[0].date()
+max_date = price_panel.dates[-1].date()
 
 period_options = {
     '1 day': timedelta(days=1),
@@ -191,22 +257,21 @@ to_date = max_date
 
 st.write(f"Displaying data from {from_date} to {to_date}")
 
-# Filtering DataFrame
-filtered_stock_df = stock_df[(stock_df['Date'].dt.date >= from_date) & (stock_df['Date'].dt.date <= to_date)]
-filtered_stock_returns = stock_returns[(stock_returns.index >= from_date) & (stock_returns.index <= to_date)]
-tickers = stock_df.columns[1:]
+# Portfolio and indexes rebased to 0 at the start of the period
+filtered_stock_returns = return_index.window(from_date, to_date)
+tickers = price_panel.columns
 
 if not len(tickers):
     st.warning("No stocks available to select")
 
 selected_stocks = st.multiselect('Which stocks would you like to view?', tickers, [])
 
-if selected_stocks:
-    filtered_stock_df = filtered_stock_df[['Date'] + selected_stocks]
+# Prices of the period, a view of the panel unless some stocks are selected
+filtered_stock_df = price_panel.frame(from_date, to_date, selected_stocks or None)
 
 # Stock Prices Line Chart
 st.header('Stock Prices over Time', divider='gray')
-st.line_chart(filtered_stock_df.set_index('Date'))
+line_chart('prices', selected_period, tuple(selected_stocks), filtered_stock_df, 'Ticker', 'Price')
 
 # Returns of the selected stocks
 if selected_stocks:
@@ -228,18 +293,41 @@ if selected_stocks:
             st.metric(label=f'{ticker} Price', value=f'{last_price:,.2f}', delta=growth, delta_color=delta_color)
 
 # Top 10 Tables
-generate_tables(filtered_stock_df)
+with stage('growth tables', rows=len(filtered_stock_df.columns)):
+    generate_tables(filtered_stock_df, smart_portfolio)
 
 # Backtracking Graph
 st.header('Backtracking Portfolio vs Main Indexes', divider='gray')
-st.line_chart(filtered_stock_returns)
+line_chart('backtracking', selected_period, (), filtered_stock_returns, 'Series', 'Cumulative Return')
 
 # Print the portfolio on the dataframe
-generate_dataframe_visualization(smart_portfolio)
+with stage('portfolio table', rows=len(smart_portfolio)):
+    generate_dataframe_visualization(portfolio_view(smart_portfolio, snapshot.version))
 
 # Show Graph with the Tracking
 st.header(f'Tracking Portfolio Performance', divider='gray')
-st.line_chart(smart_tracking)
+line_chart('tracking', None, (), smart_tracking.rename_axis('Date'), 'Series', 'Amount')
+
+# Volatility, drawdown, Sharpe and Sortino ratios, beta and correlation with the indexes
+with stage('risk metrics', rows=len(tickers)):
+    risk_metrics, benchmarks = get_risk_metrics(data_key, tuple(tickers))
+generate_risk_tables(risk_metrics, smart_portfolio, benchmarks)
+
+# Plot Market Sector and Cap Distribution of the open positions, and how it drifted over the period
+with stage('donut charts'):
+    plot_charts(exposure)
+    plot_exposure_drift(exposure, from_date, to_date)
+
+# Results of the last strategy sweep (python Strategy_Sweep.py), if one was run
+from Strategy_Sweep import read_sweep
+
+sweep = read_sweep(os.path.join(data_dir, 'sweep'))
+if sweep is not None:
+    from Sweep_Heatmap import plot_sweep_heatmap
+
+    plot_sweep_heatmap(sweep[0])
+
+if st.session_state.get('is_admin', False):
+    from Admin_Panel import show_instrumentation_panel
 
-# Plot Market Sector and Cap Distribution
-plot_charts(smart_portfolio)
+    show_instrumentation_panel()
@@ -0,0 +1,55 @@
+import os
+import sys
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from Price_Store import PriceStore, LocalPriceSource  # noqa: E402
+
+DATES = pd.bdate_range('2024-01-01', periods=10)
+CLOSES = pd.DataFrame({'A': np.arange(10, 20.0), 'B': np.arange(30, 40.0)}, index=DATES)
+
+
+def update(directory, close_prices, tickers=('A', 'B')):
+    source = LocalPriceSource(close_prices)
+    store = PriceStore(str(directory), source, max_age=0)
+    errors = store.update(list(tickers))
+    return store, source, errors
+
+
+def test_intraday_close_is_overwritten_without_a_full_fetch(tmp_path):
+    partial = CLOSES.iloc[:6].copy()
+    partial.iloc[-1] += 0.37
+    update(tmp_path, partial)
+    store, source, errors = update(tmp_path, CLOSES)
+    assert errors == {}
+    assert source.requests == [(['A', 'B'], DATES[4])]
+    np.testing.assert_allclose(store.closes(['A', 'B']).to_numpy(), CLOSES.to_numpy())
+
+
+def test_adjusted_history_is_fetched_again(tmp_path):
+    update(tmp_path, CLOSES.iloc[:6])
+    adjusted = CLOSES.copy()
+    adjusted['A'] /= 2
+    store, source, errors = update(tmp_path, adjusted)
+    assert errors == {}
+    assert source.requests == [(['A', 'B'], DATES[4]), (['A'], None)]
+    np.testing.assert_allclose(store.closes(['A'])['A'].to_numpy(), adjusted['A'].to_numpy())
+
+
+def test_delisted_ticker_keeps_its_history_and_is_reported(tmp_path):
+    update(tmp_path, CLOSES)
+    delisted = CLOSES.copy()
+    delisted['B'] = np.nan
+    for _ in range(3):
+        store, _, errors = update(tmp_path, delisted)
+        assert set(errors) == {'B'}
+        assert len(store.history('B')[0]) == len(DATES)
+
+
+def test_missing_last_stored_day_keeps_the_history(tmp_path):
+    update(tmp_path, CLOSES)
+    store, _, errors = update(tmp_path, CLOSES.iloc[:-1])
+    assert set(errors) == {'A', 'B'}
+    assert len(store.history('A')[0]) == len(DATES)